@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+
+# 🖼 АВАТАРЫ
+# Аватар в настройках - имя встроенной картинки ("default", "bot", имя
+# характера) или путь к своей. Встроенные собраны в атлас при сборке
+# (tools/build_atlas.py): одна текстура на все. Свои картинки уменьшаются
+# до миниатюры один раз, миниатюра хранится на диске под ключом из пути,
+# размера и времени изменения файла - замена картинки даёт новый ключ.
+# Модуль только решает, откуда брать картинку; загрузка и текстуры - в UI.
+
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "avatars")
+SOURCE_DIR = os.path.join(ASSET_DIR, "src")
+ATLAS_NAME = "avatars"
+THUMB_DIR = "chaiclone_thumbs"
+# Сторона миниатюры и картинки в атласе, пикселей
+THUMB_SIZE = 96
+USER_AVATAR = "default"
+AI_AVATAR = "bot"
+
+class AvatarCatalog:
+    def __init__(self, asset_dir=ASSET_DIR, thumb_dir=THUMB_DIR, thumb_size=THUMB_SIZE):
+        self.asset_dir = asset_dir
+        self.thumb_dir = thumb_dir
+        self.thumb_size = thumb_size
+        self.atlas_path = os.path.join(asset_dir, f"{ATLAS_NAME}.atlas")
+        self.atlas = self.read_atlas()
+    
+    def read_atlas(self):
+        # {"avatars-0.png": {"bot": [x, y, w, h], ...}}; без атласа (не собран) - пусто
+        try:
+            with open(self.atlas_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def builtin_names(self):
+        names = {name for regions in self.atlas.values() for name in regions}
+        source_dir = os.path.join(self.asset_dir, "src")
+        if os.path.isdir(source_dir):
+            names.update(os.path.splitext(name)[0] for name in os.listdir(source_dir) if name.endswith(".png"))
+        return sorted(names)
+    
+    def resolve(self, avatar):
+        # -> ("atlas", страница, (x, y, w, h)) | ("file", путь) | ("thumb", миниатюра, исходник) | None
+        for page, regions in self.atlas.items():
+            if avatar in regions:
+                return ("atlas", os.path.join(self.asset_dir, page), tuple(regions[avatar]))
+        source = os.path.join(self.asset_dir, "src", f"{avatar}.png")
+        if os.path.exists(source):
+            # Атлас не собран (запуск из исходников) - встроенная картинка отдельно
+            return ("file", source)
+        if not os.path.isfile(avatar):
+            return None
+        return ("thumb", self.thumb_path(avatar), avatar)
+    
+    def thumb_path(self, source):
+        stat = os.stat(source)
+        key = f"{os.path.abspath(source)}:{stat.st_size}:{stat.st_mtime_ns}:{self.thumb_size}"
+        return os.path.join(self.thumb_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".png")
+    
+    def stats(self):
+        count = 0
+        size = 0
+        if os.path.isdir(self.thumb_dir):
+            for name in os.listdir(self.thumb_dir):
+                count += 1
+                size += os.path.getsize(os.path.join(self.thumb_dir, name))
+        return {"atlas": bool(self.atlas), "thumbnails": count, "thumbnail_bytes": size}
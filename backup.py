@@ -0,0 +1,298 @@
+import gzip
+import io
+import json
+import os
+import threading
+import time
+
+from stats import merge_rows
+
+# 💾 РЕЗЕРВНЫЕ КОПИИ
+# Экспорт и импорт чатов, статистики и настроек персонажа потоком JSONL:
+# одна запись - одна строка {"type": ...}, по желанию сжатая gzip. История
+# читается и пишется пачками по первичному ключу, поэтому память не зависит
+# от числа сообщений, а лок базы держится только на время одной пачки.
+# Работа идёт в фоновом потоке; прогресс и итог приходят в колбэки (из этого
+# потока - UI сам переносит их в главный).
+
+BACKUP_FORMAT = "chaiclone-backup"
+BACKUP_VERSION = 1
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Разделы конфига в копии; ключи API и пароль администратора в файл не попадают
+CONFIG_SECTIONS = ("theme", "ai_character", "user_profile", "cloud_services", "response_cache",
+                   "requests", "router", "context", "sessions")
+
+class BackupCancelled(Exception):
+    pass
+
+def export_config(data):
+    config = {key: data[key] for key in CONFIG_SECTIONS if key in data}
+    if "cloud_services" in config:
+        config["cloud_services"] = {
+            name: {key: value for key, value in service.items() if key != "api_key"}
+            for name, service in config["cloud_services"].items()
+        }
+    return config
+
+def open_writer(path, compress):
+    if compress:
+        # Средний уровень сжатия: текст жмётся почти так же, а экспорт в разы быстрее
+        return gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+    return open(path, "w", encoding="utf-8")
+
+def open_reader(path):
+    # Сжатие определяется по содержимому, а не по расширению.
+    # raw - сам файл: по его позиции считается прогресс
+    raw = open(path, "rb")
+    compressed = raw.read(2) == GZIP_MAGIC
+    raw.seek(0)
+    if compressed:
+        return raw, gzip.open(raw, "rt", encoding="utf-8")
+    return raw, io.TextIOWrapper(raw, encoding="utf-8")
+
+class BackupJob:
+    # Экспорт или импорт в фоновом потоке:
+    #   job = BackupJob(exporter.run, on_progress, on_done, on_error); job.start()
+    # on_progress(done, total) - доля работы; on_done(summary); on_error(exception)
+    def __init__(self, work, on_progress=None, on_done=None, on_error=None):
+        self.work = work
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancel_event = threading.Event()
+        self.thread = None
+    
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="backup", daemon=True)
+        self.thread.start()
+    
+    def cancel(self):
+        self.cancel_event.set()
+    
+    def progress(self, done, total):
+        if self.cancel_event.is_set():
+            raise BackupCancelled("Операция отменена")
+        if self.on_progress is not None:
+            self.on_progress(done, total)
+    
+    def run(self):
+        try:
+            summary = self.work(self.progress)
+        except Exception as e:
+            if self.on_error is not None:
+                self.on_error(e)
+            return
+        if self.on_done is not None:
+            self.on_done(summary)
+
+class Exporter:
+    # Файл с расширением .gz сжимается
+    def __init__(self, history, config_data, path, chunk_size=1000):
+        self.history = history
+        self.config_data = config_data
+        self.path = path
+        self.compress = path.endswith(".gz")
+        self.chunk_size = chunk_size
+    
+    def query(self, sql, params=()):
+        with self.history.lock:
+            return self.history.connection.execute(sql, params).fetchall()
+    
+    def run(self, progress):
+        total = self.history.count()
+        written = 0
+        # Пишем во временный файл: оборванный экспорт не затрёт прежнюю копию
+        tmp_path = self.path + ".tmp"
+        started = time.perf_counter()
+        try:
+            with open_writer(tmp_path, self.compress) as f:
+                def write(record):
+                    f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+                    f.write("\n")
+                
+                write({"type": "header", "format": BACKUP_FORMAT, "version": BACKUP_VERSION,
+                       "created_at": time.time(), "messages": total})
+                write({"type": "config", "data": export_config(self.config_data)})
+                for row in self.history.list_sessions():
+                    write(dict(row, type="session"))
+                
+                # Сообщения - пачками по первичному ключу
+                last_id = 0
+                while True:
+                    rows = self.query(
+                        "SELECT id, session_id, is_user, text, created_at FROM messages WHERE id > ? ORDER BY id LIMIT ?",
+                        (last_id, self.chunk_size)
+                    )
+                    if not rows:
+                        break
+                    for row in rows:
+                        write({"type": "message", "session": row[1], "is_user": bool(row[2]),
+                               "text": row[3], "created_at": row[4]})
+                    last_id = rows[-1][0]
+                    written += len(rows)
+                    progress(written, total)
+                
+                for row in self.query("SELECT hour, persona, messages, replies, errors, chars_in, chars_out, "
+                                      "latency_ms FROM stats_hourly"):
+                    write({"type": "stats_hourly", "row": list(row)})
+                for row in self.query("SELECT persona, bucket, count FROM stats_latency"):
+                    write({"type": "stats_latency", "row": list(row)})
+                write({"type": "end", "messages": written})
+            # Последняя проверка отмены - до замены: после неё копия уже записана
+            progress(total, total)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return {"path": self.path, "messages": written, "bytes": os.path.getsize(self.path),
+                "seconds": round(time.perf_counter() - started, 2)}
+
+class Importer:
+    # Чаты из копии добавляются как новые; чаты, уже перенесённые раньше (тот же
+    # uid), пропускаются, так что повторный импорт ничего не удваивает.
+    # Сообщения пишутся пачками, чтобы не держать лок базы; при отмене или
+    # ошибке созданные чаты удаляются вместе с сообщениями. uid ставится
+    # последним шагом - оборванный импорт не помечает чаты как перенесённые.
+    # Настройки персонажа и темы возвращаются в итоге - применяет их вызывающий
+    def __init__(self, history, path, chunk_size=1000):
+        self.history = history
+        self.path = path
+        self.chunk_size = chunk_size
+    
+    def run(self, progress):
+        total = os.path.getsize(self.path)
+        sessions = {}
+        uids = {}
+        skipped = 0
+        batch = []
+        hourly = []
+        latency = []
+        summary = {"path": self.path, "sessions": 0, "skipped": 0, "messages": 0, "stats": False, "config": {}}
+        started = time.perf_counter()
+        
+        try:
+            raw, stream = open_reader(self.path)
+            with raw, stream:
+                header = json.loads(stream.readline() or "{}")
+                if header.get("format") != BACKUP_FORMAT:
+                    raise ValueError(f"{self.path}: не резервная копия Chai Clone")
+                if header.get("version", 0) > BACKUP_VERSION:
+                    raise ValueError(f"{self.path}: копия из более новой версии приложения")
+                
+                for line in stream:
+                    record = json.loads(line)
+                    kind = record.get("type")
+                    if kind == "message":
+                        session_id = sessions.get(record["session"])
+                        if session_id is None:
+                            continue
+                        batch.append((1 if record["is_user"] else 0, record["text"], record["created_at"], session_id))
+                        if len(batch) >= self.chunk_size:
+                            self.insert_messages(batch)
+                            summary["messages"] += len(batch)
+                            batch = []
+                            # Прогресс - по прочитанной части файла (для gzip - сжатой)
+                            progress(raw.tell(), total)
+                    elif kind == "session":
+                        # В копиях без uid чат узнаётся по времени копии и номеру в ней
+                        uid = record.get("uid") or f"{header.get('created_at')}:{record['id']}"
+                        if self.session_exists(uid):
+                            skipped += 1
+                            continue
+                        session_id = self.create_session(record["title"], record.get("persona"))
+                        sessions[record["id"]] = session_id
+                        uids[session_id] = uid
+                        summary["sessions"] += 1
+                    elif kind == "config":
+                        data = record.get("data", {})
+                        summary["config"] = {key: data[key] for key in ("theme", "ai_character") if key in data}
+                    elif kind == "stats_hourly":
+                        hourly.append(record["row"])
+                    elif kind == "stats_latency":
+                        latency.append(record["row"])
+                
+                if batch:
+                    self.insert_messages(batch)
+                    summary["messages"] += len(batch)
+            progress(total, total)
+            
+            summary["skipped"] = skipped
+            if not skipped:
+                # Вся копия новая - её сводки со временем ответов и ошибками переносятся как есть
+                summary["stats"] = bool(hourly or latency)
+            else:
+                # Часть чатов уже была: сводки копии их учитывают, поэтому только
+                # счётчики новых сообщений, как при первой миграции сводок
+                hourly = self.message_rollups(uids)
+                latency = []
+            # Сводки - часть импорта: не записались они - не остаётся и чатов
+            self.finish(uids, hourly, latency)
+        except BaseException:
+            self.remove_sessions(uids)
+            raise
+        
+        summary["seconds"] = round(time.perf_counter() - started, 2)
+        return summary
+    
+    def session_exists(self, uid):
+        with self.history.lock:
+            return self.history.connection.execute("SELECT 1 FROM sessions WHERE uid = ?", (uid,)).fetchone() is not None
+    
+    def create_session(self, title, persona):
+        # Без uid до конца импорта
+        now = time.time()
+        with self.history.lock:
+            cursor = self.history.connection.execute(
+                "INSERT INTO sessions (title, persona, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (title, json.dumps(persona, ensure_ascii=False) if persona else None, now, now)
+            )
+            self.history.connection.commit()
+            return cursor.lastrowid
+    
+    def insert_messages(self, batch):
+        with self.history.lock:
+            self.history.connection.executemany(
+                "INSERT INTO messages (is_user, text, created_at, session_id) VALUES (?, ?, ?, ?)", batch
+            )
+            self.history.connection.commit()
+    
+    def remove_sessions(self, session_ids):
+        for session_id in session_ids:
+            self.history.delete_session(session_id)
+    
+    def message_rollups(self, session_ids):
+        if not session_ids:
+            return []
+        placeholders = ",".join("?" for _ in session_ids)
+        with self.history.lock:
+            return self.history.connection.execute(
+                "SELECT CAST(created_at / 3600 AS INTEGER), '', SUM(is_user), SUM(1 - is_user), 0, "
+                "SUM(CASE WHEN is_user THEN length(text) ELSE 0 END), "
+                f"SUM(CASE WHEN is_user THEN 0 ELSE length(text) END), 0 FROM messages WHERE session_id IN ({placeholders}) "
+                "GROUP BY CAST(created_at / 3600 AS INTEGER)",
+                list(session_ids)
+            ).fetchall()
+    
+    def finish(self, uids, hourly, latency):
+        # Одной транзакцией: uid чатов, время последнего сообщения (чтобы импортированные
+        # чаты встали в списке по порядку) и сводки - сотни строк даже за годы
+        connection = self.history.connection
+        with self.history.lock:
+            try:
+                for session_id, uid in uids.items():
+                    connection.execute(
+                        "UPDATE sessions SET uid = ?, updated_at = COALESCE("
+                        "(SELECT MAX(created_at) FROM messages WHERE session_id = ?), updated_at) WHERE id = ?",
+                        (uid, session_id, session_id)
+                    )
+                merge_rows(connection, hourly, latency)
+            except BaseException:
+                # Откатываем uid и сводки; сами чаты удалит run()
+                connection.rollback()
+                raise
@@ -4,12 +4,15 @@ package.name = chaiclone
 package.domain = org.chaiclone
 
 source.dir = .
-source.include_exts = py,png,jpg,kv,atlas,json
+source.include_exts = py,png,jpg,kv,atlas,json,tsv,idx
+source.exclude_dirs = tools, data/avatars/src
 
-version = 1.0
+version.regex = __version__ = ['"](.*)['"]
+version.filename = %(source.dir)s/main.py
 requirements = python3,kivy
 
 orientation = portrait
+android.permissions = INTERNET
 
 [buildozer]
 log_level = 2
@@ -0,0 +1,163 @@
+import hashlib
+import itertools
+import re
+import threading
+from collections import deque
+
+# 🧠 КОНТЕКСТ ДИАЛОГА
+# Собирает историю переписки для облачных моделей в пределах их лимита токенов.
+# Число токенов каждого сообщения считается один раз, при добавлении; для каждой
+# модели ведётся своё окно последних реплик с текущей суммой токенов. Реплики,
+# выпавшие из окна, сжимаются в короткие строки сводки, которая тоже ограничена
+# по размеру - работа на один ход не зависит от длины переписки.
+
+# Размер контекста моделей в токенах
+MODEL_LIMITS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gemini-pro": 30720,
+    "gemini-1.5-flash": 1048576,
+    "gemini-1.5-pro": 2097152
+}
+DEFAULT_LIMIT = 4096
+# Служебные токены на сообщение (роль, разделители)
+MESSAGE_OVERHEAD = 4
+SUMMARY_LINE_CHARS = 120
+
+def estimate_tokens(text):
+    # Без токенизатора модели: ~4 байта UTF-8 на токен, для кириллицы это ~2 символа
+    return (len(text.encode('utf-8')) + 3) // 4 + MESSAGE_OVERHEAD
+
+def summary_line(role, text):
+    # Первое предложение реплики, обрезанное до разумной длины
+    sentence = re.split(r"(?<=[.!?…])\s", " ".join(text.split()), 1)[0]
+    if len(sentence) > SUMMARY_LINE_CHARS:
+        sentence = sentence[:SUMMARY_LINE_CHARS - 1].rstrip() + "…"
+    speaker = "Пользователь" if role == "user" else "Ты"
+    return f"{speaker}: {sentence}"
+
+class Turn:
+    __slots__ = ("role", "text", "tokens", "_summary")
+    
+    def __init__(self, role, text):
+        self.role = role
+        self.text = text
+        self.tokens = estimate_tokens(text)
+        self._summary = None
+    
+    def summary(self):
+        # Строка сводки считается один раз, даже если реплика выпадает из нескольких окон
+        if self._summary is None:
+            line = summary_line(self.role, self.text)
+            self._summary = (line, estimate_tokens(line) - MESSAGE_OVERHEAD)
+        return self._summary
+
+class ContextWindow:
+    # Окно одной модели: последние реплики + сводка более ранних
+    def __init__(self, budget, summary_budget):
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self.turns = deque()
+        self.tokens = 0
+        self.summary = deque()
+        self.summary_tokens = 0
+        self.folded = 0
+    
+    def add(self, turn):
+        self.turns.append(turn)
+        self.tokens += turn.tokens
+        while self.tokens > self.budget and self.turns:
+            self.fold(self.turns.popleft())
+    
+    def fold(self, turn):
+        self.tokens -= turn.tokens
+        self.folded += 1
+        line, tokens = turn.summary()
+        self.summary.append((line, tokens))
+        self.summary_tokens += tokens
+        while self.summary_tokens > self.summary_budget and self.summary:
+            _, dropped = self.summary.popleft()
+            self.summary_tokens -= dropped
+    
+    def summary_text(self):
+        if not self.summary:
+            return ""
+        return "Ранее в разговоре:\n" + "\n".join(line for line, _ in self.summary)
+
+class ContextBuilder:
+    def __init__(self, max_history_tokens=3000, reply_tokens=512, summary_tokens=300):
+        self.max_history_tokens = max_history_tokens
+        self.reply_tokens = reply_tokens
+        self.summary_tokens = summary_tokens
+        self.lock = threading.Lock()
+        self.recent = deque(maxlen=200)
+        self.windows = {}
+        # Растёт с каждой репликой: по нему видно, что история изменилась
+        self.version = 0
+        # Отпечаток всей истории чата; у пустой истории - пустая строка
+        self.digest = ""
+    
+    def available_tokens(self, model, system_prompt):
+        # Что остаётся под историю и новое сообщение после ответа, сводки и системной подсказки
+        limit = MODEL_LIMITS.get(model or "", DEFAULT_LIMIT)
+        return limit - self.reply_tokens - self.summary_tokens - estimate_tokens(system_prompt)
+    
+    def window(self, model, budget):
+        window = self.windows.get(model)
+        if window is None:
+            # Новое окно заполняется из последних реплик один раз
+            window = ContextWindow(budget, self.summary_tokens)
+            for turn in self.recent:
+                window.add(turn)
+            self.windows[model] = window
+        elif window.budget != budget:
+            window.budget = budget
+            while window.tokens > budget and window.turns:
+                window.fold(window.turns.popleft())
+        return window
+    
+    def add_turn(self, role, text):
+        turn = Turn(role, text)
+        with self.lock:
+            self.recent.append(turn)
+            self.version += 1
+            self.digest = hashlib.sha1(f"{self.digest}\x1f{role}\x1f{text}".encode('utf-8')).hexdigest()
+            for window in self.windows.values():
+                window.add(turn)
+    
+    def seed(self, rows):
+        # Начальная история из базы: [{"is_user": ..., "text": ...}, ...]
+        for row in rows:
+            self.add_turn("user" if row["is_user"] else "assistant", row["text"])
+    
+    def build(self, model, system_prompt, user_message):
+        with self.lock:
+            available = self.available_tokens(model, system_prompt)
+            window = self.window(model, max(0, min(self.max_history_tokens, available)))
+            
+            # Длинное сообщение не должно навсегда сужать окно: лишние старые
+            # реплики пропускаются только в этом запросе
+            overflow = window.tokens + estimate_tokens(user_message) - available
+            turns = iter(window.turns)
+            for turn in turns:
+                if overflow <= 0:
+                    turns = itertools.chain([turn], turns)
+                    break
+                overflow -= turn.tokens
+            
+            summary = window.summary_text()
+            messages = [{"role": "system", "content": f"{system_prompt}\n\n{summary}" if summary else system_prompt}]
+            messages.extend({"role": turn.role, "content": turn.text} for turn in turns)
+        messages.append({"role": "user", "content": user_message})
+        return messages
+    
+    def stats(self):
+        with self.lock:
+            return {
+                model: {"turns": len(window.turns), "tokens": window.tokens, "folded": window.folded}
+                for model, window in self.windows.items()
+            }
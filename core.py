@@ -0,0 +1,359 @@
+import json
+import os
+import random
+import threading
+import time
+
+from context import ContextBuilder
+from metrics import registry
+from personas import PersonaLibrary
+from providers import LocalProvider, ProviderClient, RequestHandle
+from response_cache import ResponseCache
+from retrieval import ResponseEngine
+from router import ProviderRouter
+from storage import atomic_write
+
+# 🧠 ЯДРО
+# Настройки, персонаж и движок ответов без привязки к интерфейсу: их общими
+# использует приложение на Kivy (main.py) и сервер для многих пользователей
+# (server.py). Колбэки ответов приходят из рабочих потоков - в свой поток их
+# переносит вызывающий (Clock в приложении, цикл asyncio на сервере).
+
+# 🔧 КОНФИГУРАЦИЯ
+# Один экземпляр на процесс (Config.shared()). Экраны меняют значения через
+# set/update и подписываются на нужные ветки, чтобы обновлять только изменившееся
+class Config:
+    _shared = None
+    
+    @classmethod
+    def shared(cls):
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+    
+    def __init__(self, flush_delay=0.5):
+        self.config_file = "chaiclone_config.json"
+        self.flush_delay = flush_delay
+        self.state_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.flush_timer = None
+        self.dirty = False
+        self.last_written = None
+        self.save_stats = {"requested": 0, "written": 0, "bytes": 0}
+        self.subscribers = {}
+        self.load_config()
+    
+    def load_config(self):
+        default_config = {
+            "theme": "dark",
+            "ai_character": {
+                "name": "Ассистент",
+                "personality": "дружелюбный",
+                "style": "разговорный"
+            },
+            "cloud_services": {
+                "openai": {"enabled": False, "api_key": "", "model": "gpt-3.5-turbo"},
+                "google_ai": {"enabled": False, "api_key": "", "model": "gemini-pro"},
+                "custom_api": {"enabled": False, "endpoint": "", "api_key": ""}
+            },
+            "user_profile": {
+                "name": "Игрок",
+                "level": 1,
+                "xp": 0,
+                "messages_sent": 0,
+                "chats_created": 0,
+                "avatar": "default",
+                "status": "В сети"
+            },
+            "admin": {
+                "password": "admin123",
+                "access_enabled": True
+            },
+            "response_cache": {
+                "enabled": True,
+                "persist": True,
+                "max_entries": 500,
+                "ttl_hours": 24
+            },
+            "requests": {
+                "max_in_flight": 2
+            },
+            "router": {
+                "enabled": True,
+                "hedging": True,
+                "hedge_after_ms": 0,
+                "max_error_rate": 0.5,
+                "cooldown_s": 30
+            },
+            "context": {
+                "max_history_tokens": 3000,
+                "reply_tokens": 512,
+                "summary_tokens": 300
+            },
+            "metrics": {
+                "export": False,
+                "interval_s": 10,
+                "max_kb": 512
+            },
+            "sessions": {
+                "active": 1,
+                "max_in_memory": 3
+            },
+            "outbox": {
+                "enabled": True,
+                "base_delay_s": 2,
+                "max_delay_s": 300,
+                "max_attempts": 0
+            },
+            "speculation": {
+                "enabled": False,
+                "debounce_ms": 600,
+                "min_chars": 8,
+                "max_per_minute": 6
+            }
+        }
+        
+        if os.path.exists(self.config_file):
+            with open(self.config_file, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        else:
+            self.data = default_config
+            self.save_config()
+    
+    def get(self, path, default=None):
+        node = self.data
+        for key in path.split('.'):
+            if not isinstance(node, dict) or key not in node:
+                return default
+            node = node[key]
+        return node
+    
+    def set(self, path, value):
+        self.update({path: value})
+    
+    def update(self, changes):
+        # changes: {"user_profile.xp": 10, ...}; подписчики получают только реально изменившиеся поля
+        changed = []
+        with self.state_lock:
+            for path, value in changes.items():
+                keys = path.split('.')
+                node = self.data
+                for key in keys[:-1]:
+                    node = node.setdefault(key, {})
+                if keys[-1] not in node or node[keys[-1]] != value:
+                    node[keys[-1]] = value
+                    changed.append((path, value))
+        
+        if not changed:
+            return
+        self.save_config()
+        for path, value in changed:
+            self.notify(path, value)
+    
+    def subscribe(self, path, callback):
+        # callback(path, value) вызывается при изменении path или любого вложенного поля
+        self.subscribers.setdefault(path, []).append(callback)
+    
+    def unsubscribe(self, path, callback):
+        callbacks = self.subscribers.get(path, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+    
+    def notify(self, path, value):
+        for key, callbacks in list(self.subscribers.items()):
+            if path == key or path.startswith(key + '.'):
+                for callback in list(callbacks):
+                    callback(path, value)
+    
+    def save_config(self):
+        # Запись отложенная: вызовы в пределах flush_delay сливаются в одну,
+        # а сама запись выполняется в фоновом потоке
+        with self.state_lock:
+            self.save_stats["requested"] += 1
+            self.dirty = True
+            if self.flush_timer is None:
+                self.flush_timer = threading.Timer(self.flush_delay, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+    
+    def flush(self):
+        with self.write_lock:
+            with self.state_lock:
+                if self.flush_timer is not None:
+                    self.flush_timer.cancel()
+                    self.flush_timer = None
+                if not self.dirty:
+                    return
+                self.dirty = False
+                payload = json.dumps(self.data, ensure_ascii=False)
+            
+            # Содержимое не изменилось - диск не трогаем
+            if payload == self.last_written:
+                return
+            
+            started = time.perf_counter()
+            atomic_write(self.config_file, payload)
+            registry.histogram("config.save_ms").observe((time.perf_counter() - started) * 1000)
+            self.last_written = payload
+            size = len(payload.encode('utf-8'))
+            registry.counter("config.bytes_written").inc(size)
+            with self.state_lock:
+                self.save_stats["written"] += 1
+                self.save_stats["bytes"] += size
+    
+    def saves_avoided(self):
+        return self.save_stats["requested"] - self.save_stats["written"]
+
+# 🤖 ИИ СИСТЕМА
+class AISystem:
+    def __init__(self, config, max_workers=4):
+        # max_workers - одновременных запросов к провайдерам (серверу нужно больше)
+        self.config = config
+        # Характеры - пакеты из data/personas; при запуске читается только их индекс
+        self.personas = PersonaLibrary.shared()
+        self.personas.prefetch(self.config.get("ai_character.personality", ""))
+        # Офлайн-ответы из корпуса характера; индекс читается при первом запросе
+        self.engine = ResponseEngine(
+            corpus_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "corpus"),
+            index_dir="chaiclone_index"
+        )
+        self.client = ProviderClient(max_workers=max_workers)
+        # При нескольких облачных сервисах запрос уходит самому быстрому из здоровых
+        self.router = ProviderRouter(self.client, self.config.get("router", {}))
+        self.config.subscribe("router", self.on_router_changed)
+        # Без облака ответ генерируется локально и тоже выдаётся потоком
+        self.local_provider = LocalProvider(self.generate_response)
+        
+        # Кэш облачных ответов; смена персонажа делает старые ответы неактуальными
+        cache_settings = self.config.get("response_cache", {})
+        self.cache_enabled = cache_settings.get("enabled", True)
+        self.cache = ResponseCache(
+            max_entries=cache_settings.get("max_entries", 500),
+            ttl=cache_settings.get("ttl_hours", 24) * 3600,
+            cache_file="chaiclone_response_cache.json" if cache_settings.get("persist", True) else None
+        )
+        self.config.subscribe("ai_character", self.on_character_changed)
+        
+        # История переписки для облачных моделей с учётом их лимитов токенов;
+        # у каждого чата своя, эта - для запросов без чата
+        self.context = self.make_context()
+    
+    def make_context(self):
+        context_settings = self.config.get("context", {})
+        return ContextBuilder(
+            max_history_tokens=context_settings.get("max_history_tokens", 3000),
+            reply_tokens=context_settings.get("reply_tokens", 512),
+            summary_tokens=context_settings.get("summary_tokens", 300)
+        )
+    
+    def on_character_changed(self, path, value):
+        self.cache.clear()
+        self.personas.prefetch(self.config.get("ai_character.personality", ""))
+    
+    def on_router_changed(self, path, value):
+        self.router.configure(self.config.get("router", {}))
+    
+    def build_messages(self, user_message, model=None, character=None, context=None):
+        character = character or self.config.data["ai_character"]
+        system_prompt = (f"Ты - {character['name']}, {character['personality']} собеседник. "
+                         f"Стиль общения: {character['style']}. Отвечай по-русски.")
+        if model is None:
+            # Локальному генератору история не нужна
+            return [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ]
+        return (context or self.context).build(model, system_prompt, user_message)
+    
+    def record_exchange(self, user_message, response, context=None):
+        # Вызывается по порядку доставки ответов, чтобы история шла в порядке диалога
+        context = context or self.context
+        context.add_turn("user", user_message)
+        context.add_turn("assistant", response)
+    
+    def request_response(self, user_message, on_result, on_error=None, on_token=None, character=None, context=None):
+        # Асинхронный запрос: облачный провайдер, если настроен, иначе локальный генератор.
+        # character и context - персонаж и история чата, по умолчанию общие
+        character = character or self.config.data["ai_character"]
+        providers = self.client.configured_providers(self.config.data["cloud_services"])
+        if not providers:
+            return self.local_response(user_message, on_result, on_error, on_token, character)
+        
+        def build_messages(provider):
+            return self.build_messages(user_message, provider.model, character, context)
+        
+        if len(providers) > 1 and self.config.get("router.enabled", True):
+            route = ("router", ",".join(sorted(provider.name for provider in providers)))
+            
+            def send(callback):
+                return self.router.submit(providers, build_messages, callback, on_error, on_token)
+        else:
+            provider = providers[0]
+            route = (provider.name, provider.model)
+            
+            def send(callback):
+                return self.client.submit(provider, build_messages(provider), callback, on_error, on_token)
+        
+        if not self.cache_enabled:
+            return send(on_result)
+        
+        # Ответ зависит и от истории, которая уходит модели вместе с сообщением
+        key = self.cache.make_key(user_message, character, *route, (context or self.context).digest)
+        cached = self.cache.get(key)
+        if cached is not None:
+            # Попадание в кэш: ответ целиком, без сетевого запроса
+            if on_token is not None:
+                on_token(cached)
+            on_result(cached)
+            return RequestHandle()
+        
+        def store(text):
+            self.cache.put(key, text)
+            on_result(text)
+        
+        return send(store)
+    
+    def local_response(self, user_message, on_result, on_error=None, on_token=None, character=None):
+        # Локальный ответ в пуле потоков клиента: загрузка индекса корпуса и поиск
+        # по нему не должны идти в потоке UI
+        character = character or self.config.data["ai_character"]
+        provider = self.local_provider
+        if character is not self.config.data["ai_character"]:
+            provider = LocalProvider(lambda text: self.generate_response(text, character),
+                                     token_delay=self.local_provider.token_delay)
+        return self.client.submit(provider, self.build_messages(user_message, character=character),
+                                  on_result, on_error, on_token)
+    
+    def save_cache(self):
+        self.cache.save()
+    
+    def shutdown(self):
+        self.client.shutdown()
+        self.save_cache()
+    
+    def generate_response(self, user_message, character=None):
+        character = character or self.config.data["ai_character"]
+        pack = self.personas.pack(character["personality"])
+        
+        # Ответ из корпуса по похожести на сообщение; без совпадения - общая фраза персонажа
+        base_response = self.engine.reply(pack.corpus, user_message)
+        if base_response is None:
+            base_response = random.choice(pack.greetings)
+        
+        # Стиль - шаблон пакета, разобранный при его загрузке
+        return pack.render(character["style"], base_response, character["name"],
+                           self.config.get("user_profile.name", ""))
+
+# 🏆 ПРОГРЕСС ПРОФИЛЯ
+XP_PER_LEVEL = 100
+
+def award_reply(profile):
+    # Опыт за полученный ответ: изменённые поля профиля, "level" - только при повышении
+    changes = {
+        "messages_sent": profile["messages_sent"] + 1,
+        "xp": profile["xp"] + random.randint(5, 15)
+    }
+    if changes["xp"] >= XP_PER_LEVEL:
+        changes["level"] = profile["level"] + 1
+        changes["xp"] = 0
+    return changes
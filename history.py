@@ -0,0 +1,334 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+# 🗂 ИСТОРИЯ ЧАТА
+# Сообщения хранятся во встроенной SQLite базе. Страницы читаются по первичному
+# ключу (keyset-пагинация), поэтому загрузка последней страницы не зависит
+# от длины истории.
+# Поиск - полнотекстовый индекс FTS5 поверх таблицы сообщений. Индекс обновляется
+# триггерами при каждой вставке, а не перестраивается; если SQLite собран без
+# FTS5, поиск работает медленнее, перебором сообщений с теми же правилами.
+# Сообщения разделены по чатам (sessions); страницы и последние сообщения
+# читаются по индексу (session_id, id), поэтому число чатов на скорость не влияет.
+
+# Миграции применяются по порядку, номер текущей хранится в PRAGMA user_version
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        is_user INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    """,
+    # Сводки статистики (см. stats.py); уже накопленные сообщения учитываются один раз
+    """
+    CREATE TABLE IF NOT EXISTS stats_hourly (
+        hour INTEGER NOT NULL,
+        persona TEXT NOT NULL,
+        messages INTEGER NOT NULL DEFAULT 0,
+        replies INTEGER NOT NULL DEFAULT 0,
+        errors INTEGER NOT NULL DEFAULT 0,
+        chars_in INTEGER NOT NULL DEFAULT 0,
+        chars_out INTEGER NOT NULL DEFAULT 0,
+        latency_ms REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, persona)
+    );
+    CREATE TABLE IF NOT EXISTS stats_latency (
+        persona TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (persona, bucket)
+    );
+    INSERT INTO stats_hourly (hour, persona, messages, replies, chars_in, chars_out)
+    SELECT CAST(created_at / 3600 AS INTEGER), '', SUM(is_user), SUM(1 - is_user),
+           SUM(CASE WHEN is_user THEN length(text) ELSE 0 END),
+           SUM(CASE WHEN is_user THEN 0 ELSE length(text) END)
+    FROM messages GROUP BY CAST(created_at / 3600 AS INTEGER);
+    """,
+    # Несколько чатов; существующая переписка становится первым из них
+    """
+    CREATE TABLE IF NOT EXISTS sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        persona TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    INSERT INTO sessions (id, title, persona, created_at, updated_at)
+    SELECT 1, 'Основной чат', NULL,
+           COALESCE(MIN(created_at), strftime('%s', 'now')), COALESCE(MAX(created_at), strftime('%s', 'now'))
+    FROM messages;
+    ALTER TABLE messages ADD COLUMN session_id INTEGER NOT NULL DEFAULT 1;
+    CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id);
+    """,
+    # Неотправленные запросы к облаку (см. outbox.py)
+    """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL,
+        prompt TEXT NOT NULL,
+        persona TEXT,
+        created_at REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        last_error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt_at);
+    """,
+    # Опыт и уровень пользователя в чате сервера (см. server.py)
+    """
+    ALTER TABLE sessions ADD COLUMN profile TEXT;
+    """,
+    # Постоянный идентификатор чата: по нему импорт копии узнаёт уже перенесённые чаты
+    """
+    ALTER TABLE sessions ADD COLUMN uid TEXT;
+    UPDATE sessions SET uid = lower(hex(randomblob(16)));
+    CREATE UNIQUE INDEX IF NOT EXISTS sessions_uid ON sessions (uid);
+    """,
+]
+
+DEFAULT_SESSION = 1
+
+# Внешний контент-индекс: сам текст хранится только в messages
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE messages_fts USING fts5(
+    text, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+CREATE TRIGGER messages_fts_update AFTER UPDATE OF text ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text);
+END;
+INSERT INTO messages_fts(messages_fts) VALUES ('rebuild');
+"""
+
+def session_row(row):
+    return {
+        "id": row[0],
+        "title": row[1],
+        "persona": json.loads(row[2]) if row[2] else None,
+        "created_at": row[3],
+        "updated_at": row[4],
+        "uid": row[5]
+    }
+
+# Маркеры подсветки в найденном фрагменте; вызывающий заменяет их на свою разметку
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+def search_terms(query):
+    return re.findall(r"\w+", query.lower())
+
+def term_patterns(terms):
+    # Поиск без FTS5: термин - начало слова, без учёта регистра, как у индекса.
+    # LIKE для этого не годится: он ищет подстроку и не знает регистра кириллицы
+    return [re.compile(r"\b" + re.escape(term), re.IGNORECASE) for term in terms]
+
+def highlight_terms(text, terms):
+    # Подсветка для поиска без FTS5: начала слов, совпадающие с терминами
+    pattern = re.compile(r"\b(" + "|".join(re.escape(term) for term in terms) + r")", re.IGNORECASE)
+    return pattern.sub(lambda match: MATCH_START + match.group(0) + MATCH_END, text)
+
+class ChatHistory:
+    def __init__(self, db_file="chaiclone_history.db", page_size=50):
+        self.db_file = db_file
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.migrate()
+        self.fts = self.ensure_search_index()
+    
+    def migrate(self):
+        # Миграция и её номер - одна транзакция: оборванная на середине миграция
+        # откатывается целиком и при следующем запуске выполняется заново
+        with self.lock:
+            version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+            for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+                try:
+                    self.connection.executescript(f"BEGIN;{script}PRAGMA user_version = {number};COMMIT;")
+                except sqlite3.Error:
+                    self.connection.rollback()
+                    raise
+    
+    def ensure_search_index(self):
+        # Индекс создаётся один раз; для уже накопленной истории - с полной сборкой
+        with self.lock:
+            exists = self.connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+            ).fetchone()
+            if exists:
+                return True
+            try:
+                self.connection.executescript("BEGIN;" + SEARCH_SCHEMA + "COMMIT;")
+            except sqlite3.OperationalError:
+                # Нет модуля fts5
+                self.connection.rollback()
+                return False
+            return True
+    
+    # 💬 ЧАТЫ
+    def create_session(self, title, persona=None):
+        # persona - словарь с полями ai_character, которые в этом чате свои
+        now = time.time()
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT INTO sessions (title, persona, created_at, updated_at, uid) VALUES (?, ?, ?, ?, ?)",
+                (title, json.dumps(persona, ensure_ascii=False) if persona else None, now, now, uuid.uuid4().hex)
+            )
+            self.connection.commit()
+            return cursor.lastrowid
+    
+    def get_session(self, session_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id, title, persona, created_at, updated_at, uid FROM sessions WHERE id = ?",
+                (session_id,)
+            ).fetchone()
+        return session_row(row) if row else None
+    
+    def list_sessions(self):
+        # Недавно использованные - первыми
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, title, persona, created_at, updated_at, uid FROM sessions ORDER BY updated_at DESC, id DESC"
+            ).fetchall()
+        return [session_row(row) for row in rows]
+    
+    def update_session(self, session_id, title=None, persona=None, profile=None):
+        with self.lock:
+            if title is not None:
+                self.connection.execute("UPDATE sessions SET title = ? WHERE id = ?", (title, session_id))
+            if persona is not None:
+                self.connection.execute(
+                    "UPDATE sessions SET persona = ? WHERE id = ?",
+                    (json.dumps(persona, ensure_ascii=False) if persona else None, session_id)
+                )
+            if profile is not None:
+                self.connection.execute("UPDATE sessions SET profile = ? WHERE id = ?", (json.dumps(profile), session_id))
+            self.connection.commit()
+    
+    def get_session_profile(self, session_id):
+        with self.lock:
+            row = self.connection.execute("SELECT profile FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+    
+    def delete_session(self, session_id):
+        # Сообщения и неотправленные запросы удаляются вместе с чатом; индекс поиска чистят триггеры
+        with self.lock:
+            self.connection.execute("DELETE FROM outbox WHERE session_id = ?", (session_id,))
+            self.connection.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self.connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self.connection.commit()
+    
+    def append(self, text, is_user, session_id=DEFAULT_SESSION):
+        now = time.time()
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT INTO messages (is_user, text, created_at, session_id) VALUES (?, ?, ?, ?)",
+                (1 if is_user else 0, text, now, session_id)
+            )
+            self.connection.execute("UPDATE sessions SET updated_at = ? WHERE id = ?", (now, session_id))
+            self.connection.commit()
+            return cursor.lastrowid
+    
+    def load_last_page(self, session_id=DEFAULT_SESSION):
+        return self.load_page_before(None, session_id=session_id)
+    
+    def load_page_before(self, before_id, limit=None, session_id=DEFAULT_SESSION):
+        # Возвращает до limit сообщений чата старше before_id в хронологическом порядке
+        limit = limit or self.page_size
+        with self.lock:
+            if before_id is None:
+                rows = self.connection.execute(
+                    "SELECT id, is_user, text, created_at FROM messages WHERE session_id = ? "
+                    "ORDER BY id DESC LIMIT ?",
+                    (session_id, limit)
+                ).fetchall()
+            else:
+                rows = self.connection.execute(
+                    "SELECT id, is_user, text, created_at FROM messages WHERE session_id = ? AND id < ? "
+                    "ORDER BY id DESC LIMIT ?",
+                    (session_id, before_id, limit)
+                ).fetchall()
+        
+        rows.reverse()
+        return [
+            {"id": row[0], "is_user": bool(row[1]), "text": row[2], "created_at": row[3]}
+            for row in rows
+        ]
+    
+    def load_page_after(self, after_id, limit=None, session_id=DEFAULT_SESSION):
+        # До limit сообщений чата новее after_id в хронологическом порядке
+        limit = limit or self.page_size
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, is_user, text, created_at FROM messages WHERE session_id = ? AND id > ? "
+                "ORDER BY id LIMIT ?",
+                (session_id, after_id, limit)
+            ).fetchall()
+        return [
+            {"id": row[0], "is_user": bool(row[1]), "text": row[2], "created_at": row[3]}
+            for row in rows
+        ]
+    
+    def load_around(self, message_id, limit=None, session_id=DEFAULT_SESSION):
+        # Страница вокруг сообщения: половина до него, само сообщение и следующие
+        limit = limit or self.page_size
+        before = self.load_page_before(message_id, limit // 2, session_id)
+        return before + self.load_page_after(message_id - 1, limit - len(before), session_id)
+    
+    def search(self, query, limit=50):
+        # Каждое слово запроса - префикс ("прив" находит "привет"), слова через И.
+        # Поиск по всем чатам, от новых к старым: {"id", "session_id", "is_user", "snippet", "created_at"}
+        terms = search_terms(query)
+        if not terms:
+            return []
+        with self.lock:
+            if self.fts:
+                match = " ".join(f'"{term}"*' for term in terms)
+                rows = self.connection.execute(
+                    "SELECT m.id, m.is_user, snippet(messages_fts, 0, ?, ?, '…', 16), m.created_at, m.session_id "
+                    "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                    "WHERE messages_fts MATCH ? ORDER BY messages_fts.rowid DESC LIMIT ?",
+                    (MATCH_START, MATCH_END, match, limit)
+                ).fetchall()
+            else:
+                patterns = term_patterns(terms)
+                rows = []
+                cursor = self.connection.execute(
+                    "SELECT id, is_user, text, created_at, session_id FROM messages ORDER BY id DESC"
+                )
+                for row in cursor:
+                    if all(pattern.search(row[2]) for pattern in patterns):
+                        rows.append((row[0], row[1], highlight_terms(row[2], terms), row[3], row[4]))
+                        if len(rows) >= limit:
+                            break
+                cursor.close()
+        return [
+            {"id": row[0], "session_id": row[4], "is_user": bool(row[1]), "snippet": row[2], "created_at": row[3]}
+            for row in rows
+        ]
+    
+    def count(self, session_id=None):
+        with self.lock:
+            if session_id is None:
+                return self.connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+    
+    def close(self):
+        with self.lock:
+            self.connection.close()
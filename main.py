@@ -1,3 +1,6 @@
+import time
+STARTUP_BEGIN = time.perf_counter()
+
 import kivy
 from kivy.app import App
 from kivy.uix.screenmanager import ScreenManager, Screen
@@ -5,120 +8,78 @@ from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.label import Label
 from kivy.uix.button import Button
 from kivy.uix.textinput import TextInput
-from kivy.uix.switch import Switch
 from kivy.uix.scrollview import ScrollView
-from kivy.uix.progressbar import ProgressBar
-from kivy.uix.slider import Slider
-from kivy.uix.spinner import Spinner
-from kivy.uix.popup import Popup
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
 from kivy.core.window import Window
-from kivy.clock import Clock
+from kivy.clock import Clock, mainthread
+from kivy.logger import Logger
 from kivy.graphics import Color, Rectangle, RoundedRectangle
-from kivy.uix.image import Image
+from kivy.lang import Builder
+from kivy.properties import ListProperty, NumericProperty
+from kivy.uix.widget import Widget
 from kivy.uix.behaviors import ButtonBehavior
+from kivy.core.text import Label as CoreLabel
+from kivy.metrics import sp
+from kivy.utils import escape_markup
 import json
 import os
-import random
+import threading
+from collections import OrderedDict
 from datetime import datetime
 
-# 🔧 КОНФИГУРАЦИЯ
-class Config:
-    def __init__(self):
-        self.config_file = "chaiclone_config.json"
-        self.load_config()
-    
-    def load_config(self):
-        default_config = {
-            "theme": "dark",
-            "ai_character": {
-                "name": "Ассистент",
-                "personality": "дружелюбный",
-                "style": "разговорный"
-            },
-            "cloud_services": {
-                "openai": {"enabled": False, "api_key": "", "model": "gpt-3.5-turbo"},
-                "google_ai": {"enabled": False, "api_key": "", "model": "gemini-pro"},
-                "custom_api": {"enabled": False, "endpoint": "", "api_key": ""}
-            },
-            "user_profile": {
-                "name": "Игрок",
-                "level": 1,
-                "xp": 0,
-                "messages_sent": 0,
-                "chats_created": 0,
-                "avatar": "default",
-                "status": "В сети"
-            },
-            "admin": {
-                "password": "admin123",
-                "access_enabled": True
-            }
-        }
-        
-        if os.path.exists(self.config_file):
-            with open(self.config_file, 'r', encoding='utf-8') as f:
-                self.data = json.load(f)
-        else:
-            self.data = default_config
-            self.save_config()
-    
-    def save_config(self):
-        with open(self.config_file, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
+from avatars import AI_AVATAR, USER_AVATAR, AvatarCatalog
+from core import AISystem, Config, award_reply
+from history import DEFAULT_SESSION, MATCH_END, MATCH_START, ChatHistory
+from metrics import MetricsExporter, registry, rss_bytes
+from outbox import Outbox
+from personas import PersonaLibrary
+from providers import ProviderUnavailable
+from scheduler import ReplyJob, ReplyScheduler
+from sessions import ChatSession, SessionCache
+from speculation import Speculator
+from stats import UsageStats
 
-# 🤖 ИИ СИСТЕМА
-class AISystem:
-    def __init__(self, config):
-        self.config = config
-        self.personalities = {
-            "дружелюбный": ["Привет! Как твои дела?", "Отлично! Рад тебя видеть!", "Как прошел твой день?"],
-            "профессиональный": ["Здравствуйте. Чем могу помочь?", "Понимаю вашу ситуацию.", "Готов оказать помощь."],
-            "веселый": ["Йоу! Как сам? 😎", "Опа, новое сообщение! 🎉", "Хей! Давай пообщаемся! 🚀"],
-            "заботливый": ["Привет, дорогой! Как ты себя чувствуешь?", "Все будет хорошо, я с тобой 💖", "Береги себя!"]
-        }
-    
-    def generate_response(self, user_message):
-        character = self.config.data["ai_character"]
-        personality = character["personality"]
-        style = character["style"]
-        
-        # Локальные ответы на основе персонажа
-        responses = self.personalities.get(personality, self.personalities["дружелюбный"])
-        
-        # Добавляем стиль
-        base_response = random.choice(responses)
-        
-        if style == "формальный":
-            return f"{base_response} (формальный стиль)"
-        elif style == "разговорный":
-            return f"{base_response} (неформально)"
-        elif style == "креативный":
-            return f"🎨 {base_response} 🎭"
-        
-        return f"{character['name']}: {base_response}"
+# Модули виджетов, которых нет на экране чата (Popup, Spinner, Switch, ProgressBar),
+# импортируются там, где используются, чтобы не замедлять первый кадр
+STARTUP_IMPORTED = time.perf_counter()
+
+__version__ = "1.0"
 
 # 🎨 КАСТОМНЫЕ ВИДЖЕТЫ
-class RoundedButton(ButtonBehavior, BoxLayout):
+# Скруглённый фон - одно общее правило KV на все панели вместо ручной сборки канвы
+# и bind(pos=..., size=...) в каждом классе. Привязки к pos/size по-прежнему
+# создаются на каждый виджет (Builder компилирует их в колбэки), зато кода
+# настройки меньше, а фон обновляется только при изменении его свойств
+Builder.load_string("""
+<RoundedPanel>:
+    canvas.before:
+        Color:
+            rgba: self.background_color
+        RoundedRectangle:
+            pos: self.pos
+            size: self.size
+            radius: [self.background_radius]
+""")
+
+class RoundedPanel(BoxLayout):
+    background_color = ListProperty([0.15, 0.15, 0.2, 1])
+    background_radius = NumericProperty(15)
+
+class RoundedButton(ButtonBehavior, RoundedPanel):
     def __init__(self, text="", **kwargs):
         super().__init__(**kwargs)
         self.size_hint = (1, None)
         self.height = 50
         self.padding = [10, 5]
-        
-        with self.canvas.before:
-            Color(0.2, 0.6, 0.8, 1)
-            self.rect = RoundedRectangle(pos=self.pos, size=self.size, radius=[10])
-        
-        self.bind(pos=self.update_rect, size=self.update_rect)
+        self.background_color = (0.2, 0.6, 0.8, 1)
+        self.background_radius = 10
         
         label = Label(text=text, color=(1, 1, 1, 1), bold=True)
         self.add_widget(label)
-    
-    def update_rect(self, *args):
-        self.rect.pos = self.pos
-        self.rect.size = self.size
 
-class ProfileCard(BoxLayout):
+class ProfileCard(RoundedPanel):
     def __init__(self, profile_data, **kwargs):
         super().__init__(**kwargs)
         self.orientation = 'vertical'
@@ -127,32 +88,34 @@ class ProfileCard(BoxLayout):
         self.padding = [15, 15]
         self.spacing = 10
         
-        with self.canvas.before:
-            Color(0.15, 0.15, 0.2, 1)
-            self.rect = RoundedRectangle(pos=self.pos, size=self.size, radius=[15])
-        
-        self.bind(pos=self.update_rect, size=self.update_rect)
-        
         # Аватар и имя
         top_layout = BoxLayout(size_hint_y=0.4)
-        avatar = Label(text="👤", font_size='30sp')
+        self.avatar_box = BoxLayout(size_hint_x=0.4)
+        self.avatar = profile_data.get("avatar") or USER_AVATAR
+        self.show_avatar()
+        avatar_textures.listeners.append(self.on_avatar_ready)
         name_layout = BoxLayout(orientation='vertical')
-        name_layout.add_widget(Label(text=profile_data["name"], font_size='18sp', bold=True))
-        name_layout.add_widget(Label(text=profile_data["status"], font_size='12sp', color=(0.7, 0.7, 0.7, 1)))
+        self.name_label = Label(text=profile_data["name"], font_size='18sp', bold=True)
+        self.status_label = Label(text=profile_data["status"], font_size='12sp', color=(0.7, 0.7, 0.7, 1))
+        name_layout.add_widget(self.name_label)
+        name_layout.add_widget(self.status_label)
         
-        top_layout.add_widget(avatar)
+        top_layout.add_widget(self.avatar_box)
         top_layout.add_widget(name_layout)
         
         # Статистика
         stats_layout = BoxLayout(size_hint_y=0.6)
         stats = BoxLayout(orientation='vertical')
-        stats.add_widget(Label(text=f"Уровень: {profile_data['level']}", font_size='12sp'))
-        stats.add_widget(Label(text=f"Сообщений: {profile_data['messages_sent']}", font_size='12sp'))
+        self.level_label = Label(text=f"Уровень: {profile_data['level']}", font_size='12sp')
+        self.messages_label = Label(text=f"Сообщений: {profile_data['messages_sent']}", font_size='12sp')
+        stats.add_widget(self.level_label)
+        stats.add_widget(self.messages_label)
         
         progress_layout = BoxLayout(orientation='vertical', size_hint_x=0.6)
         progress_layout.add_widget(Label(text="Прогресс:", font_size='12sp'))
-        progress = ProgressBar(max=100, value=profile_data["xp"])
-        progress_layout.add_widget(progress)
+        from kivy.uix.progressbar import ProgressBar
+        self.progress = ProgressBar(max=100, value=profile_data["xp"])
+        progress_layout.add_widget(self.progress)
         
         stats_layout.add_widget(stats)
         stats_layout.add_widget(progress_layout)
@@ -160,37 +123,418 @@ class ProfileCard(BoxLayout):
         self.add_widget(top_layout)
         self.add_widget(stats_layout)
     
-    def update_rect(self, *args):
+    def update_field(self, field, value):
+        # Обновляем только виджет изменившегося поля
+        if field == "name":
+            self.name_label.text = value
+        elif field == "status":
+            self.status_label.text = value
+        elif field == "level":
+            self.level_label.text = f"Уровень: {value}"
+        elif field == "messages_sent":
+            self.messages_label.text = f"Сообщений: {value}"
+        elif field == "xp":
+            self.progress.value = value
+        elif field == "avatar":
+            self.avatar = value or USER_AVATAR
+            self.show_avatar()
+    
+    def show_avatar(self):
+        # Пока картинка грузится (или её нет) - эмодзи
+        from kivy.uix.image import Image
+        texture = avatar_textures.texture(self.avatar)
+        self.avatar_box.clear_widgets()
+        if texture is None:
+            self.avatar_box.add_widget(Label(text="👤", font_size='30sp'))
+        else:
+            self.avatar_box.add_widget(Image(texture=texture))
+    
+    def on_avatar_ready(self, avatar):
+        if avatar == self.avatar:
+            self.show_avatar()
+
+# 💬 ПУЗЫРЬ СООБЩЕНИЯ
+# Виджеты пузырей переиспользуются RecycleView: на экране живут только видимые,
+# а вся история хранится в списке словарей (rv.data)
+MESSAGE_FONT_SIZE = '15sp'
+MESSAGE_MIN_HEIGHT = 60
+MESSAGE_PADDING = [15, 5]
+MESSAGE_AVATAR_WIDTH = 40
+# Сторона картинки аватара в пузыре
+MESSAGE_AVATAR_SIZE = 32
+# Пузырь ответа, который ждёт в очереди неотправленных запросов
+OUTBOX_TEXT = "📮 Нет связи. Отвечу, как только сеть вернётся"
+
+def outbox_persona(entry):
+    # Персонаж, с которым запрос ушёл в очередь, - для статистики по персонажам
+    return (entry["character"] or {}).get("personality", "")
+
+class TextLayoutCache:
+    # Кэш разметки текста пузырей по ключу (текст, корзина ширины, шрифт).
+    # Размеры дешёвые и хранятся долго; текстуры занимают видеопамять, поэтому их
+    # LRU короткий - его хватает на видимые пузыри и повторяющиеся ответы ИИ.
+    def __init__(self, max_sizes=20000, max_textures=64, width_step=20):
+        self.max_sizes = max_sizes
+        self.max_textures = max_textures
+        self.width_step = width_step
+        self.sizes = OrderedDict()
+        self.textures = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def bucket(self, width):
+        # Ширина округляется вниз до шага: мелкие изменения окна не сбрасывают кэш
+        return max(self.width_step, int(width) // self.width_step * self.width_step)
+    
+    def make_label(self, text, width, font_size):
+        return CoreLabel(text=text, text_size=(width, None), font_size=sp(font_size))
+    
+    def size(self, text, width, font_size=15, store=True):
+        key = (text, width, font_size)
+        size = self.sizes.get(key)
+        if size is not None:
+            self.sizes.move_to_end(key)
+            self.hits += 1
+            return size
+        
+        self.misses += 1
+        texture = self.textures.get(key)
+        if texture is not None:
+            size = texture.size
+        else:
+            # Только расчёт разметки, без растеризации текстуры
+            label = self.make_label(text, width, font_size)
+            label.resolve_font_name()
+            size = label.render()
+        if store:
+            self.sizes[key] = size
+            if len(self.sizes) > self.max_sizes:
+                self.sizes.popitem(last=False)
+        return size
+    
+    def texture(self, text, width, font_size=15, store=True):
+        key = (text, width, font_size)
+        texture = self.textures.get(key)
+        if texture is not None:
+            self.textures.move_to_end(key)
+            return texture
+        
+        label = self.make_label(text, width, font_size)
+        label.refresh()
+        texture = label.texture
+        if store:
+            self.textures[key] = texture
+            self.sizes[key] = texture.size
+            if len(self.textures) > self.max_textures:
+                self.textures.popitem(last=False)
+        return texture
+    
+    def clear_textures(self):
+        # Размеры привязаны к ширине и остаются верными, текстуры - отпускаем
+        self.textures.clear()
+
+text_layouts = TextLayoutCache()
+
+class AvatarTextures:
+    # Одна текстура на аватар - общая для всех пузырей и карточки профиля.
+    # Картинки декодирует Loader в своих потоках; встроенные аватары - области
+    # одной страницы атласа, то есть одно декодирование и одна загрузка в
+    # видеопамять на все. Своя картинка при первой загрузке уменьшается на GPU
+    # и сохраняется миниатюрой, в следующий раз читается уже она. Пока картинка
+    # грузится, texture() возвращает None; о готовности сообщают listeners(avatar).
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.textures = {}
+        # Аватар -> время начала загрузки
+        self.loading = {}
+        self.failed = set()
+        # Fbo миниатюр: их текстуры перерисовываются после потери контекста GL
+        self.thumbnails = {}
+        self.listeners = []
+    
+    def texture(self, avatar):
+        texture = self.textures.get(avatar)
+        if texture is None and avatar not in self.loading and avatar not in self.failed:
+            self.loading[avatar] = time.perf_counter()
+            self.load(avatar)
+        return self.textures.get(avatar)
+    
+    def load(self, avatar):
+        source = self.catalog.resolve(avatar)
+        if source is None:
+            self.done(avatar, None)
+        elif source[0] == "atlas":
+            _, page, region = source
+            self.load_image(avatar, page, lambda texture: texture.get_region(*region))
+        elif source[0] == "file" or os.path.exists(source[1]):
+            self.load_image(avatar, source[1], lambda texture: texture)
+        else:
+            thumb_path, original = source[1:]
+            self.load_image(avatar, original, lambda texture: self.make_thumbnail(avatar, texture, original, thumb_path))
+    
+    def load_image(self, avatar, path, convert):
+        # Loader не декодирует один файл дважды: страница атласа читается один раз на все аватары
+        from kivy.loader import Loader
+        proxy = Loader.image(path)
+        
+        def on_load(*args):
+            self.done(avatar, convert(proxy.texture))
+        
+        def on_error(*args, **kwargs):
+            self.done(avatar, None)
+        
+        if proxy.loaded:
+            on_load()
+        else:
+            proxy.bind(on_load=on_load, on_error=on_error)
+    
+    def make_thumbnail(self, avatar, texture, original, thumb_path):
+        from kivy.cache import Cache
+        from kivy.graphics import ClearBuffers, ClearColor, Fbo
+        scale = min(1.0, self.catalog.thumb_size / max(texture.size))
+        size = (max(1, int(texture.width * scale)), max(1, int(texture.height * scale)))
+        fbo = Fbo(size=size)
+        with fbo:
+            ClearColor(0, 0, 0, 0)
+            ClearBuffers()
+            Rectangle(texture=texture, size=size)
+        fbo.draw()
+        self.thumbnails[avatar] = fbo
+        try:
+            os.makedirs(self.catalog.thumb_dir, exist_ok=True)
+            fbo.texture.save(thumb_path)
+            registry.counter("avatars.thumbnails_made").inc()
+        except OSError:
+            pass
+        # Полноразмерная картинка больше не нужна
+        Cache.remove('kv.loader', original)
+        return fbo.texture
+    
+    def done(self, avatar, texture):
+        started = self.loading.pop(avatar, None)
+        if texture is None:
+            self.failed.add(avatar)
+            return
+        if started is not None:
+            registry.histogram("avatars.load_ms").observe((time.perf_counter() - started) * 1000)
+        self.textures[avatar] = texture
+        for listener in list(self.listeners):
+            listener(avatar)
+    
+    def stats(self):
+        return dict(self.catalog.stats(), textures=len(self.textures), loading=len(self.loading),
+                    failed=len(self.failed))
+
+avatar_textures = AvatarTextures(AvatarCatalog())
+
+def message_text_width():
+    return text_layouts.bucket(Window.width * 0.7)
+
+def measure_message_height(text, width, store=True):
+    _, height = text_layouts.size(text, width, store=store)
+    return max(MESSAGE_MIN_HEIGHT, height + MESSAGE_PADDING[1] * 2)
+
+class StreamingReply:
+    # Токены приходят из рабочего потока и копятся в буфере; в UI они выводятся
+    # одним пакетом за кадр, чтобы текст пузыря перестраивался не чаще раза за кадр
+    def __init__(self, on_flush):
+        self.on_flush = on_flush
+        self.lock = threading.Lock()
+        self.pending = []
+        self.scheduled = False
+        self.closed = False
+    
+    def push(self, token):
+        with self.lock:
+            self.pending.append(token)
+            if self.scheduled:
+                return
+            self.scheduled = True
+        Clock.schedule_once(self.flush)
+    
+    def flush(self, dt):
+        with self.lock:
+            text = "".join(self.pending)
+            self.pending = []
+            self.scheduled = False
+            if self.closed:
+                return
+        if text:
+            self.on_flush(text)
+    
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.pending = []
+
+class MessageBubble(RecycleDataViewBehavior, Widget):
+    # Пузырь - один виджет без дочерних: фон, аватар и текст нарисованы его канвой
+    # из готовых текстур, и при изменении размера окна на пузырь срабатывает
+    # один колбэк вместо разметки BoxLayout и колбэков каждого ребёнка
+    avatar_textures = {}
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.size_hint_y = None
+        self.is_user = False
+        
+        with self.canvas:
+            self.bg_color = Color(0.3, 0.3, 0.4, 0.8)
+            self.rect = RoundedRectangle(radius=[15])
+            Color(1, 1, 1, 1)
+            self.avatar_rect = Rectangle(size=(0, 0))
+            self.text_rect = Rectangle(size=(0, 0))
+        
+        self.bind(pos=self.update_canvas, size=self.update_canvas)
+    
+    @classmethod
+    def avatar_texture(cls, is_user):
+        # Две текстуры эмодзи на все пузыри - пока не загружены картинки аватаров
+        texture = cls.avatar_textures.get(is_user)
+        if texture is None:
+            label = CoreLabel(text="👤" if is_user else "🤖", font_size=sp(20))
+            label.refresh()
+            texture = cls.avatar_textures[is_user] = label.texture
+        return texture
+    
+    def refresh_view_attrs(self, rv, index, data):
+        self.is_user = data["is_user"]
+        if data.get("highlight"):
+            # Сообщение, к которому перешли из поиска
+            self.bg_color.rgba = (0.8, 0.6, 0.2, 0.9)
+        else:
+            self.bg_color.rgba = (0.2, 0.5, 0.8, 0.8) if self.is_user else (0.3, 0.3, 0.4, 0.8)
+        
+        # Картинка аватара общая на все пузыри; пока она грузится - эмодзи
+        avatar = avatar_textures.texture(rv.avatar_names[self.is_user])
+        if avatar is None:
+            avatar = self.avatar_texture(self.is_user)
+            self.avatar_rect.size = avatar.size
+        else:
+            self.avatar_rect.size = (sp(MESSAGE_AVATAR_SIZE), sp(MESSAGE_AVATAR_SIZE))
+        self.avatar_rect.texture = avatar
+        # Печатающийся ответ меняется каждый кадр - его промежуточные текстуры не кэшируем
+        store = not data.get("streaming", False)
+        texture = text_layouts.texture(data["text"], data["text_width"], store=store)
+        self.text_rect.texture = texture
+        self.text_rect.size = texture.size
+        
+        self.index = index
+        if self.height != data["height"]:
+            self.height = data["height"]
+        else:
+            self.update_canvas()
+    
+    def update_canvas(self, *args):
+        x, y = self.pos
+        width, height = self.size
         self.rect.pos = self.pos
         self.rect.size = self.size
+        
+        # Пользователь: аватар слева, текст за ним; ИИ: текст слева, аватар справа
+        avatar_width, avatar_height = self.avatar_rect.size
+        _, text_height = self.text_rect.size
+        column = sp(MESSAGE_AVATAR_WIDTH)
+        if self.is_user:
+            avatar_x = x + MESSAGE_PADDING[0] + (column - avatar_width) / 2
+            text_x = x + MESSAGE_PADDING[0] + column
+        else:
+            avatar_x = x + width - MESSAGE_PADDING[0] - (column + avatar_width) / 2
+            text_x = x + MESSAGE_PADDING[0]
+        self.avatar_rect.pos = (int(avatar_x), int(y + (height - avatar_height) / 2))
+        self.text_rect.pos = (int(text_x), int(y + (height - text_height) / 2))
 
 # 📱 ЭКРАН ЧАТА
 class ChatScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.config = Config()
+        self.config = Config.shared()
         self.ai_system = AISystem(self.config)
+        self.config.subscribe("theme", self.on_theme_changed)
+        self.history = ChatHistory()
+        self.usage_stats = UsageStats(self.history)
+        # Активный чат и несколько недавних держатся в памяти, остальные - только в базе
+        self.sessions = SessionCache(
+            max_in_memory=self.config.get("sessions.max_in_memory", 3),
+            on_evict=self.on_session_evicted
+        )
+        self.session = None
+        self.config.subscribe("sessions.max_in_memory", self.on_sessions_limit_changed)
+        self.config.subscribe("user_profile.avatar", self.on_avatars_changed)
+        self.config.subscribe("ai_character", self.on_avatars_changed)
+        avatar_textures.listeners.append(self.on_avatar_ready)
+        # Запросы, не ушедшие из-за сети, ждут в базе и повторяются в фоне
+        outbox_settings = self.config.get("outbox", {})
+        self.outbox = Outbox(
+            self.history,
+            self.send_outbox_entry,
+            on_delivered=mainthread(self.on_outbox_delivered),
+            on_failed=mainthread(self.on_outbox_failed),
+            base_delay=outbox_settings.get("base_delay_s", 2),
+            max_delay=outbox_settings.get("max_delay_s", 300),
+            max_attempts=outbox_settings.get("max_attempts", 0)
+        )
+        # Упреждающий ответ: запрос уходит после паузы в наборе, до нажатия "отправить"
+        speculation_settings = self.config.get("speculation", {})
+        self.speculator = Speculator(
+            self.start_speculation,
+            min_chars=speculation_settings.get("min_chars", 8),
+            max_per_minute=speculation_settings.get("max_per_minute", 6)
+        )
+        self._speculate = Clock.create_trigger(self.speculate, speculation_settings.get("debounce_ms", 600) / 1000)
+        self.config.subscribe("speculation", self.on_speculation_changed)
         self.setup_ui()
         self.apply_theme()
+        self.outbox.start()
+    
+    # Список сообщений, его разметка и очередь ответов активного чата
+    @property
+    def chat_history(self):
+        return self.session.view
+    
+    @property
+    def message_layout(self):
+        return self.session.layout
+    
+    @property
+    def scheduler(self):
+        return self.session.scheduler
     
     def setup_ui(self):
         main_layout = BoxLayout(orientation='vertical')
         
         # Верхняя панель
         top_panel = BoxLayout(size_hint_y=0.08, padding=[10, 5])
-        top_panel.add_widget(Label(text='[b]💬 Chai Clone[/b]', markup=True))
+        # Название активного чата; нажатие открывает список чатов
+        self.title_btn = Button(
+            text='[b]💬 Chai Clone[/b]',
+            markup=True,
+            background_color=(0, 0, 0, 0),
+            shorten=True,
+            on_press=self.show_sessions
+        )
+        self.title_btn.bind(size=lambda widget, size: setattr(widget, 'text_size', size))
+        top_panel.add_widget(self.title_btn)
         
+        # Сколько ответов ещё в очереди
+        self.queue_label = Label(text='', size_hint_x=0.2)
+        
+        search_btn = Button(text='🔍', size_hint_x=0.2, on_press=self.show_search)
         profile_btn = Button(text='👤', size_hint_x=0.2, on_press=self.go_to_profile)
         theme_btn = Button(text='🌙', size_hint_x=0.2, on_press=self.toggle_theme)
         
+        top_panel.add_widget(self.queue_label)
+        top_panel.add_widget(search_btn)
         top_panel.add_widget(profile_btn)
         top_panel.add_widget(theme_btn)
         
-        # История чата
-        self.chat_history = ScrollView()
-        self.message_layout = BoxLayout(orientation='vertical', size_hint_y=None, spacing=10, padding=[10, 10])
-        self.message_layout.bind(minimum_height=self.message_layout.setter('height'))
-        self.chat_history.add_widget(self.message_layout)
+        # Место списка сообщений: у каждого чата в памяти свой список, при
+        # переключении меняется только виджет в контейнере
+        self.chat_container = BoxLayout()
+        
+        self._scroll_to_bottom = Clock.create_trigger(self.scroll_to_bottom)
+        self._remeasure_messages = Clock.create_trigger(self.remeasure_messages, 0.2)
+        Window.bind(width=self._remeasure_messages)
         
         # Панель ввода
         input_panel = BoxLayout(size_hint_y=0.12, padding=[10, 5], spacing=10)
@@ -200,7 +544,7 @@ class ChatScreen(Screen):
             size_hint_x=0.7,
             background_color=(0.1, 0.1, 0.1, 1) if self.config.data["theme"] == "dark" else (1, 1, 1, 1)
         )
-        self.message_input.bind(on_text_validate=self.send_message)
+        self.message_input.bind(on_text_validate=self.send_message, text=self.on_input_text)
         
         send_btn = Button(
             text='📤',
@@ -221,13 +565,469 @@ class ChatScreen(Screen):
         input_panel.add_widget(ai_btn)
         
         main_layout.add_widget(top_panel)
-        main_layout.add_widget(self.chat_history)
+        main_layout.add_widget(self.chat_container)
         main_layout.add_widget(input_panel)
         
         self.add_widget(main_layout)
         
+        # Последний открытый чат
+        self.switch_session(self.config.get("sessions.active", DEFAULT_SESSION))
+        
         # Приветственное сообщение
-        Clock.schedule_once(self.show_welcome, 0.5)
+        if not self.chat_history.data:
+            Clock.schedule_once(self.show_welcome, 0.5)
+    
+    # 💬 ЧАТЫ
+    def open_session(self, row):
+        # Состояние чата в памяти: свой список сообщений, окно контекста и очередь ответов
+        session = ChatSession(row["id"], row["title"], row["persona"])
+        session.view = RecycleView()
+        session.view.avatar_names = self.avatar_names(session)
+        # viewclass задаётся у разметки: RecycleView передаёт его в layout_manager,
+        # которого в конструкторе ещё нет, и значение терялось
+        session.layout = RecycleBoxLayout(
+            viewclass=MessageBubble,
+            orientation='vertical',
+            size_hint_y=None,
+            default_size=(None, MESSAGE_MIN_HEIGHT),
+            default_size_hint=(1, None),
+            spacing=10,
+            padding=[10, 10]
+        )
+        session.layout.bind(minimum_height=session.layout.setter('height'))
+        session.view.add_widget(session.layout)
+        session.view.bind(scroll_y=self.on_history_scroll)
+        session.context = self.ai_system.make_context()
+        session.scheduler = ReplyScheduler(
+            start=self.start_reply,
+            deliver=self.deliver_reply,
+            max_in_flight=self.config.get("requests.max_in_flight", 2),
+            on_depth_changed=lambda depth: self.on_queue_depth_changed(depth, session)
+        )
+        return session
+    
+    def switch_session(self, session_id):
+        if self.session is not None and self.session.id == session_id:
+            return
+        started = time.perf_counter()
+        session = self.sessions.get(session_id)
+        opened = session is None
+        if opened:
+            # Чата нет в памяти - открываем с последней страницы
+            row = self.history.get_session(session_id) or self.history.list_sessions()[0]
+            session = self.open_session(row)
+            self.sessions.put(session)
+        
+        # Упреждённый ответ относился к прежнему чату
+        self.speculator.discard()
+        self.session = session
+        self.chat_container.clear_widgets()
+        self.chat_container.add_widget(session.view)
+        if opened:
+            page = self.load_last_page()
+            session.context.seed(page)
+        else:
+            # Пока чат был скрыт, могла смениться ширина окна
+            self._remeasure_messages()
+        
+        self.title_btn.text = f"[b]💬 {escape_markup(session.title)}[/b]"
+        self.on_queue_depth_changed(session.scheduler.depth(), session)
+        self.config.set("sessions.active", session.id)
+        registry.histogram("sessions.switch_ms").observe((time.perf_counter() - started) * 1000)
+        registry.counter("sessions.opened" if opened else "sessions.switched").inc()
+    
+    def on_session_evicted(self, session):
+        # Сообщения уже в базе - достаточно отпустить виджеты и историю в памяти
+        session.view.clear_widgets()
+        session.view = None
+        session.layout = None
+        session.context = None
+        session.scheduler = None
+        registry.counter("sessions.evicted").inc()
+    
+    def on_sessions_limit_changed(self, path, value):
+        self.sessions.resize(self.config.get("sessions.max_in_memory", 3))
+    
+    # 🔮 УПРЕЖДАЮЩИЙ ОТВЕТ
+    def on_speculation_changed(self, path, value):
+        settings = self.config.get("speculation", {})
+        self.speculator.configure(settings.get("min_chars", 8), settings.get("max_per_minute", 6))
+        self._speculate.cancel()
+        self._speculate = Clock.create_trigger(self.speculate, settings.get("debounce_ms", 600) / 1000)
+        if not settings.get("enabled", False):
+            self.speculator.discard()
+    
+    def on_input_text(self, instance, text):
+        # Каждое нажатие откладывает запрос: он уйдёт после паузы в наборе
+        if not self.config.get("speculation.enabled", False):
+            return
+        self._speculate.cancel()
+        self._speculate()
+    
+    def speculation_key(self, session):
+        # Ответ зависит не только от текста: чат, персонаж и история должны совпасть
+        character = self.session_character(session)
+        return (session.id, tuple(sorted(character.items())), session.context.version)
+    
+    def speculate(self, dt):
+        session = self.session
+        if session is None or session.busy or not self.config.get("speculation.enabled", False):
+            # Пока чат ждёт ответа, история успеет измениться - упреждать нечего
+            self.speculator.discard()
+            return
+        self.speculator.update(self.message_input.text, self.speculation_key(session))
+    
+    def start_speculation(self, speculation):
+        session = self.session
+        return self.ai_system.request_response(
+            speculation.prompt,
+            on_token=speculation.on_token,
+            on_result=speculation.on_result,
+            on_error=speculation.on_error,
+            character=self.session_character(session),
+            context=session.context
+        )
+    
+    def session_character(self, session):
+        return session.character(self.config.data["ai_character"])
+    
+    def avatar_names(self, session):
+        # Аватар ИИ: свой у персонажа в настройках, иначе - из пакета его характера
+        character = self.session_character(session)
+        ai_avatar = character.get("avatar") or self.ai_system.personas.avatar(character["personality"])
+        return {
+            True: self.config.get("user_profile.avatar") or USER_AVATAR,
+            False: ai_avatar or AI_AVATAR
+        }
+    
+    def update_avatars(self, session):
+        names = self.avatar_names(session)
+        if names != session.view.avatar_names:
+            session.view.avatar_names = names
+            session.view.refresh_from_data()
+    
+    def on_avatars_changed(self, path, value):
+        for session in self.sessions:
+            self.update_avatars(session)
+    
+    def on_avatar_ready(self, avatar):
+        # Картинка догрузилась - перерисовываем пузыри чатов, где она видна
+        for session in self.sessions:
+            if avatar in session.view.avatar_names.values():
+                session.view.refresh_from_data()
+    
+    def create_session(self, persona=None):
+        number = self.config.data["user_profile"]["chats_created"] + 1
+        session_id = self.history.create_session(f"Чат {number}", persona)
+        self.config.set("user_profile.chats_created", number)
+        self.switch_session(session_id)
+        self.show_welcome(0)
+    
+    def delete_session(self, session_id):
+        sessions = self.history.list_sessions()
+        if len(sessions) < 2:
+            return
+        if self.session.id == session_id:
+            self.switch_session(next(row["id"] for row in sessions if row["id"] != session_id))
+        session = self.sessions.discard(session_id)
+        if session is not None:
+            session.scheduler.cancel_all()
+            self.on_session_evicted(session)
+        self.history.delete_session(session_id)
+    
+    def save_session(self, session_id, title, persona):
+        # persona - переопределённые поля персонажа; пустой словарь - общие настройки
+        self.history.update_session(session_id, title=title, persona=persona)
+        session = self.sessions.sessions.get(session_id)
+        if session is not None:
+            session.title = title
+            session.persona = persona or None
+            self.update_avatars(session)
+        if session is self.session:
+            self.title_btn.text = f"[b]💬 {escape_markup(title)}[/b]"
+    
+    def show_sessions(self, instance):
+        from kivy.uix.popup import Popup
+        from kivy.uix.spinner import Spinner
+        content = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        
+        new_panel = BoxLayout(size_hint_y=None, height=45, spacing=10)
+        persona_spinner = Spinner(
+            text='общий',
+            values=('общий',) + tuple(self.ai_system.personas.names()),
+            size_hint_x=0.4
+        )
+        new_btn = Button(text='➕ Новый чат', background_color=(0.2, 0.8, 0.2, 1))
+        new_panel.add_widget(new_btn)
+        new_panel.add_widget(persona_spinner)
+        
+        rows = BoxLayout(orientation='vertical', size_hint_y=None, spacing=5)
+        rows.bind(minimum_height=rows.setter('height'))
+        scroll = ScrollView()
+        scroll.add_widget(rows)
+        
+        content.add_widget(new_panel)
+        content.add_widget(scroll)
+        popup = Popup(title='💬 Чаты', content=content, size_hint=(0.9, 0.85))
+        
+        def create(*args):
+            popup.dismiss()
+            personality = persona_spinner.text
+            self.create_session(None if personality == 'общий' else {"personality": personality})
+        
+        def refresh():
+            rows.clear_widgets()
+            sessions = self.history.list_sessions()
+            for row in sessions:
+                rows.add_widget(self.make_session_row(row, popup, refresh, can_delete=len(sessions) > 1))
+        
+        new_btn.bind(on_press=create)
+        refresh()
+        popup.open()
+    
+    def make_session_row(self, row, popup, refresh, can_delete):
+        panel = BoxLayout(size_hint_y=None, height=55, spacing=5)
+        active = row["id"] == self.session.id
+        personality = (row["persona"] or {}).get("personality", "")
+        when = datetime.fromtimestamp(row["updated_at"]).strftime('%d.%m %H:%M')
+        open_btn = Button(
+            text=f"{'▶ ' if active else ''}[b]{escape_markup(row['title'])}[/b]  {when}  {personality}",
+            markup=True,
+            halign='left',
+            valign='middle',
+            shorten=True,
+            shorten_from='right'
+        )
+        open_btn.bind(size=lambda widget, size: setattr(widget, 'text_size', size))
+        edit_btn = Button(text='✏️', size_hint_x=None, width=50)
+        delete_btn = Button(text='🗑', size_hint_x=None, width=50, disabled=not can_delete)
+        
+        def switch(*args):
+            popup.dismiss()
+            self.switch_session(row["id"])
+        
+        def delete(*args):
+            self.delete_session(row["id"])
+            refresh()
+        
+        open_btn.bind(on_press=switch)
+        edit_btn.bind(on_press=lambda *args: self.show_session_settings(row, refresh))
+        delete_btn.bind(on_press=delete)
+        panel.add_widget(open_btn)
+        panel.add_widget(edit_btn)
+        panel.add_widget(delete_btn)
+        return panel
+    
+    def show_session_settings(self, row, on_saved):
+        # Название чата и свой персонаж; "общий" - как в настройках ИИ
+        from kivy.uix.popup import Popup
+        from kivy.uix.spinner import Spinner
+        persona = row["persona"] or {}
+        content = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        title_input = TextInput(text=row["title"], multiline=False, size_hint_y=None, height=45)
+        personality_spinner = Spinner(
+            text=persona.get("personality", 'общий'),
+            values=('общий',) + tuple(self.ai_system.personas.names()),
+            size_hint_y=None,
+            height=45
+        )
+        style_spinner = Spinner(
+            text=persona.get("style", 'общий'),
+            values=('общий',) + tuple(self.ai_system.personas.styles()),
+            size_hint_y=None,
+            height=45
+        )
+        save_btn = Button(text='💾 Сохранить', size_hint_y=None, height=50, background_color=(0.2, 0.8, 0.2, 1))
+        
+        content.add_widget(Label(text='Название:', size_hint_y=None, height=30))
+        content.add_widget(title_input)
+        content.add_widget(Label(text='Характер:', size_hint_y=None, height=30))
+        content.add_widget(personality_spinner)
+        content.add_widget(Label(text='Стиль:', size_hint_y=None, height=30))
+        content.add_widget(style_spinner)
+        content.add_widget(save_btn)
+        popup = Popup(title='✏️ Чат', content=content, size_hint=(0.8, 0.7))
+        
+        def save(*args):
+            changes = {field: spinner.text for field, spinner in
+                       (("personality", personality_spinner), ("style", style_spinner)) if spinner.text != 'общий'}
+            self.save_session(row["id"], title_input.text.strip() or row["title"], changes)
+            popup.dismiss()
+            on_saved()
+        
+        save_btn.bind(on_press=save)
+        popup.open()
+    
+    def load_last_page(self):
+        session = self.session
+        page = self.history.load_last_page(session.id)
+        session.has_older_messages = len(page) == self.history.page_size
+        session.has_newer_messages = False
+        if page:
+            session.oldest_loaded_id = page[0]["id"]
+            session.newest_loaded_id = page[-1]["id"]
+        messages = [self.make_message(row["text"], row["is_user"], row["id"]) for row in page]
+        # Ответов из очереди и тех, что ещё печатаются, в базе пока нет - возвращаем их пузыри
+        for entry in self.outbox.pending(session.id):
+            if entry["id"] not in session.outbox:
+                session.outbox[entry["id"]] = self.make_outbox_message(entry["id"])
+            messages.append(session.outbox[entry["id"]])
+        messages.extend(job.reply_msg for job in session.scheduler.jobs)
+        session.view.data = messages
+        self._scroll_to_bottom()
+        return page
+    
+    def on_history_scroll(self, instance, value):
+        session = self.session
+        if instance is not session.view or not session.view.data:
+            return
+        if value >= 1 and session.has_older_messages:
+            self.load_older_messages()
+        elif value <= 0 and session.has_newer_messages:
+            self.load_newer_messages()
+    
+    def load_older_messages(self):
+        session = self.session
+        page = self.history.load_page_before(session.oldest_loaded_id, session_id=session.id)
+        session.has_older_messages = len(page) == self.history.page_size
+        if not page:
+            return
+        
+        session.oldest_loaded_id = page[0]["id"]
+        older = [self.make_message(row["text"], row["is_user"], row["id"]) for row in page]
+        
+        # Сохраняем видимую позицию: расстояние от низа списка не меняется
+        viewport = self.chat_history.height
+        old_height = self.message_layout.height
+        added_height = sum(message["height"] for message in older) + self.message_layout.spacing * len(older)
+        self.chat_history.data[0:0] = older
+        
+        new_height = old_height + added_height
+        if new_height > viewport:
+            self.chat_history.scroll_y = max(0, old_height - viewport) / (new_height - viewport)
+    
+    def load_newer_messages(self):
+        session = self.session
+        page = self.history.load_page_after(session.newest_loaded_id, session_id=session.id)
+        if len(page) < self.history.page_size:
+            # Дошли до конца истории - дальше список снова живой
+            self.load_last_page()
+            return
+        
+        session.newest_loaded_id = page[-1]["id"]
+        newer = [self.make_message(row["text"], row["is_user"], row["id"]) for row in page]
+        
+        # Сохраняем видимую позицию: расстояние от верха списка не меняется
+        viewport = self.chat_history.height
+        old_height = self.message_layout.height
+        added_height = sum(message["height"] for message in newer) + self.message_layout.spacing * len(newer)
+        self.chat_history.data.extend(newer)
+        
+        new_height = old_height + added_height
+        if new_height > viewport:
+            self.chat_history.scroll_y = 1 - max(0, old_height - viewport) / (new_height - viewport)
+    
+    # 🔍 ПОИСК
+    def show_search(self, instance):
+        from kivy.uix.popup import Popup
+        content = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        query_input = TextInput(hint_text='Поиск по сообщениям...', multiline=False, size_hint_y=None, height=45)
+        status_label = Label(size_hint_y=None, height=25, font_size=sp(12))
+        results = BoxLayout(orientation='vertical', size_hint_y=None, spacing=5)
+        results.bind(minimum_height=results.setter('height'))
+        scroll = ScrollView()
+        scroll.add_widget(results)
+        
+        content.add_widget(query_input)
+        content.add_widget(status_label)
+        content.add_widget(scroll)
+        popup = Popup(title='🔍 Поиск', content=content, size_hint=(0.9, 0.85))
+        
+        def run_search(*args):
+            results.clear_widgets()
+            started = time.perf_counter()
+            found = self.history.search(query_input.text)
+            elapsed = (time.perf_counter() - started) * 1000
+            registry.histogram("history.search_ms").observe(elapsed)
+            if query_input.text.strip():
+                status_label.text = f"Найдено: {len(found)} ({elapsed:.1f} мс)"
+            titles = {row["id"]: row["title"] for row in self.history.list_sessions()} if found else {}
+            for row in found:
+                results.add_widget(self.make_search_result(row, popup, titles))
+        
+        # Поиск на ходу, но не на каждое нажатие клавиши
+        search_trigger = Clock.create_trigger(run_search, 0.25)
+        query_input.bind(text=lambda *args: search_trigger())
+        query_input.bind(on_text_validate=run_search)
+        popup.open()
+        query_input.focus = True
+    
+    def make_search_result(self, row, popup, titles):
+        # Совпадения подсвечены маркерами истории; остальной текст экранируем от разметки Kivy
+        snippet = escape_markup(row["snippet"])
+        snippet = snippet.replace(MATCH_START, "[b][color=ffd54f]").replace(MATCH_END, "[/color][/b]")
+        when = datetime.fromtimestamp(row["created_at"]).strftime('%d.%m %H:%M')
+        # Сообщение из другого чата - с его названием
+        chat = "" if row["session_id"] == self.session.id else f"[{escape_markup(titles.get(row['session_id'], ''))}] "
+        button = Button(
+            text=f"{'👤' if row['is_user'] else '🤖'} {when}  {chat}{snippet}",
+            markup=True,
+            size_hint_y=None,
+            height=60,
+            halign='left',
+            valign='middle',
+            shorten=True,
+            shorten_from='right'
+        )
+        button.bind(size=lambda widget, size: setattr(widget, 'text_size', size))
+        
+        def jump(*args):
+            popup.dismiss()
+            self.jump_to_message(row["id"], row["session_id"])
+        
+        button.bind(on_press=jump)
+        return button
+    
+    def jump_to_message(self, message_id, session_id=None):
+        # Загружаем только страницу вокруг найденного сообщения
+        if session_id is not None:
+            self.switch_session(session_id)
+        session = self.session
+        page = self.history.load_around(message_id, session_id=session.id)
+        if not page:
+            return
+        session.oldest_loaded_id = page[0]["id"]
+        session.newest_loaded_id = page[-1]["id"]
+        session.has_older_messages = True
+        session.has_newer_messages = True
+        
+        messages = [self.make_message(row["text"], row["is_user"], row["id"]) for row in page]
+        index = next((i for i, message in enumerate(messages) if message["id"] == message_id), 0)
+        messages[index]["highlight"] = True
+        self.chat_history.data = messages
+        Clock.schedule_once(lambda dt: self.scroll_to_message(index))
+        
+        def clear_highlight(dt):
+            target = messages[index]
+            if target.pop("highlight", None) and session.view is not None:
+                position = self.find_message_index(target, session)
+                if position is not None:
+                    session.view.data[position] = target
+        
+        Clock.schedule_once(clear_highlight, 2)
+    
+    def scroll_to_message(self, index):
+        # Высоты пузырей известны заранее, поэтому позиция считается без ожидания разметки
+        data = self.chat_history.data
+        spacing = self.message_layout.spacing
+        padding = self.message_layout.padding[1]
+        total = 2 * padding + sum(message["height"] for message in data) + spacing * (len(data) - 1)
+        viewport = self.chat_history.height
+        if total <= viewport:
+            return
+        top = padding + sum(message["height"] + spacing for message in data[:index])
+        offset = top + data[index]["height"] / 2 - viewport / 2
+        self.chat_history.scroll_y = 1 - min(max(0, offset), total - viewport) / (total - viewport)
     
     def show_welcome(self, dt):
         welcome_msg = "Привет! Я твой ИИ-помощник. Напиши мне что-нибудь, и я отвечу!"
@@ -240,11 +1040,13 @@ class ChatScreen(Screen):
             Window.clearcolor = (0.95, 0.95, 0.95, 1)
     
     def toggle_theme(self, instance):
-        self.config.data["theme"] = "light" if self.config.data["theme"] == "dark" else "dark"
-        self.config.save_config()
-        self.apply_theme()
+        self.config.set("theme", "light" if self.config.data["theme"] == "dark" else "dark")
         self.show_popup("Тема", "Тема изменена!")
     
+    def on_theme_changed(self, path, value):
+        self.apply_theme()
+        self.message_input.background_color = (0.1, 0.1, 0.1, 1) if value == "dark" else (1, 1, 1, 1)
+    
     def go_to_profile(self, instance):
         self.manager.current = 'profile'
     
@@ -256,70 +1058,248 @@ class ChatScreen(Screen):
         if not message:
             return
         
-        # Сообщение пользователя
-        self.add_message(message, is_user=True)
-        self.message_input.text = ""
-        
-        # Имитация загрузки ИИ
-        thinking_msg = self.add_message("ИИ печатает...", is_user=False)
-        
-        # Ответ ИИ
-        Clock.schedule_once(lambda dt: self.ai_response(message, thinking_msg), 1)
-    
-    def ai_response(self, user_message, thinking_msg):
-        self.message_layout.remove_widget(thinking_msg)
-        
-        response = self.ai_system.generate_response(user_message)
-        self.add_message(response, is_user=False)
+        # Упреждённый ответ забираем до очистки поля ввода, иначе она его отменит
+        session = self.session
+        self._speculate.cancel()
+        speculation = self.speculator.take(message, self.speculation_key(session))
         
-        # Обновляем статистику
-        self.config.data["user_profile"]["messages_sent"] += 1
-        self.config.data["user_profile"]["xp"] += random.randint(5, 15)
+        # Открыта страница из середины истории - возвращаемся к последним сообщениям
+        if session.has_newer_messages:
+            self.load_last_page()
         
-        # Повышение уровня
-        if self.config.data["user_profile"]["xp"] >= 100:
-            self.config.data["user_profile"]["level"] += 1
-            self.config.data["user_profile"]["xp"] = 0
-            self.show_popup("Уровень повышен!", f"Теперь у тебя {self.config.data['user_profile']['level']} уровень!")
+        # Сообщение пользователя
+        message_id = self.history.append(message, is_user=True, session_id=session.id)
+        self.add_message(message, is_user=True, message_id=message_id)
+        self.message_input.text = ""
+        self.usage_stats.record_message(self.session_character(session)["personality"], message)
+        
+        # Запрос ещё ждёт в очереди - сообщение уходит вместе с ним,
+        # а его пузырь ответа переезжает под последнее сообщение
+        job = session.scheduler.merge(message)
+        if job is not None:
+            if speculation is not None:
+                self.speculator.waste(speculation)
+            self.remove_message(job.reply_msg)
+            self.chat_history.data.append(job.reply_msg)
+            return
         
-        self.config.save_config()
+        # Пузырь ответа: "ИИ печатает..." заменяется первыми токенами.
+        # Ответ допечатывается в свой чат, даже если пользователь уже переключился
+        job = ReplyJob(message)
+        job.session = session
+        job.speculation = speculation
+        job.reply_msg = self.add_message("ИИ печатает...", is_user=False)
+        job.reply_msg["placeholder"] = True
+        job.stream = StreamingReply(lambda text: self.append_reply_text(job.reply_msg, text, session))
+        session.scheduler.submit(job)
     
-    def add_message(self, text, is_user=False):
-        message_layout = BoxLayout(
-            size_hint_y=None, 
-            height=60, 
-            padding=[15, 5],
-            orientation='horizontal' if is_user else 'horizontal-reverse'
+    def start_reply(self, job):
+        # Токены и итог приходят из рабочего потока и возвращаются в UI через Clock
+        first_token = registry.histogram("reply.first_token_ms")
+        
+        def on_token(token):
+            if job.first_token_at is None:
+                job.first_token_at = time.perf_counter()
+                first_token.observe((job.first_token_at - job.created_at) * 1000)
+            job.stream.push(token)
+        
+        # Очередь запоминается сразу: удалённый чат отпускает её, а поздний ответ она отбросит
+        session = job.session
+        scheduler = session.scheduler
+        on_result = mainthread(lambda text: scheduler.complete(job, text))
+        on_error = mainthread(lambda error: scheduler.fail(job, error))
+        if job.speculation is not None:
+            # Ответ запрошен, пока пользователь печатал: накопленные токены выводятся сразу
+            return job.speculation.adopt(on_token, on_result, on_error)
+        return self.ai_system.request_response(
+            job.prompt,
+            on_token=on_token,
+            on_result=on_result,
+            on_error=on_error,
+            character=self.session_character(session),
+            context=session.context
         )
-        
-        with message_layout.canvas.before:
-            if is_user:
-                Color(0.2, 0.5, 0.8, 0.8)
-            else:
-                Color(0.3, 0.3, 0.4, 0.8)
-            message_layout.rect = RoundedRectangle(pos=message_layout.pos, size=message_layout.size, radius=[15])
-        
-        message_layout.bind(pos=self.update_message_rect, size=self.update_message_rect)
-        
-        avatar = Label(text="👤" if is_user else "🤖", font_size='20sp')
-        message_label = Label(
-            text=text,
-            text_size=(Window.width * 0.7, None),
-            size_hint_x=0.8
+    
+    def deliver_reply(self, job):
+        # Вызывается в порядке отправки сообщений
+        latency_ms = (time.perf_counter() - job.created_at) * 1000
+        registry.histogram("reply.latency_ms").observe(latency_ms)
+        registry.histogram("reply.queue_ms").observe(((job.started_at or job.created_at) - job.created_at) * 1000)
+        session = job.session
+        persona = self.session_character(session)["personality"]
+        if job.error is not None:
+            registry.counter("reply.errors").inc()
+            self.usage_stats.record_error(persona)
+            self.ai_error(job.prompt, job.reply_msg, job.stream, job.error, session)
+        else:
+            self.usage_stats.record_reply(persona, job.result, latency_ms)
+            self.ai_response(job.prompt, job.reply_msg, job.stream, job.result, session)
+            # Запрос прошёл - значит, связь есть и очередь можно повторить сразу
+            self.outbox.wake(reset=True)
+        # Чат, который держали в памяти ради этого ответа, теперь можно вытеснить
+        Clock.schedule_once(lambda dt: self.sessions.evict())
+    
+    def on_queue_depth_changed(self, depth, session):
+        if session is self.session:
+            self.queue_label.text = f"⏳ {depth}" if depth else ""
+    
+    def append_reply_text(self, reply_msg, text, session=None):
+        reply_msg["streaming"] = True
+        if reply_msg.pop("placeholder", False):
+            self.update_message(reply_msg, text, session)
+        else:
+            self.update_message(reply_msg, reply_msg["text"] + text, session)
+    
+    def ai_error(self, user_message, reply_msg, stream, error, session=None):
+        Logger.warning(f"AISystem: {error}")
+        session = session or self.session
+        if reply_msg.get("placeholder") and isinstance(error, ProviderUnavailable) and self.config.get("outbox.enabled", True):
+            # Нет сети до первого токена - запрос ждёт в очереди, ответ придёт в этот чат
+            stream.close()
+            entry = self.outbox.add(session.id, user_message, self.session_character(session))
+            session.outbox[entry["id"]] = reply_msg
+            reply_msg["outbox"] = entry["id"]
+            self.update_message(reply_msg, OUTBOX_TEXT, session)
+            registry.counter("outbox.queued").inc()
+            return
+        if reply_msg.get("placeholder"):
+            # Облако недоступно до первого токена - отвечаем локально, не в потоке UI
+            def on_local(response):
+                self.ai_response(user_message, reply_msg, stream, response, session)
+            
+            self.ai_system.local_response(user_message, mainthread(on_local), character=self.session_character(session))
+            return
+        self.ai_response(user_message, reply_msg, stream, reply_msg["text"] + " ⚠️", session)
+    
+    def ai_response(self, user_message, reply_msg, stream, response, session=None):
+        session = session or self.session
+        stream.close()
+        reply_msg.pop("placeholder", None)
+        reply_msg.pop("streaming", None)
+        reply_msg["id"] = self.history.append(response, is_user=False, session_id=session.id)
+        self.update_message(reply_msg, response, session)
+        self.ai_system.record_exchange(user_message, response, session.context)
+        self.reward_reply()
+    
+    def reward_reply(self):
+        # Обновляем статистику; опыт и уровни - по правилам ядра, общим с сервером
+        changes = award_reply(self.config.data["user_profile"])
+        if "level" in changes:
+            self.show_popup("Уровень повышен!", f"Теперь у тебя {changes['level']} уровень!")
+        self.config.update({f"user_profile.{field}": value for field, value in changes.items()})
+    
+    # 📮 ОЧЕРЕДЬ НЕОТПРАВЛЕННЫХ ЗАПРОСОВ
+    def make_outbox_message(self, entry_id):
+        message = self.make_message(OUTBOX_TEXT, False)
+        message["placeholder"] = True
+        message["outbox"] = entry_id
+        return message
+    
+    def send_outbox_entry(self, entry, on_result, on_error):
+        # Вызывается в потоке очереди; история чата - если он сейчас в памяти
+        session = self.sessions.sessions.get(entry["session_id"])
+        return self.ai_system.request_response(
+            entry["prompt"], on_result, on_error,
+            character=entry["character"],
+            context=session.context if session is not None else None
         )
+    
+    def on_outbox_delivered(self, entry, message_id, text):
+        # Ответ уже сохранён в свой чат; опыт и статистика - как за обычный ответ
+        registry.counter("outbox.delivered").inc()
+        self.usage_stats.record_reply(outbox_persona(entry), text, entry.get("latency_ms", 0.0))
+        self.reward_reply()
+        self.show_outbox_reply(entry, message_id, text)
+    
+    def show_outbox_reply(self, entry, message_id, text):
+        # Если чат не в памяти, ответ появится при открытии
+        session = self.sessions.sessions.get(entry["session_id"])
+        if session is None or session.view is None:
+            return
+        session.context.add_turn("user", entry["prompt"])
+        session.context.add_turn("assistant", text)
+        reply_msg = session.outbox.pop(entry["id"], None)
+        if reply_msg is not None:
+            reply_msg.pop("placeholder", None)
+            reply_msg.pop("outbox", None)
+            reply_msg["id"] = message_id
+            self.update_message(reply_msg, text, session)
+        elif not session.has_newer_messages:
+            session.view.data.append(self.make_message(text, False, message_id))
+    
+    def on_outbox_failed(self, entry, error):
+        # Сервис отказал не из-за сети - отвечаем локально, как при обычной ошибке
+        Logger.warning(f"Outbox: {error}")
+        registry.counter("outbox.failed").inc()
+        self.usage_stats.record_error(outbox_persona(entry))
+        
+        def on_local(response):
+            message_id = self.history.append(response, is_user=False, session_id=entry["session_id"])
+            self.reward_reply()
+            self.show_outbox_reply(entry, message_id, response)
+        
+        self.ai_system.local_response(entry["prompt"], mainthread(on_local), character=entry["character"])
+    
+    def make_message(self, text, is_user, message_id=None):
+        width = message_text_width()
+        return {
+            "id": message_id,
+            "text": text,
+            "is_user": is_user,
+            "text_width": width,
+            "height": measure_message_height(text, width)
+        }
+    
+    def add_message(self, text, is_user=False, message_id=None):
+        message = self.make_message(text, is_user, message_id)
+        self.chat_history.data.append(message)
         
-        message_layout.add_widget(avatar)
-        message_layout.add_widget(message_label)
-        self.message_layout.add_widget(message_layout)
-        
-        self.chat_history.scroll_to(message_layout)
-        return message_layout
+        self._scroll_to_bottom()
+        return message
+    
+    def find_message_index(self, message, session=None):
+        # Изменяемые сообщения (ответ, который печатается) почти всегда в конце
+        data = (session or self.session).data
+        for index in range(len(data) - 1, -1, -1):
+            if data[index] is message:
+                return index
+        return None
+    
+    def update_message(self, message, text, session=None):
+        session = session or self.session
+        message["text"] = text
+        message["height"] = measure_message_height(text, message["text_width"], store=not message.get("streaming"))
+        index = self.find_message_index(message, session)
+        if index is not None:
+            session.view.data[index] = message
+            if session is self.session:
+                self._scroll_to_bottom()
+    
+    def remove_message(self, message):
+        index = self.find_message_index(message)
+        if index is not None:
+            del self.chat_history.data[index]
+    
+    def scroll_to_bottom(self, *args):
+        self.chat_history.scroll_y = 0
     
-    def update_message_rect(self, instance, value):
-        instance.rect.pos = instance.pos
-        instance.rect.size = instance.size
+    def remeasure_messages(self, *args):
+        # Ширина окна изменилась (поворот экрана) - пересчитываем высоты пузырей.
+        # Высоты кэшируются по корзине ширины: повторные повороты берут их из кэша,
+        # а первая новая ширина размечает все загруженные сообщения
+        width = message_text_width()
+        data = self.chat_history.data
+        if not data or data[-1]["text_width"] == width:
+            return
+        
+        text_layouts.clear_textures()
+        for message in self.chat_history.data:
+            message["text_width"] = width
+            message["height"] = measure_message_height(message["text"], width)
+        self.chat_history.refresh_from_data()
     
     def show_popup(self, title, message):
+        from kivy.uix.popup import Popup
         popup = Popup(
             title=title,
             content=Label(text=message),
@@ -331,7 +1311,7 @@ class ChatScreen(Screen):
 class ProfileScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.config = Config()
+        self.config = Config.shared()
         self.setup_ui()
     
     def setup_ui(self):
@@ -349,19 +1329,22 @@ class ProfileScreen(Screen):
         profile_content.bind(minimum_height=profile_content.setter('height'))
         
         # Карточка профиля
-        profile_card = ProfileCard(self.config.data["user_profile"])
-        profile_content.add_widget(profile_card)
+        self.profile_card = ProfileCard(self.config.data["user_profile"])
+        profile_content.add_widget(self.profile_card)
+        self.config.subscribe("user_profile", self.on_profile_changed)
         
         # Действия
         actions_label = Label(text='[b]Действия:[/b]', markup=True, size_hint_y=None, height=30)
         profile_content.add_widget(actions_label)
         
-        actions = BoxLayout(orientation='vertical', size_hint_y=None, height=200, spacing=10)
+        actions = BoxLayout(orientation='vertical', size_hint_y=None, height=270, spacing=10)
         
+        avatar_btn = Button(text='🖼 Аватар', on_press=self.show_avatar_picker)
         ai_settings_btn = Button(text='⚙️ Настройки ИИ', on_press=self.go_to_ai_settings)
         admin_btn = Button(text='🔧 Админ-панель', on_press=self.go_to_admin)
         stats_btn = Button(text='📊 Статистика', on_press=self.show_stats)
         
+        actions.add_widget(avatar_btn)
         actions.add_widget(ai_settings_btn)
         actions.add_widget(admin_btn)
         actions.add_widget(stats_btn)
@@ -374,6 +1357,9 @@ class ProfileScreen(Screen):
         
         self.add_widget(layout)
     
+    def on_profile_changed(self, path, value):
+        self.profile_card.update_field(path.split('.')[-1], value)
+    
     def go_to_chat(self, instance):
         self.manager.current = 'chat'
     
@@ -385,6 +1371,7 @@ class ProfileScreen(Screen):
         self.show_password_popup()
     
     def show_password_popup(self):
+        from kivy.uix.popup import Popup
         content = BoxLayout(orientation='vertical', spacing=10, padding=10)
         password_input = TextInput(hint_text='Введите пароль', password=True)
         submit_btn = Button(text='Войти', on_press=lambda x: self.check_password(password_input.text))
@@ -402,8 +1389,50 @@ class ProfileScreen(Screen):
         else:
             self.show_popup("Ошибка", "Неверный пароль!")
     
+    def show_avatar_picker(self, instance):
+        # Встроенный аватар из атласа или путь к своей картинке (уменьшится до миниатюры)
+        from kivy.uix.popup import Popup
+        from kivy.uix.spinner import Spinner
+        current = self.config.get("user_profile.avatar") or USER_AVATAR
+        builtin = avatar_textures.catalog.builtin_names()
+        content = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        avatar_spinner = Spinner(
+            text=current if current in builtin else USER_AVATAR,
+            values=tuple(builtin),
+            size_hint_y=None,
+            height=45
+        )
+        path_input = TextInput(
+            text='' if current in builtin else current,
+            hint_text='Путь к своей картинке (PNG, JPG)',
+            multiline=False,
+            size_hint_y=None,
+            height=45
+        )
+        save_btn = Button(text='💾 Сохранить', size_hint_y=None, height=50, background_color=(0.2, 0.8, 0.2, 1))
+        
+        content.add_widget(Label(text='Встроенный:', size_hint_y=None, height=30))
+        content.add_widget(avatar_spinner)
+        content.add_widget(Label(text='Или своя картинка:', size_hint_y=None, height=30))
+        content.add_widget(path_input)
+        content.add_widget(save_btn)
+        popup = Popup(title='🖼 Аватар', content=content, size_hint=(0.8, 0.6))
+        
+        def save(*args):
+            path = path_input.text.strip()
+            if path and not os.path.isfile(path):
+                self.show_popup("Ошибка", f"Файл не найден: {path}")
+                return
+            self.config.set("user_profile.avatar", path or avatar_spinner.text)
+            popup.dismiss()
+        
+        save_btn.bind(on_press=save)
+        popup.open()
+    
     def show_stats(self, instance):
+        # Сводки обновляются по мере событий - здесь только чтение готовых агрегатов
         stats = self.config.data["user_profile"]
+        usage = self.manager.get_screen('chat').usage_stats.summary()
         stats_text = f"""
 [b]Статистика:[/b]
 
@@ -412,14 +1441,38 @@ class ProfileScreen(Screen):
 • Сообщений отправлено: {stats['messages_sent']}
 • Чатов создано: {stats['chats_created']}
 • Статус: {stats['status']}
+
+[b]Активность:[/b]
+• Всего сообщений: {usage['messages']}, ответов: {usage['replies']}, ошибок: {usage['errors']}
+• Средняя длина: ваша {usage['avg_message_chars']:.0f}, ответа {usage['avg_reply_chars']:.0f} симв.
+• Время ответа: {self.latency_text(usage)}
+• Самый активный час: {'—' if usage['busiest_hour'] is None else f"{usage['busiest_hour']}:00"}
 """
-        self.show_popup("📊 Статистика", stats_text)
+        peak = max([messages for _, (messages, _) in usage["per_day"]] + [1])
+        stats_text += "\n[b]За неделю:[/b]\n"
+        for day, (messages, replies) in usage["per_day"]:
+            bar = "▇" * round(10 * messages / peak)
+            stats_text += f"{day.strftime('%d.%m')} {bar} {messages}\n"
+        if usage["personas"]:
+            stats_text += "\n[b]По персонажам:[/b]\n"
+            for row in usage["personas"][:4]:
+                stats_text += f"• {row['persona']}: {row['messages']} сообщ., {row['replies']} ответов\n"
+        self.show_popup("📊 Статистика", stats_text, size_hint=(0.9, 0.9))
     
-    def show_popup(self, title, message):
+    def latency_text(self, usage):
+        if usage["avg_latency_ms"] is None:
+            return "нет данных"
+        p50 = usage["latency_p50_ms"]
+        p95 = usage["latency_p95_ms"]
+        return (f"в среднем {usage['avg_latency_ms'] / 1000:.1f} с, "
+                f"p50 ≤ {'—' if p50 is None else p50 / 1000}, p95 ≤ {'—' if p95 is None else p95 / 1000} с")
+    
+    def show_popup(self, title, message, size_hint=(0.8, 0.6)):
+        from kivy.uix.popup import Popup
         popup = Popup(
             title=title,
             content=Label(text=message, markup=True),
-            size_hint=(0.8, 0.6)
+            size_hint=size_hint
         )
         popup.open()
 
@@ -427,10 +1480,13 @@ class ProfileScreen(Screen):
 class AISettingsScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.config = Config()
+        self.config = Config.shared()
         self.setup_ui()
     
     def setup_ui(self):
+        from kivy.uix.spinner import Spinner
+        from kivy.uix.switch import Switch
+        
         layout = BoxLayout(orientation='vertical')
         
         header = BoxLayout(size_hint_y=0.1, padding=[10, 5])
@@ -455,10 +1511,13 @@ class AISettingsScreen(Screen):
         # Характер
         personality_layout = BoxLayout(size_hint_y=None, height=50)
         personality_layout.add_widget(Label(text='Характер:'))
+        # Списки - из индекса пакетов персонажей, сами пакеты не читаются
+        personas = PersonaLibrary.shared()
         self.personality_spinner = Spinner(
             text=self.config.data["ai_character"]["personality"],
-            values=('дружелюбный', 'профессиональный', 'веселый', 'заботливый')
+            values=tuple(personas.names())
         )
+        self.personality_spinner.bind(text=self.on_personality_selected)
         personality_layout.add_widget(self.personality_spinner)
         
         # Стиль
@@ -466,7 +1525,7 @@ class AISettingsScreen(Screen):
         style_layout.add_widget(Label(text='Стиль:'))
         self.style_spinner = Spinner(
             text=self.config.data["ai_character"]["style"],
-            values=('разговорный', 'формальный', 'креативный')
+            values=tuple(personas.styles(self.config.data["ai_character"]["personality"]))
         )
         style_layout.add_widget(self.style_spinner)
         
@@ -482,16 +1541,91 @@ class AISettingsScreen(Screen):
         openai_layout = BoxLayout(size_hint_y=None, height=50)
         openai_layout.add_widget(Label(text='OpenAI:'))
         self.openai_switch = Switch(active=self.config.data["cloud_services"]["openai"]["enabled"])
-        openai_key_input = TextInput(
+        self.openai_key_input = TextInput(
             hint_text='API ключ OpenAI',
             text=self.config.data["cloud_services"]["openai"]["api_key"],
             password=True
         )
         openai_layout.add_widget(self.openai_switch)
-        openai_layout.add_widget(openai_key_input)
+        openai_layout.add_widget(self.openai_key_input)
         
         settings_content.add_widget(openai_layout)
         
+        # Google AI
+        google_layout = BoxLayout(size_hint_y=None, height=50)
+        google_layout.add_widget(Label(text='Google AI:'))
+        self.google_switch = Switch(active=self.config.data["cloud_services"]["google_ai"]["enabled"])
+        self.google_key_input = TextInput(
+            hint_text='API ключ Google AI',
+            text=self.config.data["cloud_services"]["google_ai"]["api_key"],
+            password=True
+        )
+        google_layout.add_widget(self.google_switch)
+        google_layout.add_widget(self.google_key_input)
+        
+        settings_content.add_widget(google_layout)
+        
+        # Свой API (OpenAI-совместимый)
+        custom_layout = BoxLayout(size_hint_y=None, height=50)
+        custom_layout.add_widget(Label(text='Свой API:'))
+        self.custom_switch = Switch(active=self.config.data["cloud_services"]["custom_api"]["enabled"])
+        self.custom_endpoint_input = TextInput(
+            hint_text='http://.../v1/chat/completions',
+            text=self.config.data["cloud_services"]["custom_api"]["endpoint"]
+        )
+        custom_layout.add_widget(self.custom_switch)
+        custom_layout.add_widget(self.custom_endpoint_input)
+        
+        custom_key_layout = BoxLayout(size_hint_y=None, height=50)
+        custom_key_layout.add_widget(Label(text='Ключ API:'))
+        self.custom_key_input = TextInput(
+            hint_text='Необязательно',
+            text=self.config.data["cloud_services"]["custom_api"]["api_key"],
+            password=True
+        )
+        custom_key_layout.add_widget(self.custom_key_input)
+        
+        settings_content.add_widget(custom_layout)
+        settings_content.add_widget(custom_key_layout)
+        
+        # Маршрутизация между облачными сервисами
+        router_label = Label(text='[b]Маршрутизация:[/b]', markup=True, size_hint_y=None, height=30)
+        settings_content.add_widget(router_label)
+        
+        router_layout = BoxLayout(size_hint_y=None, height=50)
+        router_layout.add_widget(Label(text='Самый быстрый сервис:'))
+        self.router_switch = Switch(active=self.config.get("router.enabled", True))
+        router_layout.add_widget(self.router_switch)
+        
+        hedging_layout = BoxLayout(size_hint_y=None, height=50)
+        hedging_layout.add_widget(Label(text='Дублировать медленные:'))
+        self.hedging_switch = Switch(active=self.config.get("router.hedging", True))
+        hedging_layout.add_widget(self.hedging_switch)
+        
+        hedge_after_layout = BoxLayout(size_hint_y=None, height=50)
+        hedge_after_layout.add_widget(Label(text='Порог дубля, мс:'))
+        self.hedge_after_input = TextInput(
+            hint_text='0 - по p95 сервиса',
+            text=str(self.config.get("router.hedge_after_ms", 0)),
+            input_filter='int',
+            multiline=False
+        )
+        hedge_after_layout.add_widget(self.hedge_after_input)
+        
+        self.router_stats_label = Label(text='', size_hint_y=None, height=80, font_size=sp(12))
+        
+        settings_content.add_widget(router_layout)
+        settings_content.add_widget(hedging_layout)
+        settings_content.add_widget(hedge_after_layout)
+        settings_content.add_widget(self.router_stats_label)
+        
+        # Упреждающий ответ: быстрее ответ, но часть запросов уходит впустую
+        speculation_layout = BoxLayout(size_hint_y=None, height=50)
+        speculation_layout.add_widget(Label(text='Отвечать, пока я печатаю:'))
+        self.speculation_switch = Switch(active=self.config.get("speculation.enabled", False))
+        speculation_layout.add_widget(self.speculation_switch)
+        settings_content.add_widget(speculation_layout)
+        
         # Кнопка сохранения
         save_btn = Button(
             text='💾 Сохранить настройки',
@@ -507,23 +1641,91 @@ class AISettingsScreen(Screen):
         layout.add_widget(content)
         
         self.add_widget(layout)
+        
+        self.config.subscribe("ai_character", self.on_settings_changed)
+        self.config.subscribe("cloud_services", self.on_settings_changed)
+        self.config.subscribe("router", self.on_settings_changed)
+        self.config.subscribe("speculation", self.on_settings_changed)
+    
+    def on_pre_enter(self):
+        self.router_stats_label.text = self.router_stats_text()
+    
+    def router_stats_text(self):
+        snapshot = self.manager.get_screen('chat').ai_system.router.snapshot()
+        if not snapshot["providers"]:
+            return "Статистики сервисов пока нет"
+        lines = []
+        for name, stats in snapshot["providers"].items():
+            latency = "нет данных" if stats["p50_ms"] is None else f"p50 {stats['p50_ms']} мс, p95 {stats['p95_ms']} мс"
+            state = " ⛔" if stats["down"] else ""
+            lines.append(f"{name}: {latency}, ошибок {stats['error_rate']:.0%}{state}")
+        lines.append(f"Дублей: {snapshot['hedges']} (выиграли {snapshot['hedge_wins']}), "
+                     f"переключений: {snapshot['failovers']}")
+        return "\n".join(lines)
+    
+    def on_personality_selected(self, spinner, personality):
+        # Стили - свои у каждого пакета; пакет грузится в фоне, пока настройки не сохранены
+        personas = PersonaLibrary.shared()
+        self.style_spinner.values = tuple(personas.styles(personality))
+        if self.style_spinner.values and self.style_spinner.text not in self.style_spinner.values:
+            self.style_spinner.text = self.style_spinner.values[0]
+        personas.prefetch(personality)
+    
+    def on_settings_changed(self, path, value):
+        # Поля формы, изменённые в другом месте приложения
+        fields = {
+            "ai_character.name": (self.name_input, "text"),
+            "ai_character.personality": (self.personality_spinner, "text"),
+            "ai_character.style": (self.style_spinner, "text"),
+            "cloud_services.openai.enabled": (self.openai_switch, "active"),
+            "cloud_services.openai.api_key": (self.openai_key_input, "text"),
+            "cloud_services.google_ai.enabled": (self.google_switch, "active"),
+            "cloud_services.google_ai.api_key": (self.google_key_input, "text"),
+            "cloud_services.custom_api.enabled": (self.custom_switch, "active"),
+            "cloud_services.custom_api.endpoint": (self.custom_endpoint_input, "text"),
+            "cloud_services.custom_api.api_key": (self.custom_key_input, "text"),
+            "router.enabled": (self.router_switch, "active"),
+            "router.hedging": (self.hedging_switch, "active"),
+            "router.hedge_after_ms": (self.hedge_after_input, "text"),
+            "speculation.enabled": (self.speculation_switch, "active")
+        }
+        if path in fields:
+            widget, attr = fields[path]
+            setattr(widget, attr, str(value) if attr == "text" else value)
     
     def save_settings(self, instance):
-        # Сохраняем настройки персонажа
-        self.config.data["ai_character"]["name"] = self.name_input.text
-        self.config.data["ai_character"]["personality"] = self.personality_spinner.text
-        self.config.data["ai_character"]["style"] = self.style_spinner.text
-        
-        # Сохраняем настройки облачных сервисов
-        self.config.data["cloud_services"]["openai"]["enabled"] = self.openai_switch.active
-        
-        self.config.save_config()
+        # Фильтр ввода 'int' пропускает "-" и пустую строку, вставка - что угодно
+        try:
+            hedge_after_ms = max(0, int(self.hedge_after_input.text.strip() or 0))
+        except ValueError:
+            self.show_popup("Ошибка", "Порог дубля - целое число миллисекунд")
+            return
+        self.config.update({
+            # Настройки персонажа
+            "ai_character.name": self.name_input.text,
+            "ai_character.personality": self.personality_spinner.text,
+            "ai_character.style": self.style_spinner.text,
+            # Настройки облачных сервисов
+            "cloud_services.openai.enabled": self.openai_switch.active,
+            "cloud_services.openai.api_key": self.openai_key_input.text,
+            "cloud_services.google_ai.enabled": self.google_switch.active,
+            "cloud_services.google_ai.api_key": self.google_key_input.text,
+            "cloud_services.custom_api.enabled": self.custom_switch.active,
+            "cloud_services.custom_api.endpoint": self.custom_endpoint_input.text.strip(),
+            "cloud_services.custom_api.api_key": self.custom_key_input.text,
+            # Маршрутизация
+            "router.enabled": self.router_switch.active,
+            "router.hedging": self.hedging_switch.active,
+            "router.hedge_after_ms": hedge_after_ms,
+            "speculation.enabled": self.speculation_switch.active
+        })
         self.show_popup("Успех", "Настройки сохранены!")
     
     def go_to_profile(self, instance):
         self.manager.current = 'profile'
     
     def show_popup(self, title, message):
+        from kivy.uix.popup import Popup
         popup = Popup(
             title=title,
             content=Label(text=message),
@@ -535,7 +1737,8 @@ class AISettingsScreen(Screen):
 class AdminScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.config = Config()
+        self.config = Config.shared()
+        self.backup_job = None
         self.setup_ui()
     
     def setup_ui(self):
@@ -558,6 +1761,8 @@ class AdminScreen(Screen):
             ("🎨 Сменить тему", self.toggle_theme),
             ("👤 Изменить имя", self.change_name),
             ("📊 Системные логи", self.show_system_logs),
+            ("📈 Производительность", self.show_performance),
+            ("💾 Резервная копия", self.show_backup),
             ("🚀 Ускорение ИИ", self.boost_ai),
             ("🎯 Сбросить прогресс", self.reset_progress)
         ]
@@ -573,17 +1778,15 @@ class AdminScreen(Screen):
         self.add_widget(layout)
     
     def reset_stats(self, instance):
-        self.config.data["user_profile"]["messages_sent"] = 0
-        self.config.data["user_profile"]["chats_created"] = 0
-        self.config.save_config()
+        self.config.update({"user_profile.messages_sent": 0, "user_profile.chats_created": 0})
         self.show_popup("Успех", "Статистика сброшена!")
     
     def toggle_theme(self, instance):
-        self.config.data["theme"] = "light" if self.config.data["theme"] == "dark" else "dark"
-        self.config.save_config()
+        self.config.set("theme", "light" if self.config.data["theme"] == "dark" else "dark")
         self.show_popup("Тема", "Тема изменена!")
     
     def change_name(self, instance):
+        from kivy.uix.popup import Popup
         content = BoxLayout(orientation='vertical', spacing=10, padding=10)
         name_input = TextInput(text=self.config.data["user_profile"]["name"])
         save_btn = Button(text='Сохранить', on_press=lambda x: self.save_name(name_input.text))
@@ -596,8 +1799,7 @@ class AdminScreen(Screen):
         popup.open()
     
     def save_name(self, new_name):
-        self.config.data["user_profile"]["name"] = new_name
-        self.config.save_config()
+        self.config.set("user_profile.name", new_name)
         self.show_popup("Успех", f"Имя изменено на: {new_name}")
     
     def show_system_logs(self, instance):
@@ -610,27 +1812,219 @@ class AdminScreen(Screen):
 • Сообщений: {self.config.data['user_profile']['messages_sent']}
 • Тема: {self.config.data['theme']}
 • Персонаж ИИ: {self.config.data['ai_character']['name']}
+• Записей конфига: {self.config.save_stats['written']} из {self.config.save_stats['requested']} (сэкономлено {self.config.saves_avoided()})
+• Кэш ответов: {self.cache_stats_text()}
+• Контекст: {self.context_stats_text()}
+• Чаты: {self.sessions_stats_text()}
+• Очередь отправки: {self.outbox_stats_text()}
+• Аватары: {self.avatar_stats_text()}
+• Упреждение: {self.speculation_stats_text()}
 • Статус: ✅ Активно
 • Время: {datetime.now().strftime('%H:%M:%S')}
 """
         self.show_popup("📊 Системные логи", logs)
     
+    def show_performance(self, instance):
+        # Живая панель: снимок метрик обновляется раз в секунду, пока окно открыто
+        from kivy.uix.popup import Popup
+        content = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        scroll = ScrollView()
+        metrics_label = Label(markup=True, size_hint_y=None, halign='left', valign='top', font_size=sp(12))
+        metrics_label.bind(width=lambda label, width: setattr(label, 'text_size', (width, None)))
+        metrics_label.bind(texture_size=lambda label, size: setattr(label, 'height', size[1]))
+        scroll.add_widget(metrics_label)
+        
+        export_btn = Button(size_hint_y=None, height=50)
+        
+        def refresh(*args):
+            metrics_label.text = self.performance_text()
+            exporting = self.config.get("metrics.export", False)
+            export_btn.text = f"💾 Запись в файл: {'вкл' if exporting else 'выкл'}"
+        
+        def toggle_export(*args):
+            self.config.set("metrics.export", not self.config.get("metrics.export", False))
+            refresh()
+        
+        export_btn.bind(on_press=toggle_export)
+        content.add_widget(scroll)
+        content.add_widget(export_btn)
+        
+        refresh()
+        event = Clock.schedule_interval(refresh, 1)
+        popup = Popup(title='📈 Производительность', content=content, size_hint=(0.9, 0.8))
+        popup.bind(on_dismiss=lambda *args: event.cancel())
+        popup.open()
+    
+    # 💾 РЕЗЕРВНАЯ КОПИЯ
+    def show_backup(self, instance):
+        # Экспорт и импорт идут в фоне; окно можно закрыть, работа продолжится
+        from kivy.uix.popup import Popup
+        from kivy.uix.progressbar import ProgressBar
+        from backup import BackupJob, Exporter, Importer
+        content = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        path_input = TextInput(
+            text=self.latest_backup() or "",
+            hint_text='Файл копии для импорта',
+            multiline=False,
+            size_hint_y=None,
+            height=45
+        )
+        progress_bar = ProgressBar(max=1, size_hint_y=None, height=30)
+        status_label = Label(text='Чаты, статистика и персонажи в JSONL (gzip)', font_size=sp(12))
+        status_label.bind(width=lambda label, width: setattr(label, 'text_size', (width, None)))
+        
+        buttons = BoxLayout(size_hint_y=None, height=50, spacing=10)
+        export_btn = Button(text='📤 Экспорт')
+        import_btn = Button(text='📥 Импорт')
+        cancel_btn = Button(text='✖ Отмена', disabled=True)
+        buttons.add_widget(export_btn)
+        buttons.add_widget(import_btn)
+        buttons.add_widget(cancel_btn)
+        
+        content.add_widget(Label(text='Импорт из файла:', size_hint_y=None, height=30))
+        content.add_widget(path_input)
+        content.add_widget(progress_bar)
+        content.add_widget(status_label)
+        content.add_widget(buttons)
+        popup = Popup(title='💾 Резервная копия', content=content, size_hint=(0.9, 0.6))
+        
+        def set_running(running):
+            export_btn.disabled = running
+            import_btn.disabled = running
+            cancel_btn.disabled = not running
+        
+        @mainthread
+        def on_progress(done, total):
+            progress_bar.value = done / total if total else 1
+            status_label.text = f"Обработано {done} из {total}" if total else "Готово"
+        
+        @mainthread
+        def on_error(error):
+            self.backup_job = None
+            set_running(False)
+            status_label.text = f"⚠️ {error}"
+        
+        def start(work, on_done):
+            self.backup_job = BackupJob(work, on_progress, mainthread(on_done), on_error)
+            set_running(True)
+            progress_bar.value = 0
+            self.backup_job.start()
+        
+        def export(*args):
+            chat = self.manager.get_screen('chat')
+            # Накопленные в памяти приращения статистики тоже попадают в копию
+            chat.usage_stats.flush()
+            path = datetime.now().strftime("chaiclone_backup_%Y%m%d_%H%M%S.jsonl.gz")
+            exporter = Exporter(chat.history, json.loads(json.dumps(self.config.data)), path)
+            
+            def done(summary):
+                self.backup_job = None
+                set_running(False)
+                path_input.text = summary["path"]
+                status_label.text = (f"✅ {summary['messages']} сообщений, {summary['bytes'] // 1024} КБ "
+                                     f"за {summary['seconds']} с\n{os.path.abspath(summary['path'])}")
+            
+            start(exporter.run, done)
+        
+        def import_backup(*args):
+            path = path_input.text.strip()
+            if not os.path.exists(path):
+                status_label.text = "⚠️ Файл не найден"
+                return
+            importer = Importer(self.manager.get_screen('chat').history, path)
+            
+            def done(summary):
+                self.backup_job = None
+                set_running(False)
+                # Персонаж и тема из копии; чаты уже в базе и видны в списке чатов
+                if summary["config"]:
+                    self.config.update(summary["config"])
+                skipped = f", уже были: {summary['skipped']}" if summary["skipped"] else ""
+                status_label.text = (f"✅ Чатов: {summary['sessions']}{skipped}, сообщений: {summary['messages']} "
+                                     f"за {summary['seconds']} с")
+            
+            start(importer.run, done)
+        
+        def cancel(*args):
+            if self.backup_job is not None:
+                self.backup_job.cancel()
+        
+        export_btn.bind(on_press=export)
+        import_btn.bind(on_press=import_backup)
+        cancel_btn.bind(on_press=cancel)
+        set_running(self.backup_job is not None and self.backup_job.running)
+        popup.open()
+    
+    def latest_backup(self):
+        backups = [name for name in os.listdir('.') if name.startswith("chaiclone_backup_") and
+                   (name.endswith(".jsonl") or name.endswith(".jsonl.gz"))]
+        return max(backups) if backups else None
+    
+    def performance_text(self):
+        lines = []
+        for name, value in registry.snapshot().items():
+            if isinstance(value, dict):
+                if not value["count"]:
+                    continue
+                lines.append(f"[b]{name}[/b]: p50 {value['p50']}, p95 {value['p95']}, "
+                             f"max {value['max']} (n={value['count']})")
+            elif name.endswith("hit_rate"):
+                lines.append(f"[b]{name}[/b]: {value:.0%}")
+            elif value is not None:
+                lines.append(f"[b]{name}[/b]: {value}")
+        return "\n".join(lines) or "Метрик пока нет"
+    
+    def cache_stats_text(self):
+        stats = self.manager.get_screen('chat').ai_system.cache.stats()
+        return (f"{stats['entries']} записей, попаданий {stats['hits']}, "
+                f"промахов {stats['misses']} ({stats['hit_rate']:.0%})")
+    
+    def context_stats_text(self):
+        stats = self.manager.get_screen('chat').session.context.stats()
+        if not stats:
+            return "не использовался"
+        return "; ".join(f"{model}: {window['turns']} реплик, ~{window['tokens']} токенов, в сводке {window['folded']}"
+                         for model, window in stats.items())
+    
+    def sessions_stats_text(self):
+        chat = self.manager.get_screen('chat')
+        stats = chat.sessions.stats()
+        return (f"в памяти {stats['in_memory']} из {stats['max_in_memory']}, "
+                f"всего {len(chat.history.list_sessions())}, вытеснено {stats['evictions']}")
+    
+    def outbox_stats_text(self):
+        stats = self.manager.get_screen('chat').outbox.stats()
+        return f"ждут {stats['pending']}, доставлено {stats['delivered']}, повторов {stats['retries']}"
+    
+    def speculation_stats_text(self):
+        if not self.config.get("speculation.enabled", False):
+            return "выключено"
+        stats = self.manager.get_screen('chat').speculator.stats()
+        return (f"запросов {stats['started']}, пригодилось {stats['hits']} ({stats['hit_rate']:.0%}), "
+                f"впустую {stats['wasted']}, отложено по лимиту {stats['throttled']}")
+    
+    def avatar_stats_text(self):
+        stats = avatar_textures.stats()
+        atlas = "атлас" if stats["atlas"] else "без атласа"
+        return (f"{atlas}, текстур {stats['textures']}, грузится {stats['loading']}, "
+                f"миниатюр {stats['thumbnails']} ({stats['thumbnail_bytes'] // 1024} КБ)")
+    
     def boost_ai(self, instance):
-        self.config.data["user_profile"]["level"] += 5
-        self.config.data["user_profile"]["xp"] = 100
-        self.config.save_config()
+        self.config.update({
+            "user_profile.level": self.config.data["user_profile"]["level"] + 5,
+            "user_profile.xp": 100
+        })
         self.show_popup("Буст!", "ИИ ускорен! Уровень повышен!")
     
     def reset_progress(self, instance):
-        self.config.data["user_profile"]["level"] = 1
-        self.config.data["user_profile"]["xp"] = 0
-        self.config.save_config()
+        self.config.update({"user_profile.level": 1, "user_profile.xp": 0})
         self.show_popup("Сброс", "Прогресс сброшен!")
     
     def go_to_profile(self, instance):
         self.manager.current = 'profile'
     
     def show_popup(self, title, message):
+        from kivy.uix.popup import Popup
         popup = Popup(
             title=title,
             content=Label(text=message, markup=True),
@@ -639,18 +2033,138 @@ class AdminScreen(Screen):
         popup.open()
 
 # 🎯 ГЛАВНОЕ ПРИЛОЖЕНИЕ
+class LazyScreenManager(ScreenManager):
+    # Экраны, кроме стартового, создаются при первом переходе на них
+    def __init__(self, screen_factories, **kwargs):
+        self.screen_factories = screen_factories
+        super().__init__(**kwargs)
+    
+    def on_current(self, instance, value):
+        if value not in self.screen_names and value in self.screen_factories:
+            self.add_widget(self.screen_factories[value](name=value))
+        super().on_current(instance, value)
+
 class ChaiCloneApp(App):
     def build(self):
         self.title = "Chai Clone"
+        self.startup_marks = {"build_begin": time.perf_counter()}
         
         # Создаем менеджер экранов
-        sm = ScreenManager()
+        sm = LazyScreenManager({
+            'profile': ProfileScreen,
+            'ai_settings': AISettingsScreen,
+            'admin': AdminScreen
+        })
         sm.add_widget(ChatScreen(name='chat'))
-        sm.add_widget(ProfileScreen(name='profile'))
-        sm.add_widget(AISettingsScreen(name='ai_settings'))
-        sm.add_widget(AdminScreen(name='admin'))
         
+        self.startup_marks["build_end"] = time.perf_counter()
         return sm
+    
+    def on_start(self):
+        Window.bind(on_flip=self.on_first_frame)
+        
+        # Метрики интерфейса: интервал между кадрами - каждый кадр, остальное - реже.
+        # Состояние UI читается только здесь, в главном потоке: экспорт метрик
+        # идёт из своего потока и видит уже записанные значения
+        Clock.schedule_interval(self.sample_frame, 0)
+        Clock.schedule_interval(self.sample_ui, 1)
+        Clock.schedule_interval(self.sample_widgets, 5)
+        self.sample_ui()
+        # Кэш ответов работает под своим локом - его сборщик опрашивает напрямую
+        self.response_cache = self.root.get_screen('chat').ai_system.cache
+        registry.add_collector(self.collect_metrics)
+        
+        config = Config.shared()
+        self.metrics_exporter = MetricsExporter(
+            registry,
+            interval=config.get("metrics.interval_s", 10),
+            max_bytes=config.get("metrics.max_kb", 512) * 1024
+        )
+        config.subscribe("metrics", self.on_metrics_settings_changed)
+        self.on_metrics_settings_changed("metrics", None)
+    
+    def on_metrics_settings_changed(self, path, value):
+        if Config.shared().get("metrics.export", False):
+            self.metrics_exporter.start()
+        else:
+            self.metrics_exporter.stop()
+    
+    def sample_frame(self, dt):
+        registry.histogram("ui.frame_ms").observe(dt * 1000)
+    
+    def sample_widgets(self, dt):
+        def count(widget):
+            return 1 + sum(count(child) for child in widget.children)
+        registry.gauge("ui.widgets").set(count(Window))
+    
+    def sample_ui(self, dt=None):
+        # Значения, которыми владеет UI-поток: кэш разметки, чаты в памяти, аватары, упреждение
+        chat = self.root.get_screen('chat')
+        lookups = text_layouts.hits + text_layouts.misses
+        registry.gauge("cache.text_layout.hit_rate").set(round(text_layouts.hits / lookups, 3) if lookups else 0.0)
+        registry.gauge("sessions.in_memory").set(len(chat.sessions))
+        registry.gauge("avatars.textures").set(len(avatar_textures.textures))
+        speculation = chat.speculator.stats()
+        registry.gauge("speculation.hit_rate").set(round(speculation["hit_rate"], 3))
+        registry.gauge("speculation.wasted").set(speculation["wasted"])
+    
+    def collect_metrics(self, registry):
+        # Вызывается при снимке метрик, в том числе из потока экспорта: только то,
+        # что можно читать не из UI-потока - память процесса и кэш ответов
+        rss = rss_bytes()
+        if rss is not None:
+            registry.gauge("process.rss_mb").set(round(rss / 2 ** 20, 1))
+        cache = self.response_cache.stats()
+        registry.gauge("cache.responses.entries").set(cache["entries"])
+        registry.gauge("cache.responses.hit_rate").set(round(cache["hit_rate"], 3))
+    
+    def on_first_frame(self, *args):
+        Window.unbind(on_flip=self.on_first_frame)
+        self.startup_marks["first_frame"] = time.perf_counter()
+        self.report_startup()
+    
+    def report_startup(self):
+        # Время холодного старта: импорты, build(), первый отрисованный кадр
+        from kivy.utils import platform
+        marks = self.startup_marks
+        report = {
+            "version": __version__,
+            "platform": platform,
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "import_ms": round((STARTUP_IMPORTED - STARTUP_BEGIN) * 1000, 1),
+            "build_ms": round((marks["build_end"] - marks["build_begin"]) * 1000, 1),
+            "first_frame_ms": round((marks["first_frame"] - STARTUP_BEGIN) * 1000, 1)
+        }
+        Logger.info(f"Startup: импорт {report['import_ms']} мс, build {report['build_ms']} мс, "
+                    f"первый кадр {report['first_frame_ms']} мс")
+        try:
+            with open("chaiclone_startup.jsonl", 'a', encoding='utf-8') as f:
+                f.write(json.dumps(report) + "\n")
+        except OSError as e:
+            Logger.warning(f"Startup: отчёт не сохранён ({e})")
+    
+    def on_pause(self):
+        Config.shared().flush()
+        chat = self.root.get_screen('chat')
+        chat.ai_system.save_cache()
+        chat.usage_stats.flush()
+        return True
+    
+    def on_stop(self):
+        self.metrics_exporter.stop()
+        chat = self.root.get_screen('chat')
+        chat.outbox.stop()
+        chat.speculator.discard()
+        for session in chat.sessions:
+            session.scheduler.cancel_all()
+        chat.ai_system.shutdown()
+        chat.usage_stats.flush()
+        config = Config.shared()
+        config.flush()
+        stats = config.save_stats
+        Logger.info(f"Config: save_config {stats['requested']}, "
+                    f"записей {stats['written']} ({stats['bytes']} байт), "
+                    f"сэкономлено {config.saves_avoided()}")
 
 # 🚀 ЗАПУСК
 if __name__ == '__main__':
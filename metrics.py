@@ -0,0 +1,199 @@
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+# 📈 МЕТРИКИ
+# Реестр счётчиков, значений и гистограмм для диагностики на устройстве.
+# Запись метрики - несколько операций под коротким локом, без выделения памяти
+# на горячем пути. Гистограмма хранит корзины по логарифмической шкале и
+# последние значения для перцентилей. Модуль не зависит от Kivy: UI читает
+# snapshot(), а экспортёр в фоновом потоке дописывает его в файл с ротацией.
+
+# Границы корзин гистограмм, мс
+DEFAULT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+class Counter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+    
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+    
+    def snapshot(self):
+        return self.value
+
+class Gauge:
+    def __init__(self):
+        self.value = None
+    
+    def set(self, value):
+        self.value = value
+    
+    def snapshot(self):
+        return self.value
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS, recent=256):
+        self.lock = threading.Lock()
+        self.bounds = buckets
+        self.buckets = [0] * (len(buckets) + 1)
+        self.recent = deque(maxlen=recent)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+    
+    def observe(self, value):
+        with self.lock:
+            self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+            self.recent.append(value)
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+    
+    def time(self):
+        return Timer(self)
+    
+    def snapshot(self):
+        with self.lock:
+            if not self.count:
+                return {"count": 0}
+            ordered = sorted(self.recent)
+            result = {
+                "count": self.count,
+                "mean": round(self.total / self.count, 2),
+                "min": round(self.min, 2),
+                "max": round(self.max, 2),
+                "buckets": dict(zip([str(b) for b in self.bounds] + ["+inf"], self.buckets))
+            }
+        for name, q in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+            result[name] = round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+        return result
+
+class Timer:
+    # with registry.histogram("x_ms").time(): ... - длительность блока в мс
+    def __init__(self, histogram):
+        self.histogram = histogram
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.histogram.observe((time.perf_counter() - self.started) * 1000)
+        return False
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        # Значения, которые дешевле опросить при снимке, чем обновлять на каждом событии
+        self.collectors = []
+    
+    def get(self, name, factory):
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.setdefault(name, factory())
+        return metric
+    
+    def counter(self, name):
+        return self.get(name, Counter)
+    
+    def gauge(self, name):
+        return self.get(name, Gauge)
+    
+    def histogram(self, name, buckets=DEFAULT_BUCKETS):
+        return self.get(name, lambda: Histogram(buckets))
+    
+    def add_collector(self, collect):
+        # collect(registry) вызывается перед каждым снимком
+        self.collectors.append(collect)
+    
+    def collect(self):
+        for collect in list(self.collectors):
+            try:
+                collect(self)
+            except Exception:
+                # Сломанный сборщик не должен ронять панель или экспорт
+                pass
+    
+    def snapshot(self):
+        self.collect()
+        with self.lock:
+            metrics = dict(self.metrics)
+        return {name: metric.snapshot() for name, metric in sorted(metrics.items())}
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+        except ImportError:
+            return None
+        # ru_maxrss - пиковое значение (Linux: КБ, macOS: байты)
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+# 💾 ЭКСПОРТ
+class MetricsExporter:
+    # Раз в interval секунд дописывает снимок строкой JSON; файл больше max_bytes
+    # переименовывается в .1 (старые копии сдвигаются, хранится backups штук)
+    def __init__(self, registry, path="chaiclone_metrics.jsonl", interval=10, max_bytes=512 * 1024, backups=2):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+    
+    def start(self):
+        if self.running:
+            return
+        # Своё событие на каждый запуск: старый поток гарантированно завершится
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(self.stop_event,), name="metrics-export", daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+        self.thread = None
+    
+    def run(self, stop_event):
+        while not stop_event.wait(self.interval):
+            self.export()
+    
+    def export(self):
+        line = json.dumps({"time": time.time(), "metrics": self.registry.snapshot()}, ensure_ascii=False)
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(line) > self.max_bytes:
+                self.rotate()
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+        except OSError:
+            pass
+    
+    def rotate(self):
+        for number in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{number}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{number + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+registry = MetricsRegistry()
@@ -0,0 +1,192 @@
+import json
+import random
+import threading
+import time
+
+from providers import ProviderUnavailable, RequestCancelled
+
+# 📮 ОЧЕРЕДЬ НЕОТПРАВЛЕННЫХ ЗАПРОСОВ
+# Запрос к облаку, упавший из-за сети (см. ProviderUnavailable), не теряется:
+# он записывается в таблицу outbox базы истории и переживает перезапуск.
+# Фоновый поток повторяет запросы с экспоненциальной задержкой и случайным
+# разбросом, чтобы после возврата сети запросы не ушли все разом. Ответ
+# сохраняется в свой чат и удаляется из очереди одной транзакцией, поэтому
+# доставленный запрос повторно не отправляется. Не зависит от Kivy: колбэки
+# вызываются в потоке очереди.
+
+class Outbox:
+    def __init__(self, history, send, on_delivered=None, on_failed=None,
+                 base_delay=2.0, max_delay=300.0, max_attempts=0, timeout=60):
+        # send(entry, on_result, on_error) отправляет запрос и возвращает дескриптор с cancel().
+        # on_delivered(entry, message_id, text) - ответ уже в базе, entry["latency_ms"] - время
+        # удачной попытки (без ожидания в очереди);
+        # on_failed(entry, error) - ошибка не сетевая или попытки кончились, запрос снят с очереди
+        self.history = history
+        self.send = send
+        self.on_delivered = on_delivered
+        self.on_failed = on_failed
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # 0 - повторять, пока не получится
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.delivered = 0
+        self.retries = 0
+        # Есть ли что повторять - чтобы wake() на каждом удачном ответе не трогал базу
+        self.has_pending = True
+    
+    def query(self, sql, params=()):
+        with self.history.lock:
+            rows = self.history.connection.execute(sql, params).fetchall()
+            self.history.connection.commit()
+        return rows
+    
+    # 📥 ОЧЕРЕДЬ
+    def add(self, session_id, prompt, character):
+        now = time.time()
+        with self.history.lock:
+            cursor = self.history.connection.execute(
+                "INSERT INTO outbox (session_id, prompt, persona, created_at, next_attempt_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, prompt, json.dumps(character, ensure_ascii=False), now, now + self.backoff(1))
+            )
+            self.history.connection.commit()
+            entry_id = cursor.lastrowid
+        self.has_pending = True
+        self.wake_event.set()
+        return {"id": entry_id, "session_id": session_id, "prompt": prompt, "character": character,
+                "created_at": now, "attempts": 0}
+    
+    def pending(self, session_id=None):
+        sql = "SELECT id, session_id, prompt, persona, created_at, attempts, next_attempt_at, last_error FROM outbox"
+        if session_id is None:
+            rows = self.query(sql + " ORDER BY id")
+        else:
+            rows = self.query(sql + " WHERE session_id = ? ORDER BY id", (session_id,))
+        return [entry_row(row) for row in rows]
+    
+    def next_due(self):
+        rows = self.query(
+            "SELECT id, session_id, prompt, persona, created_at, attempts, next_attempt_at, last_error "
+            "FROM outbox ORDER BY next_attempt_at, id LIMIT 1"
+        )
+        self.has_pending = bool(rows)
+        return entry_row(rows[0]) if rows else None
+    
+    def backoff(self, attempts):
+        # Экспоненциальная задержка, от половины до полной - с разбросом
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return random.uniform(delay / 2, delay)
+    
+    def wake(self, reset=False):
+        # reset - связь точно есть (другой запрос только что прошёл): повторяем всё сразу
+        if not self.has_pending:
+            return
+        if reset:
+            now = time.time()
+            self.query("UPDATE outbox SET next_attempt_at = ? WHERE next_attempt_at > ?", (now, now))
+        self.wake_event.set()
+    
+    # 🔁 ПОВТОРЫ
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+    
+    def start(self):
+        if self.running:
+            return
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(self.stop_event,), name="outbox", daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+        self.thread = None
+    
+    def run(self, stop_event):
+        while not stop_event.is_set():
+            entry = self.next_due()
+            wait = None if entry is None else entry["next_attempt_at"] - time.time()
+            if wait is None or wait > 0:
+                self.wake_event.wait(wait)
+                self.wake_event.clear()
+                continue
+            self.attempt(entry, stop_event)
+    
+    def attempt(self, entry, stop_event):
+        done = threading.Event()
+        outcome = {}
+        
+        def on_result(text):
+            outcome["text"] = text
+            done.set()
+        
+        def on_error(error):
+            outcome["error"] = error
+            done.set()
+        
+        started = time.perf_counter()
+        handle = self.send(entry, on_result, on_error)
+        if not done.wait(self.timeout):
+            handle.cancel()
+            outcome["error"] = ProviderUnavailable("Нет ответа")
+        # Остановка приложения - не повод снимать запрос с очереди
+        if "text" not in outcome and (stop_event.is_set() or isinstance(outcome["error"], RequestCancelled)):
+            return
+        
+        if "text" in outcome:
+            entry["latency_ms"] = (time.perf_counter() - started) * 1000
+            message_id = self.complete(entry, outcome["text"])
+            if message_id is not None:
+                self.delivered += 1
+                if self.on_delivered is not None:
+                    self.on_delivered(entry, message_id, outcome["text"])
+            return
+        
+        error = outcome["error"]
+        attempts = entry["attempts"] + 1
+        if not isinstance(error, ProviderUnavailable) or (self.max_attempts and attempts >= self.max_attempts):
+            self.query("DELETE FROM outbox WHERE id = ?", (entry["id"],))
+            if self.on_failed is not None:
+                self.on_failed(entry, error)
+            return
+        self.retries += 1
+        self.query(
+            "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (attempts, time.time() + self.backoff(attempts + 1), str(error), entry["id"])
+        )
+    
+    def complete(self, entry, text):
+        # Ответ и удаление из очереди - одна транзакция; чат могли удалить, пока ждали ответа
+        with self.history.lock:
+            connection = self.history.connection
+            if connection.execute("DELETE FROM outbox WHERE id = ?", (entry["id"],)).rowcount == 0:
+                connection.rollback()
+                return None
+            now = time.time()
+            cursor = connection.execute(
+                "INSERT INTO messages (is_user, text, created_at, session_id) VALUES (0, ?, ?, ?)",
+                (text, now, entry["session_id"])
+            )
+            connection.execute("UPDATE sessions SET updated_at = ? WHERE id = ?", (now, entry["session_id"]))
+            connection.commit()
+            return cursor.lastrowid
+    
+    def stats(self):
+        rows = self.query("SELECT COUNT(*) FROM outbox")
+        return {"pending": rows[0][0], "delivered": self.delivered, "retries": self.retries}
+
+def entry_row(row):
+    return {
+        "id": row[0],
+        "session_id": row[1],
+        "prompt": row[2],
+        "character": json.loads(row[3]) if row[3] else None,
+        "created_at": row[4],
+        "attempts": row[5],
+        "next_attempt_at": row[6],
+        "last_error": row[7]
+    }
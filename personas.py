@@ -0,0 +1,184 @@
+import json
+import os
+import string
+import threading
+import time
+
+from metrics import registry
+from storage import atomic_write
+
+# 🎭 ПАКЕТЫ ПЕРСОНАЖЕЙ
+# Характер ИИ - файл JSON в data/personas или в каталоге пользователя
+# chaiclone_personas: общие фразы, корпус локальных ответов, аватар и шаблоны
+# стилей. При запуске читается только index.json каталога - названия
+# характеров, их стили и аватары, этого хватает для настроек и пузырей. Сам пакет загружается при
+# первом ответе этим характером, его шаблоны разбираются один раз при загрузке.
+# Индекс каталога пересобирается, если в нём появились или пропали файлы;
+# после правки существующего пакета - python tools/build_index.py.
+
+INDEX_FILE = "index.json"
+INDEX_VERSION = 2
+BUILTIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "personas")
+USER_DIR = "chaiclone_personas"
+DEFAULT_PERSONA = "дружелюбный"
+DEFAULT_TEMPLATE = "{name}: {reply}"
+# Фразы встроенного характера - на случай, если не установлен ни один пакет
+FALLBACK_GREETINGS = ("Привет! Как твои дела?", "Рад тебя видеть!")
+
+# Поля, доступные в шаблонах: ответ, имя персонажа, имя пользователя
+TEMPLATE_FIELDS = ("reply", "name", "user")
+
+def compile_template(template):
+    # "🎨 {reply} 🎭" -> список (текст, поле); ошибка в шаблоне видна при загрузке пакета,
+    # а не на случайном ответе
+    parts = []
+    for literal, field, spec, conversion in string.Formatter().parse(template):
+        if field is not None and (field not in TEMPLATE_FIELDS or spec or conversion):
+            raise ValueError(f"Неизвестное поле шаблона: {{{field}}}")
+        parts.append((literal, field))
+    
+    def render(fields):
+        return "".join(literal + (fields[field] if field else "") for literal, field in parts)
+    return render
+
+class PersonaPack:
+    def __init__(self, name, greetings, corpus=None, styles=None, default_template=DEFAULT_TEMPLATE):
+        self.name = name
+        self.greetings = list(greetings)
+        # Имя корпуса в data/corpus; по умолчанию - как у характера
+        self.corpus = corpus or name
+        self.styles = list(styles or {})
+        self.templates = {style: compile_template(template) for style, template in (styles or {}).items()}
+        # Стиль, которого нет в пакете, оформляется этим шаблоном
+        self.default_template = compile_template(default_template)
+    
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not data.get("greetings"):
+            raise ValueError(f"{path}: в пакете нет фраз greetings")
+        return cls(data["name"], data["greetings"], data.get("corpus"), data.get("styles"),
+                   data.get("default_template", DEFAULT_TEMPLATE))
+    
+    def render(self, style, reply, name, user=""):
+        template = self.templates.get(style, self.default_template)
+        return template({"reply": reply, "name": name, "user": user})
+
+def pack_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".json") and name != INDEX_FILE)
+
+def build_index(directory):
+    # Читает все пакеты каталога; битый пакет пропускается, чтобы не потерять остальные
+    files = pack_files(directory)
+    personas = {}
+    for file_name in files:
+        try:
+            with open(os.path.join(directory, file_name), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            personas[data["name"]] = {"file": file_name, "styles": list(data.get("styles", {})),
+                                      "avatar": data.get("avatar")}
+        except (OSError, ValueError, KeyError, TypeError):
+            continue
+    index = {"version": INDEX_VERSION, "files": files, "personas": personas}
+    try:
+        atomic_write(os.path.join(directory, INDEX_FILE),
+                     json.dumps(index, ensure_ascii=False, indent=2, sort_keys=True) + "\n")
+    except OSError:
+        # Каталог только для чтения (APK) - индекс просто не кэшируется
+        pass
+    return index
+
+def read_index(directory):
+    if not os.path.isdir(directory):
+        return {}
+    try:
+        with open(os.path.join(directory, INDEX_FILE), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get("version") == INDEX_VERSION and index.get("files") == pack_files(directory):
+            return index["personas"]
+    except (OSError, ValueError, AttributeError):
+        pass
+    return build_index(directory)["personas"]
+
+class PersonaLibrary:
+    # Один экземпляр на процесс (PersonaLibrary.shared()), как и Config
+    _shared = None
+    
+    @classmethod
+    def shared(cls):
+        if cls._shared is None:
+            cls._shared = cls([BUILTIN_DIR, USER_DIR])
+        return cls._shared
+    
+    def __init__(self, directories):
+        self.lock = threading.Lock()
+        # Характер -> путь к пакету и стили; пакет пользователя заменяет встроенный с тем же именем
+        self.entries = {}
+        for directory in directories:
+            for name, entry in read_index(directory).items():
+                self.entries[name] = {"path": os.path.join(directory, entry["file"]), "styles": entry["styles"],
+                                      "avatar": entry.get("avatar")}
+        self.packs = {}
+        self.loads = 0
+    
+    def names(self):
+        return sorted(self.entries)
+    
+    def styles(self, name=None):
+        # Стили характера; без имени - все стили всех характеров по порядку
+        if name is not None:
+            entry = self.entries.get(name)
+            return list(entry["styles"]) if entry else []
+        result = []
+        for entry in self.entries.values():
+            result.extend(style for style in entry["styles"] if style not in result)
+        return result
+    
+    def avatar(self, name):
+        # Имя встроенного аватара или путь к картинке (см. avatars.py); None - аватар по умолчанию
+        entry = self.entries.get(name)
+        return entry["avatar"] if entry else None
+    
+    def resolve(self, name):
+        if name in self.entries:
+            return name
+        # Без единого пакета (data/personas пуст или не попал в сборку) отвечает встроенный характер
+        if DEFAULT_PERSONA in self.entries or not self.entries:
+            return DEFAULT_PERSONA
+        return next(iter(self.entries))
+    
+    def pack(self, name):
+        # Неизвестный характер (пакет удалили) отвечает характером по умолчанию
+        name = self.resolve(name)
+        pack = self.packs.get(name)
+        if pack is not None:
+            return pack
+        with self.lock:
+            pack = self.packs.get(name)
+            if pack is None and name not in self.entries:
+                pack = PersonaPack(name, FALLBACK_GREETINGS)
+                self.packs[name] = pack
+            elif pack is None:
+                started = time.perf_counter()
+                pack = PersonaPack.load(self.entries[name]["path"])
+                registry.histogram("personas.load_ms").observe((time.perf_counter() - started) * 1000)
+                self.packs[name] = pack
+                self.loads += 1
+        return pack
+    
+    def prefetch(self, name):
+        # Загрузка в фоне, чтобы первый ответ новым характером не ждал диска
+        if self.resolve(name) in self.packs:
+            return
+        threading.Thread(target=self.load_quietly, args=(name,), name="persona-load", daemon=True).start()
+    
+    def load_quietly(self, name):
+        try:
+            self.pack(name)
+        except (OSError, ValueError, KeyError):
+            # Ошибка повторится и будет видна при ответе
+            pass
+    
+    def stats(self):
+        return {"installed": len(self.entries), "loaded": len(self.packs), "loads": self.loads}
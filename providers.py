@@ -0,0 +1,385 @@
+import http.client
+import json
+import re
+import socket
+import ssl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+# ☁️ ОБЛАЧНЫЕ ПРОВАЙДЕРЫ
+# Запросы выполняются в пуле рабочих потоков, HTTP-соединения переиспользуются
+# (keep-alive). Модуль ничего не знает о Kivy: колбэки вызываются в рабочем
+# потоке, и вызывающий сам возвращает результат в UI (через Clock).
+# Ответы можно получать целиком (complete) или потоком токенов (stream, SSE).
+
+class ProviderError(Exception):
+    pass
+
+class RequestCancelled(ProviderError):
+    pass
+
+class ProviderUnavailable(ProviderError):
+    # Нет сети, таймаут, обрыв соединения, 429 или 5xx - запрос стоит повторить позже
+    pass
+
+# 🔌 ПУЛ СОЕДИНЕНИЙ
+class ConnectionPool:
+    def __init__(self, max_idle_per_host=4, timeout=30):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.ssl_context = ssl.create_default_context()
+    
+    def acquire(self, scheme, netloc):
+        # Возвращает (соединение, переиспользовано ли оно)
+        key = (scheme, netloc)
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                return connections.pop(), True
+        
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(netloc, timeout=self.timeout, context=self.ssl_context)
+        else:
+            connection = http.client.HTTPConnection(netloc, timeout=self.timeout)
+        return connection, False
+    
+    def release(self, scheme, netloc, connection):
+        key = (scheme, netloc)
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle_per_host:
+                connections.append(connection)
+                return
+        connection.close()
+    
+    def close_all(self):
+        with self.lock:
+            connections = [c for group in self.idle.values() for c in group]
+            self.idle = {}
+        for connection in connections:
+            connection.close()
+
+# 🎫 ДЕСКРИПТОР ЗАПРОСА
+class RequestHandle:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancel_event = threading.Event()
+        self.connection = None
+        self.future = None
+    
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+    
+    def attach(self, connection):
+        with self.lock:
+            if self.cancelled:
+                raise RequestCancelled("Запрос отменён")
+            self.connection = connection
+    
+    def detach(self):
+        with self.lock:
+            self.connection = None
+    
+    def cancel(self):
+        # Прерываем ожидание ответа: shutdown будит поток, заблокированный на recv
+        with self.lock:
+            self.cancel_event.set()
+            connection = self.connection
+        if self.future is not None:
+            self.future.cancel()
+        if connection is not None and connection.sock is not None:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+# 🤖 ПРОВАЙДЕРЫ
+class CloudProvider:
+    name = None
+    
+    def __init__(self, settings, pool):
+        self.settings = settings
+        self.pool = pool
+    
+    @property
+    def model(self):
+        return self.settings.get("model", "")
+    
+    def is_configured(self):
+        return bool(self.settings.get("enabled") and self.settings.get("api_key"))
+    
+    def build_request(self, messages, stream=False):
+        raise NotImplementedError
+    
+    def parse_response(self, payload):
+        raise NotImplementedError
+    
+    def parse_stream_event(self, event):
+        raise NotImplementedError
+    
+    def complete(self, messages, handle):
+        url, headers, body = self.build_request(messages)
+        payload = self.post(url, headers, body, handle, lambda response: response.read())
+        try:
+            return self.parse_response(json.loads(payload))
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            raise ProviderError(f"{self.name}: неожиданный ответ сервера ({e})")
+    
+    def stream(self, messages, handle, on_token):
+        url, headers, body = self.build_request(messages, stream=True)
+        
+        def consume(response):
+            tokens = []
+            for event in iter_sse_events(response):
+                try:
+                    token = self.parse_stream_event(event)
+                except (KeyError, IndexError, TypeError) as e:
+                    raise ProviderError(f"{self.name}: неожиданный фрагмент потока ({e})")
+                if token:
+                    tokens.append(token)
+                    on_token(token)
+            # Дочитываем хвост, чтобы соединение можно было вернуть в пул
+            response.read()
+            return "".join(tokens)
+        
+        return self.post(url, headers, body, handle, consume)
+    
+    def post(self, url, headers, body, handle, consume):
+        # consume(response) читает тело ответа; соединение возвращается в пул,
+        # только если ответ прочитан полностью
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        headers = dict(headers, **{"Content-Type": "application/json", "Connection": "keep-alive"})
+        
+        # Сервер мог закрыть простаивающее соединение: один повтор на свежем
+        for attempt in range(2):
+            connection, reused = self.pool.acquire(parts.scheme, parts.netloc)
+            try:
+                handle.attach(connection)
+            except RequestCancelled:
+                # Отменён до отправки - соединение никому не отдано, закрываем сами
+                connection.close()
+                raise
+            try:
+                try:
+                    connection.request("POST", path, body=data, headers=headers)
+                    response = connection.getresponse()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    connection.close()
+                    if reused and attempt == 0 and not handle.cancelled:
+                        continue
+                    raise
+                
+                if response.status >= 400:
+                    response.read()
+                    transient = response.status == 429 or response.status >= 500
+                    result = (ProviderUnavailable if transient else ProviderError)(f"{self.name}: HTTP {response.status}")
+                else:
+                    result = consume(response)
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                if handle.cancelled:
+                    raise RequestCancelled("Запрос отменён")
+                raise ProviderUnavailable(f"{self.name}: {e}")
+            except ProviderError:
+                connection.close()
+                raise
+            finally:
+                handle.detach()
+            
+            if response.will_close:
+                connection.close()
+            else:
+                self.pool.release(parts.scheme, parts.netloc, connection)
+            
+            if isinstance(result, ProviderError):
+                raise result
+            return result
+
+class OpenAIProvider(CloudProvider):
+    name = "openai"
+    
+    def chat_url(self):
+        base_url = self.settings.get("base_url", "https://api.openai.com/v1")
+        return base_url.rstrip("/") + "/chat/completions"
+    
+    def build_request(self, messages, stream=False):
+        headers = {"Authorization": f"Bearer {self.settings.get('api_key', '')}"}
+        body = {"model": self.model, "messages": messages}
+        if stream:
+            body["stream"] = True
+        return self.chat_url(), headers, body
+    
+    def parse_response(self, payload):
+        return payload["choices"][0]["message"]["content"]
+    
+    def parse_stream_event(self, event):
+        choices = event.get("choices") or [{}]
+        return choices[0].get("delta", {}).get("content")
+
+class GoogleAIProvider(CloudProvider):
+    name = "google_ai"
+    
+    def build_request(self, messages, stream=False):
+        base_url = self.settings.get("base_url", "https://generativelanguage.googleapis.com/v1beta")
+        if stream:
+            url = f"{base_url.rstrip('/')}/models/{self.model}:streamGenerateContent?alt=sse"
+        else:
+            url = f"{base_url.rstrip('/')}/models/{self.model}:generateContent"
+        headers = {"x-goog-api-key": self.settings.get("api_key", "")}
+        
+        # У Gemini нет роли system: инструкция персонажа уходит отдельным полем
+        system = [m["content"] for m in messages if m["role"] == "system"]
+        contents = [
+            {"role": "model" if m["role"] == "assistant" else "user", "parts": [{"text": m["content"]}]}
+            for m in messages if m["role"] != "system"
+        ]
+        body = {"contents": contents}
+        if system:
+            body["systemInstruction"] = {"parts": [{"text": "\n".join(system)}]}
+        return url, headers, body
+    
+    def parse_response(self, payload):
+        parts = payload["candidates"][0]["content"]["parts"]
+        return "".join(part.get("text", "") for part in parts)
+    
+    def parse_stream_event(self, event):
+        return self.parse_response(event)
+
+class CustomAPIProvider(OpenAIProvider):
+    # Любой OpenAI-совместимый сервер: endpoint - полный адрес chat/completions
+    name = "custom_api"
+    
+    @property
+    def model(self):
+        return self.settings.get("model", "default")
+    
+    def is_configured(self):
+        return bool(self.settings.get("enabled") and self.settings.get("endpoint"))
+    
+    def chat_url(self):
+        return self.settings["endpoint"]
+    
+    def build_request(self, messages, stream=False):
+        url, headers, body = super().build_request(messages, stream)
+        if not self.settings.get("api_key"):
+            headers = {}
+        return url, headers, body
+
+# 🏠 ЛОКАЛЬНЫЙ ГЕНЕРАТОР
+class LocalProvider:
+    # Ответ без сети: generate(prompt) возвращает текст целиком, а при потоковой
+    # выдаче он отдаётся по словам с паузой token_delay (имитация набора)
+    name = "local"
+    model = "local"
+    
+    def __init__(self, generate, token_delay=0.05):
+        self.generate = generate
+        self.token_delay = token_delay
+    
+    def is_configured(self):
+        return True
+    
+    def complete(self, messages, handle):
+        return self.generate(last_user_message(messages))
+    
+    def stream(self, messages, handle, on_token):
+        text = self.complete(messages, handle)
+        for token in re.findall(r"\S+\s*", text):
+            if handle.cancel_event.wait(self.token_delay):
+                raise RequestCancelled("Запрос отменён")
+            on_token(token)
+        return text
+
+def last_user_message(messages):
+    for message in reversed(messages):
+        if message["role"] == "user":
+            return message["content"]
+    return ""
+
+def iter_sse_events(response):
+    # Server-Sent Events: полезная нагрузка в строках "data: {...}", конец - [DONE]
+    for raw_line in response:
+        line = raw_line.decode('utf-8').strip()
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        try:
+            yield json.loads(data)
+        except ValueError:
+            raise ProviderError(f"Некорректное событие потока: {data[:80]}")
+
+PROVIDERS = {
+    "openai": OpenAIProvider,
+    "google_ai": GoogleAIProvider,
+    "custom_api": CustomAPIProvider
+}
+
+# 🚚 КЛИЕНТ
+class ProviderClient:
+    def __init__(self, max_workers=4, timeout=30):
+        self.pool = ConnectionPool(timeout=timeout)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="provider")
+        self.lock = threading.Lock()
+        self.active = set()
+    
+    def provider(self, name, settings):
+        return PROVIDERS[name](settings, self.pool)
+    
+    def configured_providers(self, cloud_services):
+        providers = []
+        for name, settings in cloud_services.items():
+            if name in PROVIDERS:
+                provider = self.provider(name, settings)
+                if provider.is_configured():
+                    providers.append(provider)
+        return providers
+    
+    def submit(self, provider, messages, on_result, on_error=None, on_token=None):
+        # on_token(token) / on_result(text) / on_error(exception) вызываются в рабочем
+        # потоке; с on_token ответ запрашивается потоком. После отмены колбэки не вызываются
+        handle = RequestHandle()
+        
+        def emit(token):
+            if not handle.cancelled:
+                on_token(token)
+        
+        def run():
+            try:
+                if on_token is not None:
+                    text = provider.stream(messages, handle, emit)
+                else:
+                    text = provider.complete(messages, handle)
+            except Exception as e:
+                if not handle.cancelled and on_error is not None:
+                    on_error(e)
+            else:
+                if not handle.cancelled:
+                    on_result(text)
+        
+        def done(future):
+            with self.lock:
+                self.active.discard(handle)
+        
+        with self.lock:
+            self.active.add(handle)
+        handle.future = self.executor.submit(run)
+        handle.future.add_done_callback(done)
+        return handle
+    
+    def shutdown(self):
+        with self.lock:
+            handles = list(self.active)
+        for handle in handles:
+            handle.cancel()
+        self.executor.shutdown(wait=False)
+        self.pool.close_all()
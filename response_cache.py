@@ -0,0 +1,123 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from storage import atomic_write
+
+# 🗃 КЭШ ОТВЕТОВ
+# LRU-кэш с ограничением по размеру и времени жизни записей. Ключ - нормализованный
+# текст запроса + персонаж ИИ + провайдер/модель + отпечаток истории диалога, так
+# что повтор того же вопроса тому же персонажу в том же разговоре не стоит
+# сетевого запроса, а короткое "почему?" не получит ответ из чужой беседы.
+
+class ResponseCache:
+    def __init__(self, max_entries=500, ttl=24 * 3600, cache_file=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dirty = False
+        if cache_file:
+            self.load()
+    
+    @staticmethod
+    def normalize(prompt):
+        # "Привет,  как дела?!" и "привет как дела" - один и тот же запрос
+        text = prompt.lower().replace("ё", "е")
+        text = re.sub(r"[^\w\s]", " ", text)
+        return " ".join(text.split())
+    
+    def make_key(self, prompt, character, provider, model, history=""):
+        # history - отпечаток переписки, которую видит модель (ContextBuilder.digest)
+        return "\x1f".join([
+            self.normalize(prompt),
+            character.get("name", ""),
+            character.get("personality", ""),
+            character.get("style", ""),
+            provider,
+            model or "",
+            history
+        ])
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, text = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                self.evictions += 1
+                self.misses += 1
+                self.dirty = True
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return text
+    
+    def put(self, key, text):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, text)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            self.dirty = True
+    
+    def clear(self):
+        with self.lock:
+            if self.entries:
+                self.entries.clear()
+                self.dirty = True
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+    
+    def load(self):
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+        
+        now = time.time()
+        with self.lock:
+            try:
+                for key, expires_at, text in stored:
+                    if expires_at > now:
+                        self.entries[key] = (expires_at, text)
+            except (TypeError, ValueError):
+                # Файл другого формата или испорчен - начинаем с пустого кэша
+                self.entries.clear()
+                return
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def save(self):
+        if not self.cache_file:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            now = time.time()
+            stored = [[key, expires_at, text] for key, (expires_at, text) in self.entries.items() if expires_at > now]
+            self.dirty = False
+        atomic_write(self.cache_file, json.dumps(stored, ensure_ascii=False))
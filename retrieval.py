@@ -0,0 +1,219 @@
+import hashlib
+import heapq
+import json
+import math
+import os
+import random
+import re
+import struct
+import threading
+from array import array
+
+# 🔎 ЛОКАЛЬНЫЙ ПОИСК ОТВЕТОВ
+# Офлайн-движок ответов: корпус пар "реплика -> ответ" для каждого характера,
+# инвертированный индекс по символьным триграммам с весами TF-IDF.
+# Индекс строится один раз и хранится в компактном бинарном файле:
+# заголовок, JSON со словарём и ответами, затем массивы постингов
+# (номера документов uint32 и квантованные веса uint16, по убыванию веса).
+
+INDEX_MAGIC = b"CCIX1\0"
+INDEX_VERSION = 2
+NGRAM = 3
+WEIGHT_SCALE = 65535
+
+# Характер -> файл корпуса в data/corpus (латиница - для упаковки в APK)
+CORPORA = {
+    "дружелюбный": "friendly",
+    "профессиональный": "professional",
+    "веселый": "cheerful",
+    "заботливый": "caring"
+}
+
+def normalize(text):
+    text = text.lower().replace("ё", "е")
+    return " ".join(re.sub(r"[^\w]", " ", text).split())
+
+def char_ngrams(text):
+    padded = f" {normalize(text)} "
+    counts = {}
+    for i in range(len(padded) - NGRAM + 1):
+        gram = padded[i:i + NGRAM]
+        counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+def corpus_digest(path):
+    # Индекс привязан к содержимому корпуса, а не ко времени изменения файлов
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_corpus(path):
+    # Строка корпуса: "реплика<TAB>ответ"; пустые строки и # - комментарии
+    pairs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#") or "\t" not in line:
+                continue
+            prompt, reply = line.split("\t", 1)
+            pairs.append((prompt.strip(), reply.strip()))
+    return pairs
+
+class RetrievalIndex:
+    def __init__(self, grams, replies, docs, weights, source=None):
+        self.source = source
+        self.grams = grams
+        self.replies = replies
+        self.docs = docs
+        self.weights = weights
+    
+    @classmethod
+    def build(cls, pairs, source=None):
+        doc_vectors = [char_ngrams(prompt) for prompt, _ in pairs]
+        document_frequency = {}
+        for vector in doc_vectors:
+            for gram in vector:
+                document_frequency[gram] = document_frequency.get(gram, 0) + 1
+        
+        total = len(pairs)
+        idf = {gram: math.log((total + 1) / (df + 1)) + 1 for gram, df in document_frequency.items()}
+        
+        # Вектор документа нормируется, поэтому скор запроса - косинусная близость
+        postings = {}
+        for doc, vector in enumerate(doc_vectors):
+            weighted = {gram: (1 + math.log(tf)) * idf[gram] for gram, tf in vector.items()}
+            norm = math.sqrt(sum(w * w for w in weighted.values())) or 1.0
+            for gram, weight in weighted.items():
+                postings.setdefault(gram, []).append((doc, weight / norm))
+        
+        grams = {}
+        docs = array('I')
+        weights = array('H')
+        for gram in sorted(postings):
+            entries = sorted(postings[gram], key=lambda entry: entry[1], reverse=True)
+            grams[gram] = (len(docs), len(entries), idf[gram])
+            for doc, weight in entries:
+                docs.append(doc)
+                weights.append(min(WEIGHT_SCALE, int(round(weight * WEIGHT_SCALE))))
+        
+        return cls(grams, [reply for _, reply in pairs], docs, weights, source)
+    
+    def save(self, path):
+        meta = json.dumps({"source": self.source, "grams": self.grams, "replies": self.replies}, ensure_ascii=False).encode('utf-8')
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_MAGIC)
+            f.write(struct.pack("<III", INDEX_VERSION, len(meta), len(self.docs)))
+            f.write(meta)
+            f.write(self.docs.tobytes())
+            f.write(self.weights.tobytes())
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError(f"{path}: не индекс Chai Clone")
+            version, meta_length, postings = struct.unpack("<III", f.read(12))
+            if version != INDEX_VERSION:
+                raise ValueError(f"{path}: версия индекса {version}")
+            meta = json.loads(f.read(meta_length).decode('utf-8'))
+            docs = array('I')
+            docs.frombytes(f.read(postings * docs.itemsize))
+            weights = array('H')
+            weights.frombytes(f.read(postings * weights.itemsize))
+        grams = {gram: tuple(entry) for gram, entry in meta["grams"].items()}
+        return cls(grams, meta["replies"], docs, weights, meta.get("source"))
+    
+    def search(self, query, limit=5, budget=8000):
+        # Триграммы обходятся от редких к частым, а постинги внутри триграммы
+        # отсортированы по убыванию веса; после budget просмотренных постингов
+        # поиск останавливается - частые триграммы почти не различают документы,
+        # а время ответа не растёт с размером корпуса
+        terms = []
+        query_norm = 0.0
+        for gram, tf in char_ngrams(query).items():
+            entry = self.grams.get(gram)
+            if entry is None:
+                continue
+            offset, length, idf = entry
+            query_weight = (1 + math.log(tf)) * idf
+            query_norm += query_weight * query_weight
+            terms.append((length, offset, query_weight))
+        
+        scores = {}
+        get = scores.get
+        for length, offset, query_weight in sorted(terms):
+            take = min(length, budget)
+            if take <= 0:
+                break
+            budget -= take
+            for doc, weight in zip(self.docs[offset:offset + take], self.weights[offset:offset + take]):
+                scores[doc] = get(doc, 0.0) + query_weight * weight
+        
+        if not scores:
+            return []
+        # Нормируем на длину запроса, чтобы порог не зависел от его размера
+        scale = math.sqrt(query_norm) * WEIGHT_SCALE
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(doc, score / scale) for doc, score in best]
+
+class ResponseEngine:
+    # Индексы загружаются лениво, по характеру, при первом обращении
+    def __init__(self, corpus_dir, index_dir, min_score=0.15):
+        self.corpus_dir = corpus_dir
+        self.index_dir = index_dir
+        self.min_score = min_score
+        self.lock = threading.Lock()
+        self.indexes = {}
+    
+    def corpus_name(self, personality):
+        return CORPORA.get(personality, personality)
+    
+    def corpus_path(self, personality):
+        return os.path.join(self.corpus_dir, f"{self.corpus_name(personality)}.tsv")
+    
+    def index_path(self, personality):
+        return os.path.join(self.index_dir, f"{self.corpus_name(personality)}.idx")
+    
+    def index(self, personality):
+        with self.lock:
+            if personality not in self.indexes:
+                self.indexes[personality] = self.open_index(personality)
+            return self.indexes[personality]
+    
+    def open_index(self, personality):
+        corpus_path = self.corpus_path(personality)
+        if not os.path.exists(corpus_path):
+            return None
+        
+        # Готовый индекс рядом с корпусом (собран при сборке) или в рабочем каталоге
+        source = corpus_digest(corpus_path)
+        for path in (corpus_path[:-4] + ".idx", self.index_path(personality)):
+            if not os.path.exists(path):
+                continue
+            try:
+                index = RetrievalIndex.load(path)
+            except (OSError, ValueError, struct.error):
+                continue
+            if index.source == source:
+                return index
+        
+        index = RetrievalIndex.build(read_corpus(corpus_path), source)
+        os.makedirs(self.index_dir, exist_ok=True)
+        index.save(self.index_path(personality))
+        return index
+    
+    def reply(self, personality, message):
+        index = self.index(personality)
+        if index is None:
+            return None
+        results = index.search(message)
+        if not results or results[0][1] < self.min_score:
+            return None
+        # Среди почти равных кандидатов выбираем случайно, чтобы ответы не повторялись
+        top_score = results[0][1]
+        candidates = [doc for doc, score in results if score >= top_score * 0.95]
+        return index.replies[random.choice(candidates)]
@@ -0,0 +1,265 @@
+import threading
+import time
+from collections import deque
+
+from providers import ProviderError, RequestCancelled
+
+# 🧭 МАРШРУТИЗАЦИЯ ЗАПРОСОВ
+# Выбирает облачного провайдера для каждого запроса по живой статистике:
+# задержке до первого токена и доле ошибок за последние запросы. Провайдер,
+# который часто падает, на время выводится из ротации. Если основной провайдер
+# не ответил дольше своего p95, запрос дублируется на следующий (hedging):
+# побеждает тот, кто первым начал отвечать, второй запрос отменяется.
+# При ошибке запрос автоматически уходит на следующего провайдера.
+
+class ProviderStats:
+    def __init__(self, window=50):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.down_until = 0.0
+        self.last_success = 0.0
+    
+    def record_success(self, latency):
+        with self.lock:
+            self.last_success = time.monotonic()
+            self.requests += 1
+            self.latencies.append(latency)
+            self.outcomes.append(True)
+            self.consecutive_errors = 0
+    
+    def record_error(self, cooldown, max_consecutive):
+        with self.lock:
+            self.requests += 1
+            self.errors += 1
+            self.outcomes.append(False)
+            self.consecutive_errors += 1
+            if self.consecutive_errors >= max_consecutive:
+                self.down_until = time.monotonic() + cooldown
+    
+    def expected_latency(self, min_samples, stale_after):
+        # Мало замеров или они устарели - провайдер стоит перепроверить
+        with self.lock:
+            if len(self.latencies) < min_samples or time.monotonic() - self.last_success > stale_after:
+                return 0.0
+        return self.percentile(0.50)
+    
+    def percentile(self, q):
+        with self.lock:
+            if not self.latencies:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    
+    def error_rate(self):
+        with self.lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+    
+    def is_healthy(self, max_error_rate):
+        if time.monotonic() < self.down_until:
+            return False
+        # Пара случайных ошибок на старте ещё не повод выводить провайдера из ротации
+        with self.lock:
+            if len(self.outcomes) < 5:
+                return True
+        return self.error_rate() <= max_error_rate
+    
+    def snapshot(self):
+        p50 = self.percentile(0.50)
+        p95 = self.percentile(0.95)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": self.error_rate(),
+            "p50_ms": None if p50 is None else round(p50 * 1000),
+            "p95_ms": None if p95 is None else round(p95 * 1000),
+            "down": time.monotonic() < self.down_until
+        }
+
+class RoutedRequest:
+    # Дескриптор маршрутизированного запроса: отмена гасит все попытки сразу
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancel_event = threading.Event()
+        self.attempts = []
+        self.timer = None
+        self.winner = None
+        self.finished = False
+    
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+    
+    def cancel(self):
+        with self.lock:
+            self.cancel_event.set()
+            attempts = list(self.attempts)
+            timer = self.timer
+        if timer is not None:
+            timer.cancel()
+        for attempt in attempts:
+            attempt.cancel()
+
+class ProviderRouter:
+    def __init__(self, client, settings=None):
+        self.client = client
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.configure(settings or {})
+    
+    def configure(self, settings):
+        self.hedging = settings.get("hedging", True)
+        # 0 - порог по p95 основного провайдера, иначе фиксированный, мс
+        self.hedge_after_ms = settings.get("hedge_after_ms", 0)
+        self.hedge_default_ms = settings.get("hedge_default_ms", 2000)
+        self.hedge_min_ms = settings.get("hedge_min_ms", 300)
+        self.max_error_rate = settings.get("max_error_rate", 0.5)
+        self.max_consecutive_errors = settings.get("max_consecutive_errors", 3)
+        self.cooldown = settings.get("cooldown_s", 30)
+        self.stale_after = settings.get("stale_after_s", 120)
+    
+    def provider_stats(self, name):
+        with self.lock:
+            if name not in self.stats:
+                self.stats[name] = ProviderStats()
+            return self.stats[name]
+    
+    def rank(self, providers):
+        # Здоровые - по медианной задержке; без свежей статистики - первыми, чтобы её набрать
+        def key(provider):
+            stats = self.provider_stats(provider.name)
+            return (not stats.is_healthy(self.max_error_rate), stats.expected_latency(5, self.stale_after))
+        return sorted(providers, key=key)
+    
+    def hedge_delay(self, provider):
+        if self.hedge_after_ms:
+            return self.hedge_after_ms / 1000
+        p95 = self.provider_stats(provider.name).percentile(0.95)
+        if p95 is None:
+            return self.hedge_default_ms / 1000
+        return max(self.hedge_min_ms / 1000, p95)
+    
+    def submit(self, providers, build_messages, on_result, on_error=None, on_token=None):
+        # build_messages(provider) собирает запрос под модель провайдера.
+        # Колбэки, как и у ProviderClient, вызываются в рабочем потоке
+        request = RoutedRequest()
+        queue = deque(self.rank(providers))
+        last_error = [None]
+        
+        def launch(hedge=False):
+            with request.lock:
+                if request.cancelled or request.finished or request.winner is not None or not queue:
+                    return False
+                provider = queue.popleft()
+            started = time.perf_counter()
+            state = {"provider": provider, "hedge": hedge}
+            
+            def claim():
+                # Первый ответивший становится победителем, остальные попытки отменяются
+                with request.lock:
+                    if request.winner is None and not request.finished:
+                        request.winner = state
+                        losers = [a for a in request.attempts if a is not state.get("handle")]
+                        timer = request.timer
+                    else:
+                        return request.winner is state
+                if timer is not None:
+                    timer.cancel()
+                self.provider_stats(provider.name).record_success(time.perf_counter() - started)
+                if hedge:
+                    self.count("hedge_wins")
+                for attempt in losers:
+                    attempt.cancel()
+                return True
+            
+            def token(text):
+                if claim():
+                    on_token(text)
+            
+            def result(text):
+                if not claim():
+                    return
+                with request.lock:
+                    request.finished = True
+                on_result(text)
+            
+            def error(e):
+                if isinstance(e, RequestCancelled):
+                    return
+                self.provider_stats(provider.name).record_error(self.cooldown, self.max_consecutive_errors)
+                last_error[0] = e
+                with request.lock:
+                    request.attempts.remove(state["handle"])
+                    # Победитель уже отдал часть ответа - переключаться поздно
+                    if request.winner is state:
+                        request.finished = True
+                        failed = True
+                    else:
+                        failed = False
+                    others = bool(request.attempts)
+                if failed:
+                    if on_error is not None:
+                        on_error(e)
+                    return
+                if others:
+                    # Параллельная попытка ещё идёт - ждём её
+                    return
+                self.count("failovers")
+                if not launch() and on_error is not None:
+                    with request.lock:
+                        if request.finished or request.cancelled:
+                            return
+                        request.finished = True
+                    on_error(last_error[0] or ProviderError("Нет доступных провайдеров"))
+            
+            with request.lock:
+                # submit может вызвать колбэк ошибки раньше, чем вернёт дескриптор
+                handle = self.client.submit(provider, build_messages(provider), result, error,
+                                            token if on_token is not None else None)
+                state["handle"] = handle
+                request.attempts.append(handle)
+            if not hedge and self.hedging and queue:
+                self.schedule_hedge(request, provider, launch)
+            return True
+        
+        launch()
+        return request
+    
+    def schedule_hedge(self, request, provider, launch):
+        def fire():
+            with request.lock:
+                if request.winner is not None or request.finished or request.cancelled:
+                    return
+            if launch(hedge=True):
+                self.count("hedges")
+        
+        timer = threading.Timer(self.hedge_delay(provider), fire)
+        timer.daemon = True
+        with request.lock:
+            # После переключения на другого провайдера старый таймер не нужен
+            if request.timer is not None:
+                request.timer.cancel()
+            request.timer = timer
+        timer.start()
+    
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+    
+    def snapshot(self):
+        with self.lock:
+            names = list(self.stats)
+        return {
+            "providers": {name: self.provider_stats(name).snapshot() for name in names},
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers
+        }
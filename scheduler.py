@@ -0,0 +1,99 @@
+import time
+from collections import deque
+
+# 🚦 ОЧЕРЕДЬ ОТВЕТОВ
+# Планировщик запросов одного диалога: ограничивает число одновременных запросов,
+# отдаёт результаты строго в порядке отправки и склеивает сообщения, которые
+# пользователь успел отправить, пока их запрос ещё не начался.
+# Все методы вызываются из UI-потока.
+
+class ReplyJob:
+    def __init__(self, prompt):
+        self.prompts = [prompt]
+        self.handle = None
+        self.started = False
+        self.finished = False
+        self.result = None
+        self.error = None
+        # Время постановки в очередь, отправки и первого токена (perf_counter) - для метрик
+        self.created_at = time.perf_counter()
+        self.started_at = None
+        self.first_token_at = None
+    
+    @property
+    def prompt(self):
+        return "\n".join(self.prompts)
+
+class ReplyScheduler:
+    def __init__(self, start, deliver, max_in_flight=1, on_depth_changed=None):
+        # start(job) запускает запрос и возвращает дескриптор с cancel();
+        # deliver(job) получает завершённые задачи в порядке отправки
+        self.start = start
+        self.deliver = deliver
+        self.max_in_flight = max(1, max_in_flight)
+        self.on_depth_changed = on_depth_changed
+        self.jobs = deque()
+        self.in_flight = 0
+        self.merged = 0
+        self.cancelled = 0
+    
+    def depth(self):
+        return len(self.jobs)
+    
+    def merge(self, prompt):
+        # Последний запрос ещё не отправлен - дописываем сообщение в него
+        if self.jobs and not self.jobs[-1].started:
+            job = self.jobs[-1]
+            job.prompts.append(prompt)
+            self.merged += 1
+            return job
+        return None
+    
+    def submit(self, job):
+        self.jobs.append(job)
+        self.pump()
+        self.depth_changed()
+    
+    def pump(self):
+        for job in self.jobs:
+            if self.in_flight >= self.max_in_flight:
+                break
+            if not job.started:
+                job.started = True
+                job.started_at = time.perf_counter()
+                self.in_flight += 1
+                job.handle = self.start(job)
+    
+    def complete(self, job, result):
+        self.finish(job, result=result)
+    
+    def fail(self, job, error):
+        self.finish(job, error=error)
+    
+    def finish(self, job, result=None, error=None):
+        if job.finished or job not in self.jobs:
+            return
+        job.finished = True
+        job.result = result
+        job.error = error
+        self.in_flight -= 1
+        
+        # Готовые ответы выдаём только с головы очереди, сохраняя порядок
+        while self.jobs and self.jobs[0].finished:
+            self.deliver(self.jobs.popleft())
+        
+        self.pump()
+        self.depth_changed()
+    
+    def cancel_all(self):
+        for job in self.jobs:
+            if job.started and not job.finished and job.handle is not None:
+                job.handle.cancel()
+            self.cancelled += 1
+        self.jobs.clear()
+        self.in_flight = 0
+        self.depth_changed()
+    
+    def depth_changed(self):
+        if self.on_depth_changed is not None:
+            self.on_depth_changed(self.depth())
@@ -0,0 +1,475 @@
+import argparse
+import asyncio
+import functools
+import json
+import os
+import re
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from core import AISystem, Config, award_reply
+from history import ChatHistory
+from metrics import registry
+from providers import last_user_message
+from sessions import ChatSession, SessionCache
+
+# 🌐 СЕРВЕР ЧАТА
+# Те же персонажи и движок ответов (core.py) без Kivy - для многих пользователей
+# сразу. asyncio и HTTP/1.1 с keep-alive, по умолчанию только на 127.0.0.1:
+#   POST /v1/sessions                  {"title", "persona"} -> {"session": id, ...}
+#   GET  /v1/sessions/<id>/messages    ?before=<id>&limit=50 - страница истории
+#   POST /v1/sessions/<id>/messages    {"text", "stream"} -> ответ JSON или поток SSE
+#   POST /v1/chat/completions          OpenAI-совместимый вход без состояния
+#   GET  /v1/health, GET /v1/stats
+# Ответы потоком - Server-Sent Events: события {"token": ...}, затем "done" с
+# ответом и профилем. WebSocket не нужен: сообщения клиент шлёт обычными POST,
+# а поток от сервера к клиенту - SSE, так что хватает стандартной библиотеки. У каждого чата своё окно контекста, профиль (опыт и
+# уровень) и очередь: ответы одного чата идут по порядку, разные чаты - параллельно.
+# Приложение подключается к серверу как к custom_api:
+#   endpoint = http://127.0.0.1:8800/v1/chat/completions
+# Запуск: python server.py --port 8800 --data-dir chaiclone_server
+# Свой каталог данных - свой конфиг; custom_api в нём не должен указывать на сам сервер.
+
+MAX_BODY = 64 * 1024
+# Заголовки запроса: не больше стольких строк и байт вместе со строкой запроса
+MAX_HEADERS = 100
+MAX_HEADER_BYTES = 16 * 1024
+DEFAULT_PROFILE = {"messages_sent": 0, "xp": 0, "level": 1}
+
+STATUS_TEXT = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    431: "Request Header Fields Too Large",
+    502: "Bad Gateway",
+    503: "Service Unavailable"
+}
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        self.method = method
+        self.target = target
+        self.headers = headers
+        self.body = body
+    
+    @property
+    def keep_alive(self):
+        return self.headers.get("connection", "").lower() != "close"
+    
+    def json(self):
+        try:
+            payload = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "Тело запроса - не JSON")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "Ожидается объект JSON")
+        return payload
+
+async def read_line(reader):
+    # Строка длиннее буфера потока - readline() бросает ValueError, а не отдаёт кусок
+    try:
+        return await reader.readline()
+    except ValueError:
+        raise HTTPError(431, "Слишком длинная строка заголовка")
+
+async def read_request(reader):
+    line = await read_line(reader)
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode('latin-1').split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Некорректная строка запроса")
+    headers = {}
+    size = len(line)
+    # Считаются строки, а не имена: повторы одного заголовка тоже занимают место
+    for count in range(MAX_HEADERS + 1):
+        line = await read_line(reader)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        size += len(line)
+        if size > MAX_HEADER_BYTES or count == MAX_HEADERS:
+            raise HTTPError(431, "Слишком большие заголовки")
+        name, _, value = line.decode('latin-1').partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "Некорректный Content-Length")
+    if length > MAX_BODY:
+        raise HTTPError(413, "Слишком большой запрос")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method.upper(), target, headers, body)
+
+async def send_json(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+
+class EventStream:
+    # Ответ потоком: SSE поверх chunked, чтобы соединение оставалось keep-alive
+    def __init__(self, writer):
+        self.writer = writer
+    
+    async def start(self):
+        self.writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n"
+                          b"Cache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n\r\n")
+        await self.writer.drain()
+    
+    async def send(self, payload, event=None):
+        data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        text = (f"event: {event}\n" if event else "") + f"data: {data}\n\n"
+        chunk = text.encode('utf-8')
+        self.writer.write(f"{len(chunk):X}\r\n".encode('ascii') + chunk + b"\r\n")
+        await self.writer.drain()
+    
+    async def end(self):
+        self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+
+class ServerSession(ChatSession):
+    # Чат на сервере: окно контекста, профиль и лок, выстраивающий ответы по порядку
+    def __init__(self, session_id, title, persona=None, profile=None):
+        super().__init__(session_id, title, persona)
+        self.profile = dict(DEFAULT_PROFILE, **(profile or {}))
+        self.lock = asyncio.Lock()
+        self.pending = 0
+    
+    @property
+    def busy(self):
+        # Чат с запросами в очереди не вытесняется из памяти
+        return self.pending > 0
+
+class ChatServer:
+    def __init__(self, ai_system, history, host="127.0.0.1", port=8800, max_connections=200,
+                 max_pending=4, max_in_memory=1000, reply_timeout=120):
+        self.ai_system = ai_system
+        self.config = ai_system.config
+        self.history = history
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        # Запросов одного чата в очереди, сверх - 429
+        self.max_pending = max_pending
+        self.reply_timeout = reply_timeout
+        self.sessions = SessionCache(max_in_memory=max_in_memory)
+        self.server = None
+        self.connections = 0
+        self.rejected = 0
+        self.requests = 0
+        self.active_replies = 0
+    
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+    
+    async def serve(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+    
+    async def run(self, function, *args, **kwargs):
+        # База истории синхронная - её вызовы уходят в пул потоков
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+    
+    # 🔌 СОЕДИНЕНИЯ
+    async def handle_connection(self, reader, writer):
+        if self.connections >= self.max_connections:
+            self.rejected += 1
+            registry.counter("server.rejected").inc()
+            try:
+                await send_json(writer, 503, {"error": {"message": "Сервер перегружен"}}, keep_alive=False)
+            except ConnectionError:
+                pass
+            writer.close()
+            return
+        
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HTTPError as e:
+                    await send_json(writer, e.status, {"error": {"message": e.message}}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                self.requests += 1
+                try:
+                    await self.dispatch(request, writer)
+                except HTTPError as e:
+                    await send_json(writer, e.status, {"error": {"message": e.message}}, request.keep_alive)
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # Клиент ушёл посреди запроса или ответа
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+    
+    async def dispatch(self, request, writer):
+        parts = urlsplit(request.target)
+        path = parts.path.rstrip("/")
+        query = parse_qs(parts.query)
+        
+        if path == "/v1/health":
+            await send_json(writer, 200, {"status": "ok"}, request.keep_alive)
+            return
+        if path == "/v1/stats":
+            await send_json(writer, 200, self.stats(), request.keep_alive)
+            return
+        if path == "/v1/sessions":
+            self.require_method(request, "POST")
+            await self.create_session(request, writer)
+            return
+        if path == "/v1/chat/completions":
+            self.require_method(request, "POST")
+            await self.completions(request, writer)
+            return
+        match = re.fullmatch(r"/v1/sessions/(\d+)/messages", path)
+        if match:
+            session_id = int(match.group(1))
+            if request.method == "GET":
+                await self.list_messages(request, writer, session_id, query)
+            else:
+                self.require_method(request, "POST")
+                await self.post_message(request, writer, session_id)
+            return
+        raise HTTPError(404, f"Нет такого адреса: {path}")
+    
+    def require_method(self, request, method):
+        if request.method != method:
+            raise HTTPError(405, f"Ожидается {method}")
+    
+    # 💬 ЧАТЫ
+    async def create_session(self, request, writer):
+        payload = request.json()
+        persona = payload.get("persona") or None
+        if persona is not None and not isinstance(persona, dict):
+            raise HTTPError(400, "persona - объект с полями ai_character")
+        title = str(payload.get("title") or "Чат")
+        session_id = await self.run(self.history.create_session, title, persona)
+        session = ServerSession(session_id, title, persona)
+        session.context = self.ai_system.make_context()
+        self.sessions.put(session)
+        await send_json(writer, 201, {"session": session_id, "title": title, "persona": persona,
+                                      "profile": session.profile}, request.keep_alive)
+    
+    async def session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            return session
+        # Чата нет в памяти - окно контекста из последней страницы истории
+        row = await self.run(self.history.get_session, session_id)
+        if row is None:
+            raise HTTPError(404, "Чат не найден")
+        rows = await self.run(self.history.load_last_page, session_id)
+        profile = await self.run(self.history.get_session_profile, session_id)
+        # Пока читали базу, чат мог открыть параллельный запрос
+        session = self.sessions.sessions.get(session_id)
+        if session is not None:
+            return session
+        session = ServerSession(row["id"], row["title"], row["persona"], profile)
+        session.context = self.ai_system.make_context()
+        session.context.seed(rows)
+        self.sessions.put(session)
+        return session
+    
+    async def list_messages(self, request, writer, session_id, query):
+        await self.session(session_id)
+        try:
+            before = int(query["before"][0]) if "before" in query else None
+            limit = min(200, int(query["limit"][0])) if "limit" in query else None
+        except ValueError:
+            raise HTTPError(400, "before и limit - целые числа")
+        rows = await self.run(self.history.load_page_before, before, limit, session_id)
+        await send_json(writer, 200, {"messages": rows}, request.keep_alive)
+    
+    async def post_message(self, request, writer, session_id):
+        payload = request.json()
+        text = str(payload.get("text") or "").strip()
+        if not text:
+            raise HTTPError(400, "Пустое сообщение")
+        session = await self.session(session_id)
+        if session.pending >= self.max_pending:
+            raise HTTPError(429, "Слишком много запросов в этом чате")
+        
+        session.pending += 1
+        try:
+            async with session.lock:
+                if not payload.get("stream"):
+                    try:
+                        result = await self.reply(session, text)
+                    except Exception as e:
+                        raise HTTPError(502, str(e))
+                    await send_json(writer, 200, result, request.keep_alive)
+                    return
+                
+                stream = EventStream(writer)
+                await stream.start()
+                try:
+                    result = await self.reply(session, text, lambda token: stream.send({"token": token}))
+                except (ConnectionError, asyncio.CancelledError):
+                    raise
+                except Exception as e:
+                    await stream.send({"message": str(e)}, event="error")
+                else:
+                    await stream.send(result, event="done")
+                await stream.end()
+        finally:
+            session.pending -= 1
+            self.sessions.evict()
+    
+    async def reply(self, session, text, on_token=None):
+        # Сообщение, ответ и профиль сохраняются в базу; контекст - по порядку чата
+        started = time.perf_counter()
+        await self.run(self.history.append, text, True, session.id)
+        character = session.character(self.config.data["ai_character"])
+        response = await self.generate(text, character, session.context, on_token)
+        
+        message_id = await self.run(self.history.append, response, False, session.id)
+        self.ai_system.record_exchange(text, response, session.context)
+        changes = award_reply(session.profile)
+        session.profile.update(changes)
+        await self.run(self.history.update_session, session.id, profile=session.profile)
+        registry.histogram("server.reply_ms").observe((time.perf_counter() - started) * 1000)
+        return {"message_id": message_id, "text": response, "profile": dict(session.profile),
+                "level_up": "level" in changes}
+    
+    async def generate(self, text, character, context, on_token=None):
+        # Колбэки AISystem приходят из рабочих потоков - переносим их в цикл событий
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        started = time.perf_counter()
+        
+        def push(kind, value):
+            loop.call_soon_threadsafe(events.put_nowait, (kind, value))
+        
+        self.active_replies += 1
+        handle = self.ai_system.request_response(
+            text,
+            on_result=lambda result: push("result", result),
+            on_error=lambda error: push("error", error),
+            on_token=(lambda token: push("token", token)) if on_token is not None else None,
+            character=character,
+            context=context
+        )
+        first_token = True
+        try:
+            while True:
+                kind, value = await asyncio.wait_for(events.get(), self.reply_timeout)
+                if kind == "token":
+                    if first_token:
+                        first_token = False
+                        registry.histogram("server.first_token_ms").observe((time.perf_counter() - started) * 1000)
+                    await on_token(value)
+                elif kind == "error":
+                    raise value
+                else:
+                    return value
+        except BaseException:
+            # Клиент ушёл или ответ не пришёл вовремя - запрос к провайдеру больше не нужен
+            handle.cancel()
+            raise
+        finally:
+            self.active_replies -= 1
+    
+    # 🔁 OPENAI-СОВМЕСТИМЫЙ ВХОД
+    async def completions(self, request, writer):
+        # Без состояния: история приходит в запросе (так работает custom_api приложения),
+        # персонаж - из настроек сервера
+        payload = request.json()
+        messages = payload.get("messages")
+        if not isinstance(messages, list) or not messages:
+            raise HTTPError(400, "Нужен список messages")
+        prompt = last_user_message(messages)
+        if not prompt:
+            raise HTTPError(400, "Нет сообщения пользователя")
+        turns = [message for message in messages if message.get("role") in ("user", "assistant")]
+        context = self.ai_system.make_context()
+        context.seed({"is_user": turn["role"] == "user", "text": turn.get("content", "")} for turn in turns[:-1])
+        character = self.config.data["ai_character"]
+        
+        if not payload.get("stream"):
+            try:
+                text = await self.generate(prompt, character, context)
+            except Exception as e:
+                raise HTTPError(502, str(e))
+            await send_json(writer, 200, {"choices": [{"message": {"role": "assistant", "content": text}}]},
+                            request.keep_alive)
+            return
+        
+        stream = EventStream(writer)
+        await stream.start()
+        try:
+            await self.generate(prompt, character, context,
+                                lambda token: stream.send({"choices": [{"delta": {"content": token}}]}))
+        except (ConnectionError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            await stream.send({"error": {"message": str(e)}})
+        await stream.send("[DONE]")
+        await stream.end()
+    
+    def stats(self):
+        return {
+            "connections": self.connections,
+            "max_connections": self.max_connections,
+            "rejected": self.rejected,
+            "requests": self.requests,
+            "active_replies": self.active_replies,
+            "sessions": self.sessions.stats(),
+            "reply_ms": registry.histogram("server.reply_ms").snapshot(),
+            "first_token_ms": registry.histogram("server.first_token_ms").snapshot()
+        }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Сервер чата Chai Clone для многих пользователей")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--data-dir", default="chaiclone_server", help="каталог конфига и базы сервера")
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--max-pending", type=int, default=4, help="запросов одного чата в очереди")
+    parser.add_argument("--sessions-in-memory", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=32, help="одновременных запросов к провайдерам")
+    parser.add_argument("--token-delay", type=float, default=0.05, help="пауза между словами локального ответа, сек")
+    return parser.parse_args()
+
+def main_entry():
+    args = parse_args()
+    os.makedirs(args.data_dir, exist_ok=True)
+    os.chdir(args.data_dir)
+    config = Config.shared()
+    ai_system = AISystem(config, max_workers=args.workers)
+    ai_system.local_provider.token_delay = args.token_delay
+    history = ChatHistory()
+    server = ChatServer(ai_system, history, args.host, args.port, args.max_connections,
+                        args.max_pending, args.sessions_in_memory)
+    print(f"Chai Clone: http://{args.host}:{args.port}/v1/health")
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ai_system.shutdown()
+        history.close()
+        config.flush()
+
+if __name__ == '__main__':
+    main_entry()
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+
+# 💬 ЧАТЫ В ПАМЯТИ
+# Все чаты хранятся в базе истории; в памяти держится рабочий набор - активный
+# чат и несколько недавних: данные списка сообщений, его виджет, окно контекста
+# и очередь ответов. Переключение на чат из набора - замена одного виджета,
+# без перечитывания истории и пересборки пузырей. Самый давний чат вытесняется,
+# когда набор превышает лимит; в следующий раз он открывается с последней страницы.
+# Не зависит от Kivy: виджет и очередь создаёт экран чата.
+
+class ChatSession:
+    def __init__(self, session_id, title, persona=None):
+        self.id = session_id
+        self.title = title
+        # Поля ai_character, переопределённые в этом чате (None - общие настройки)
+        self.persona = persona
+        self.view = None
+        self.layout = None
+        self.context = None
+        self.scheduler = None
+        # Пузыри ответов, ждущих в очереди неотправленных запросов: id записи -> сообщение
+        self.outbox = {}
+        # Границы загруженной страницы (см. ChatHistory)
+        self.oldest_loaded_id = None
+        self.has_older_messages = True
+        self.newest_loaded_id = None
+        self.has_newer_messages = False
+    
+    @property
+    def data(self):
+        return self.view.data if self.view is not None else []
+    
+    @property
+    def busy(self):
+        # Ответ ещё в очереди или печатается - такой чат не выгружается
+        return self.scheduler is not None and self.scheduler.depth() > 0
+    
+    def character(self, defaults):
+        if not self.persona:
+            return defaults
+        return dict(defaults, **self.persona)
+
+class SessionCache:
+    def __init__(self, max_in_memory=3, on_evict=None):
+        self.max_in_memory = max(1, max_in_memory)
+        self.on_evict = on_evict
+        self.sessions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def __len__(self):
+        return len(self.sessions)
+    
+    def __iter__(self):
+        return iter(list(self.sessions.values()))
+    
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.sessions.move_to_end(session_id)
+        return session
+    
+    def put(self, session):
+        self.sessions[session.id] = session
+        self.sessions.move_to_end(session.id)
+        self.evict()
+    
+    def discard(self, session_id):
+        return self.sessions.pop(session_id, None)
+    
+    def resize(self, max_in_memory):
+        self.max_in_memory = max(1, max_in_memory)
+        self.evict()
+    
+    def evict(self):
+        # Последний использованный (активный) и занятые чаты остаются; если занятых
+        # больше лимита, набор временно превышает его
+        for session_id in list(self.sessions)[:-1]:
+            if len(self.sessions) <= self.max_in_memory:
+                break
+            session = self.sessions[session_id]
+            if session.busy:
+                continue
+            del self.sessions[session_id]
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(session)
+    
+    def stats(self):
+        return {
+            "in_memory": len(self.sessions),
+            "max_in_memory": self.max_in_memory,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
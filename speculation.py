@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import deque
+
+# 🔮 УПРЕЖДАЮЩИЙ ОТВЕТ
+# Пока пользователь печатает, ответ на набранный текст можно запросить заранее:
+# UI после паузы в наборе вызывает update(), и если текст к моменту отправки
+# не изменился, take() отдаёт уже идущий или готовый ответ вместо нового
+# запроса. Изменившийся текст отменяет прежний запрос - он считается
+# потраченным впустую. Чтобы упреждение не умножало расходы на облако,
+# короткие тексты не запрашиваются, а число запросов в минуту ограничено.
+# Не зависит от Kivy; update() и take() вызываются из UI-потока.
+
+class Speculation:
+    # Ответ, запрошенный заранее. Токены копятся, пока ответ никому не нужен;
+    # adopt() отдаёт накопленное и дальше передаёт токены сразу
+    def __init__(self, prompt, key):
+        self.prompt = prompt
+        self.key = key
+        self.lock = threading.Lock()
+        self.handle = None
+        self.tokens = []
+        self.outcome = None
+        self.listener = None
+    
+    def on_token(self, token):
+        with self.lock:
+            if self.listener is None:
+                self.tokens.append(token)
+            else:
+                self.listener[0](token)
+    
+    def on_result(self, text):
+        self.finish(("result", text))
+    
+    def on_error(self, error):
+        self.finish(("error", error))
+    
+    def finish(self, outcome):
+        with self.lock:
+            self.outcome = outcome
+            if self.listener is not None:
+                self.deliver()
+    
+    def deliver(self):
+        kind, value = self.outcome
+        if kind == "result":
+            self.listener[1](value)
+        else:
+            self.listener[2](value)
+    
+    def adopt(self, on_token, on_result, on_error):
+        # Под локом: токены из рабочего потока не обгонят уже накопленные
+        with self.lock:
+            for token in self.tokens:
+                on_token(token)
+            self.tokens = []
+            self.listener = (on_token, on_result, on_error)
+            if self.outcome is not None:
+                self.deliver()
+        return self.handle
+    
+    def cancel(self):
+        if self.handle is not None and self.outcome is None:
+            self.handle.cancel()
+
+class Speculator:
+    def __init__(self, start, min_chars=8, max_per_minute=6):
+        # start(speculation) запускает запрос и возвращает дескриптор с cancel();
+        # токены и итог запрос передаёт в speculation.on_token/on_result/on_error
+        self.start = start
+        self.min_chars = min_chars
+        self.max_per_minute = max_per_minute
+        self.current = None
+        self.recent_starts = deque()
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+        self.throttled = 0
+    
+    def update(self, prompt, key):
+        # key - всё, кроме текста, от чего зависит ответ: чат, персонаж, история
+        prompt = prompt.strip()
+        current = self.current
+        if current is not None and current.prompt == prompt and current.key == key:
+            return
+        self.discard()
+        if len(prompt) < self.min_chars:
+            return
+        
+        now = time.monotonic()
+        while self.recent_starts and now - self.recent_starts[0] > 60:
+            self.recent_starts.popleft()
+        if len(self.recent_starts) >= self.max_per_minute:
+            self.throttled += 1
+            return
+        self.recent_starts.append(now)
+        
+        speculation = Speculation(prompt, key)
+        self.current = speculation
+        self.started += 1
+        speculation.handle = self.start(speculation)
+    
+    def take(self, prompt, key):
+        # Отправленный текст совпал с упреждённым - ответ уже идёт или готов
+        current = self.current
+        if current is None:
+            return None
+        self.current = None
+        if current.prompt == prompt.strip() and current.key == key:
+            self.hits += 1
+            return current
+        self.misses += 1
+        self.waste(current)
+        return None
+    
+    def discard(self):
+        if self.current is not None:
+            self.waste(self.current)
+            self.current = None
+    
+    def waste(self, speculation):
+        self.wasted += 1
+        speculation.cancel()
+    
+    def configure(self, min_chars, max_per_minute):
+        self.min_chars = min_chars
+        self.max_per_minute = max_per_minute
+    
+    def stats(self):
+        sends = self.hits + self.misses
+        return {
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "wasted": self.wasted,
+            "throttled": self.throttled,
+            "hit_rate": self.hits / sends if sends else 0.0
+        }
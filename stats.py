@@ -0,0 +1,159 @@
+import bisect
+import threading
+import time
+from datetime import datetime, timedelta
+
+from metrics import DEFAULT_BUCKETS
+
+# 📊 СТАТИСТИКА ИСПОЛЬЗОВАНИЯ
+# События (сообщение пользователя, ответ, ошибка) сразу складываются в сводки:
+# по часам и персонажам, плюс гистограмма задержек ответа по персонажам.
+# Приращения копятся в памяти и пишутся в базу истории пачкой, поэтому событие
+# стоит пару операций со словарём, а экран статистики читает только сводки -
+# сотни строк, а не всю историю.
+
+def merge_rows(connection, hourly, latency):
+    # Приращения складываются с уже записанными сводками; вызывать под локом истории
+    connection.executemany(
+        "INSERT INTO stats_hourly (hour, persona, messages, replies, errors, chars_in, chars_out, latency_ms) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (hour, persona) DO UPDATE SET "
+        "messages = messages + excluded.messages, replies = replies + excluded.replies, "
+        "errors = errors + excluded.errors, chars_in = chars_in + excluded.chars_in, "
+        "chars_out = chars_out + excluded.chars_out, latency_ms = latency_ms + excluded.latency_ms",
+        hourly
+    )
+    connection.executemany(
+        "INSERT INTO stats_latency (persona, bucket, count) VALUES (?, ?, ?) "
+        "ON CONFLICT (persona, bucket) DO UPDATE SET count = count + excluded.count",
+        latency
+    )
+    connection.commit()
+
+class UsageStats:
+    def __init__(self, history, flush_every=20):
+        # Таблицы stats_* создаются миграциями ChatHistory
+        self.history = history
+        self.flush_every = flush_every
+        self.lock = threading.Lock()
+        self.pending_hourly = {}
+        self.pending_latency = {}
+        self.pending_events = 0
+    
+    def hourly(self, persona):
+        key = (int(time.time() // 3600), persona)
+        row = self.pending_hourly.get(key)
+        if row is None:
+            row = self.pending_hourly[key] = {
+                "messages": 0, "replies": 0, "errors": 0, "chars_in": 0, "chars_out": 0, "latency_ms": 0.0
+            }
+        return row
+    
+    def record_message(self, persona, text):
+        with self.lock:
+            row = self.hourly(persona)
+            row["messages"] += 1
+            row["chars_in"] += len(text)
+            self.event()
+    
+    def record_reply(self, persona, text, latency_ms):
+        with self.lock:
+            row = self.hourly(persona)
+            row["replies"] += 1
+            row["chars_out"] += len(text)
+            row["latency_ms"] += latency_ms
+            key = (persona, bisect.bisect_left(DEFAULT_BUCKETS, latency_ms))
+            self.pending_latency[key] = self.pending_latency.get(key, 0) + 1
+            self.event()
+    
+    def record_error(self, persona):
+        with self.lock:
+            self.hourly(persona)["errors"] += 1
+            self.event()
+    
+    def event(self):
+        self.pending_events += 1
+        if self.pending_events >= self.flush_every:
+            self.flush_locked()
+    
+    def flush(self):
+        with self.lock:
+            self.flush_locked()
+    
+    def flush_locked(self):
+        if not self.pending_events:
+            return
+        hourly = [(hour, persona, row["messages"], row["replies"], row["errors"],
+                   row["chars_in"], row["chars_out"], row["latency_ms"])
+                  for (hour, persona), row in self.pending_hourly.items()]
+        latency = [(persona, bucket, count) for (persona, bucket), count in self.pending_latency.items()]
+        self.pending_hourly = {}
+        self.pending_latency = {}
+        self.pending_events = 0
+        
+        with self.history.lock:
+            merge_rows(self.history.connection, hourly, latency)
+    
+    def summary(self, days=7):
+        # Всё для экрана статистики: итоги, по дням (локальное время), по персонажам, задержки
+        self.flush()
+        since_hour = int(time.time() // 3600) - days * 24
+        connection = self.history.connection
+        with self.history.lock:
+            totals = connection.execute(
+                "SELECT COALESCE(SUM(messages), 0), COALESCE(SUM(replies), 0), COALESCE(SUM(errors), 0), "
+                "COALESCE(SUM(chars_in), 0), COALESCE(SUM(chars_out), 0), COALESCE(SUM(latency_ms), 0) "
+                "FROM stats_hourly"
+            ).fetchone()
+            recent = connection.execute(
+                "SELECT hour, SUM(messages), SUM(replies) FROM stats_hourly WHERE hour >= ? GROUP BY hour",
+                (since_hour,)
+            ).fetchall()
+            personas = connection.execute(
+                "SELECT persona, SUM(messages), SUM(replies), SUM(errors) FROM stats_hourly "
+                "WHERE persona != '' GROUP BY persona ORDER BY SUM(messages) DESC"
+            ).fetchall()
+            latency = connection.execute(
+                "SELECT bucket, SUM(count) FROM stats_latency GROUP BY bucket ORDER BY bucket"
+            ).fetchall()
+        
+        today = datetime.now().date()
+        per_day = {today - timedelta(days=offset): [0, 0] for offset in range(days)}
+        busiest_hours = [0] * 24
+        for hour, messages, replies in recent:
+            moment = datetime.fromtimestamp(hour * 3600)
+            if moment.date() in per_day:
+                per_day[moment.date()][0] += messages
+                per_day[moment.date()][1] += replies
+            busiest_hours[moment.hour] += messages
+        
+        messages, replies, errors, chars_in, chars_out, latency_total = totals
+        timed = sum(count for _, count in latency)
+        return {
+            "messages": messages,
+            "replies": replies,
+            "errors": errors,
+            "avg_message_chars": chars_in / messages if messages else 0,
+            "avg_reply_chars": chars_out / replies if replies else 0,
+            # Задержки есть только у ответов, записанных движком (без перенесённой истории)
+            "avg_latency_ms": latency_total / timed if timed else None,
+            "latency_p50_ms": bucket_percentile(latency, 0.50),
+            "latency_p95_ms": bucket_percentile(latency, 0.95),
+            "per_day": sorted(per_day.items()),
+            "busiest_hour": max(range(24), key=busiest_hours.__getitem__) if any(busiest_hours) else None,
+            "personas": [
+                {"persona": persona, "messages": m, "replies": r, "errors": e}
+                for persona, m, r, e in personas
+            ]
+        }
+
+def bucket_percentile(buckets, q):
+    # Верхняя граница корзины, в которую попадает q-я доля ответов
+    total = sum(count for _, count in buckets)
+    if not total:
+        return None
+    seen = 0
+    for bucket, count in buckets:
+        seen += count
+        if seen >= q * total:
+            return DEFAULT_BUCKETS[bucket] if bucket < len(DEFAULT_BUCKETS) else None
+    return None
@@ -0,0 +1,12 @@
+import os
+
+# 💾 АТОМАРНАЯ ЗАПИСЬ
+def atomic_write(path, text):
+    # Пишем во временный файл и подменяем им основной: при сбое посреди
+    # записи на диске остаётся либо старая, либо новая версия целиком
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# Тесты UI идут без окна: SDL offscreen, окно Kivy скрыто
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+os.environ.setdefault("KIVY_NO_FILELOG", "1")
+os.environ.setdefault("SDL_VIDEODRIVER", "offscreen")
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # Каждый тест - в пустом каталоге: свой конфиг, история и кэши
+    monkeypatch.chdir(tmp_path)
+    from core import Config
+    monkeypatch.setattr(Config, "_shared", None)
+    return tmp_path
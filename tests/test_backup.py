@@ -0,0 +1,80 @@
+import pytest
+
+from backup import BackupCancelled, Exporter, Importer
+from history import ChatHistory
+from stats import UsageStats
+
+def no_progress(done, total):
+    pass
+
+def totals(history):
+    return history.connection.execute("SELECT COALESCE(SUM(messages), 0) FROM stats_hourly").fetchone()[0]
+
+@pytest.fixture
+def backup(workdir):
+    history = ChatHistory("source.db")
+    second = history.create_session("Второй")
+    for number in range(250):
+        history.append(f"Сообщение {number}", number % 2 == 0, 1 if number < 120 else second)
+    stats = UsageStats(history)
+    for _ in range(10):
+        stats.record_message("friendly", "привет")
+    stats.flush()
+    Exporter(history, {}, "backup.jsonl.gz").run(no_progress)
+    yield history, "backup.jsonl.gz"
+    history.close()
+
+def test_reimport_does_not_duplicate(backup):
+    source, path = backup
+    summary = Importer(source, path).run(no_progress)
+    assert (summary["sessions"], summary["skipped"]) == (0, 2)
+    assert source.count() == 250 and totals(source) == 10
+    
+    target = ChatHistory("target.db")
+    for _ in range(2):
+        Importer(target, path, chunk_size=50).run(no_progress)
+    assert target.count() == 250
+    assert len(target.list_sessions()) == 3
+    assert totals(target) == 10
+    target.close()
+
+def test_cancelled_import_leaves_nothing(backup):
+    _, path = backup
+    target = ChatHistory("target.db")
+    calls = []
+    
+    def cancel_on_third(done, total):
+        calls.append(done)
+        if len(calls) == 3:
+            raise BackupCancelled()
+    
+    with pytest.raises(BackupCancelled):
+        Importer(target, path, chunk_size=50).run(cancel_on_third)
+    assert target.count() == 0
+    assert len(target.list_sessions()) == 1
+    
+    # Оборванный импорт не помечает чаты перенесёнными
+    assert Importer(target, path).run(no_progress)["sessions"] == 2
+    assert target.count() == 250
+    target.close()
+
+def test_failed_stats_merge_rolls_back_import(backup, monkeypatch):
+    import backup as backup_module
+    _, path = backup
+    target = ChatHistory("target.db")
+    
+    def broken_merge(connection, hourly, latency):
+        connection.executemany("INSERT INTO stats_latency (persona, bucket, count) VALUES (?, ?, ?)", latency)
+        raise OSError("диск полон")
+    
+    with monkeypatch.context() as patch:
+        patch.setattr(backup_module, "merge_rows", broken_merge)
+        with pytest.raises(OSError):
+            Importer(target, path).run(no_progress)
+    assert target.count() == 0
+    assert len(target.list_sessions()) == 1
+    assert totals(target) == 0
+    
+    assert Importer(target, path).run(no_progress)["sessions"] == 2
+    assert target.count() == 250 and totals(target) == 10
+    target.close()
@@ -0,0 +1,70 @@
+import pytest
+
+pytest.importorskip("kivy")
+
+def idle(frames=20):
+    from kivy.base import EventLoop
+    for _ in range(frames):
+        EventLoop.idle()
+
+@pytest.fixture
+def chat_screen(workdir):
+    from kivy.config import Config as KivyConfig
+    KivyConfig.set('graphics', 'window_state', 'hidden')
+    from kivy.core.window import Window
+    from kivy.uix.screenmanager import ScreenManager
+    import main
+    
+    screen = main.ChatScreen(name='chat')
+    manager = ScreenManager()
+    manager.add_widget(screen)
+    Window.add_widget(manager)
+    yield screen
+    Window.remove_widget(manager)
+    screen.outbox.stop()
+    screen.ai_system.shutdown()
+    screen.history.close()
+
+def test_history_renders_bubbles(chat_screen):
+    chat_screen.chat_history.data = [
+        chat_screen.make_message(f"Сообщение {number}", number % 2 == 0) for number in range(50)
+    ]
+    idle()
+    bubbles = chat_screen.message_layout.children
+    assert bubbles
+    assert len(bubbles) < 50
+
+def test_outbox_delivery_awards_xp_and_stats(chat_screen):
+    profile = dict(chat_screen.config.data["user_profile"])
+    entry = chat_screen.outbox.add(chat_screen.session.id, "привет", chat_screen.session_character(chat_screen.session))
+    message_id = chat_screen.outbox.complete(entry, "ответ из очереди")
+    entry["latency_ms"] = 120.0
+    chat_screen.on_outbox_delivered(entry, message_id, "ответ из очереди")
+    
+    assert chat_screen.config.data["user_profile"]["messages_sent"] == profile["messages_sent"] + 1
+    assert chat_screen.usage_stats.summary()["replies"] == 1
+
+def test_local_fallback_runs_off_the_ui_thread(chat_screen):
+    import threading
+    import time
+    from main import StreamingReply
+    
+    threads = []
+    generate = chat_screen.ai_system.generate_response
+    
+    def traced(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return generate(*args, **kwargs)
+    
+    chat_screen.ai_system.generate_response = traced
+    chat_screen.ai_system.local_provider.generate = traced
+    chat_screen.ai_system.local_provider.token_delay = 0
+    reply_msg = chat_screen.add_message("...", False)
+    reply_msg["placeholder"] = True
+    chat_screen.ai_error("привет", reply_msg, StreamingReply(lambda text: None), RuntimeError("облако упало"))
+    
+    deadline = time.monotonic() + 5
+    while reply_msg.get("placeholder") and time.monotonic() < deadline:
+        idle(1)
+    assert not reply_msg.get("placeholder")
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,63 @@
+import json
+import time
+
+import pytest
+
+import storage
+from core import Config
+
+def wait_written(config, count, timeout=3.0):
+    deadline = time.perf_counter() + timeout
+    while config.save_stats["written"] < count and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    # Запас на запоздавший таймер - лишней записи быть не должно
+    time.sleep(config.flush_delay * 3)
+    return config.save_stats["written"]
+
+def test_updates_within_delay_coalesce_into_one_write(workdir):
+    # Задержка с запасом: под нагрузкой цикл из 20 обновлений не должен её перерасти
+    config = Config(flush_delay=0.3)
+    # Первый запуск сохраняет конфиг по умолчанию
+    assert wait_written(config, 1) == 1
+    
+    for xp in range(1, 21):
+        config.set("user_profile.xp", xp)
+    assert wait_written(config, 2) == 2
+    assert config.save_stats["requested"] == 21
+    assert config.saves_avoided() == 19
+    with open(config.config_file, encoding='utf-8') as f:
+        assert json.load(f)["user_profile"]["xp"] == 20
+
+def test_unchanged_payload_is_not_written(workdir):
+    config = Config(flush_delay=0.05)
+    assert wait_written(config, 1) == 1
+    
+    # Значение меняется туда и обратно до записи - содержимое файла то же
+    config.set("theme", "light")
+    config.set("theme", "dark")
+    assert wait_written(config, 2) == 1
+    # Запись того же значения даже не планирует сохранение
+    config.set("theme", "dark")
+    assert config.save_stats["requested"] == 3
+
+def test_flush_writes_immediately(workdir):
+    config = Config(flush_delay=60)
+    config.set("user_profile.name", "Тест")
+    config.flush()
+    assert config.save_stats["written"] == 1
+    assert config.flush_timer is None
+    with open(config.config_file, encoding='utf-8') as f:
+        assert json.load(f)["user_profile"]["name"] == "Тест"
+
+def test_failed_atomic_write_keeps_old_file(workdir, monkeypatch):
+    path = str(workdir / "data.json")
+    storage.atomic_write(path, '{"version": 1}')
+    
+    def broken_fsync(fd):
+        raise OSError("диск отвалился")
+    
+    monkeypatch.setattr(storage.os, "fsync", broken_fsync)
+    with pytest.raises(OSError):
+        storage.atomic_write(path, '{"version": 2}')
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f) == {"version": 1}
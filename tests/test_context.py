@@ -0,0 +1,67 @@
+from context import ContextBuilder, estimate_tokens
+
+def fill(builder, count, text="Сообщение номер {number}. Продолжение, которое в сводку не попадёт."):
+    for number in range(count):
+        builder.add_turn("user" if number % 2 == 0 else "assistant", text.format(number=number))
+
+def message_tokens(messages):
+    return sum(estimate_tokens(message["content"]) for message in messages)
+
+def test_history_fits_the_token_budget():
+    builder = ContextBuilder(max_history_tokens=200, reply_tokens=64, summary_tokens=60)
+    fill(builder, 100)
+    messages = builder.build("gpt-4", "Ты - помощник.", "Новый вопрос")
+    
+    history = messages[1:-1]
+    assert message_tokens(history) <= 200
+    assert history[-1]["content"] == "Сообщение номер 99. Продолжение, которое в сводку не попадёт."
+    assert messages[-1] == {"role": "user", "content": "Новый вопрос"}
+    stats = builder.stats()["gpt-4"]
+    assert stats["tokens"] <= 200 and stats["turns"] == len(history)
+
+def test_small_model_limit_narrows_the_window():
+    builder = ContextBuilder(max_history_tokens=100000, reply_tokens=512, summary_tokens=300)
+    fill(builder, 150, text="Длинная реплика {number} " + "слово " * 40)
+    messages = builder.build("gpt-3.5-turbo", "Ты - помощник.", "Вопрос")
+    # Весь запрос вместе с ответом укладывается в контекст модели
+    assert message_tokens(messages) + 512 <= 4096
+
+def test_long_message_skips_old_turns_only_once():
+    builder = ContextBuilder(max_history_tokens=3000, reply_tokens=512, summary_tokens=300)
+    fill(builder, 120)
+    short = builder.build("gpt-3.5-turbo", "Ты - помощник.", "Коротко")
+    long = builder.build("gpt-3.5-turbo", "Ты - помощник.", "очень длинно " * 250)
+    assert message_tokens(long) + 512 <= 4096
+    assert len(long) < len(short)
+    # Окно не сузилось навсегда
+    assert builder.build("gpt-3.5-turbo", "Ты - помощник.", "Коротко") == short
+
+def test_old_turns_fold_into_the_summary():
+    builder = ContextBuilder(max_history_tokens=120, reply_tokens=64, summary_tokens=200)
+    fill(builder, 30)
+    system = builder.build("gpt-4", "Ты - помощник.", "Вопрос")[0]["content"]
+    
+    assert system.startswith("Ты - помощник.\n\nРанее в разговоре:\n")
+    # В сводку попадает первое предложение реплики
+    assert "Пользователь: Сообщение номер" in system and "Ты: Сообщение номер" in system
+    assert "Продолжение" not in system
+    assert builder.stats()["gpt-4"]["folded"] > 0
+    # Сводка тоже ограничена по размеру
+    assert estimate_tokens(system) <= estimate_tokens("Ты - помощник.") + 200 + 20
+
+def test_digest_changes_with_history():
+    builder = ContextBuilder()
+    assert builder.digest == ""
+    builder.add_turn("user", "Привет")
+    first = builder.digest
+    builder.add_turn("assistant", "Здравствуй")
+    assert builder.digest not in ("", first)
+    assert builder.version == 2
+    
+    # Та же история - тот же отпечаток, другая - другой
+    same = ContextBuilder()
+    same.seed([{"is_user": True, "text": "Привет"}, {"is_user": False, "text": "Здравствуй"}])
+    assert same.digest == builder.digest
+    other = ContextBuilder()
+    other.seed([{"is_user": True, "text": "Привет"}, {"is_user": True, "text": "Здравствуй"}])
+    assert other.digest != builder.digest
@@ -0,0 +1,33 @@
+import sqlite3
+
+import pytest
+
+import history
+from history import ChatHistory
+
+def test_failed_migration_is_rolled_back(workdir, monkeypatch):
+    migrations = history.MIGRATIONS + ["ALTER TABLE sessions ADD COLUMN extra TEXT; SELECT * FROM missing;"]
+    monkeypatch.setattr(history, "MIGRATIONS", migrations)
+    with pytest.raises(sqlite3.OperationalError):
+        ChatHistory()
+    
+    connection = sqlite3.connect("chaiclone_history.db")
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == len(migrations) - 1
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(sessions)")]
+    assert "extra" not in columns
+    connection.close()
+    
+    # Исправленная миграция проходит без "duplicate column"
+    migrations[-1] = "ALTER TABLE sessions ADD COLUMN extra TEXT;"
+    chat_history = ChatHistory()
+    assert chat_history.connection.execute("PRAGMA user_version").fetchone()[0] == len(migrations)
+    chat_history.close()
+
+def test_existing_database_keeps_its_chat(workdir):
+    chat_history = ChatHistory()
+    chat_history.append("привет", True)
+    chat_history.close()
+    chat_history = ChatHistory()
+    assert [message["text"] for message in chat_history.load_last_page()] == ["привет"]
+    assert chat_history.list_sessions()[0]["uid"]
+    chat_history.close()
@@ -0,0 +1,21 @@
+import pytest
+
+from history import ChatHistory
+
+@pytest.fixture(params=[True, False], ids=["fts", "scan"])
+def history(workdir, request):
+    history = ChatHistory()
+    if not request.param:
+        history.fts = False
+    elif not history.fts:
+        pytest.skip("SQLite без FTS5")
+    for text in ("Привет, как дела?", "Непривычно тихо", "приветствую всех", "Пока"):
+        history.append(text, True)
+    yield history
+    history.close()
+
+def test_prefix_matching_is_the_same_with_and_without_fts(history):
+    found = sorted(result["id"] for result in history.search("прив"))
+    assert found == [1, 3]
+    assert [result["id"] for result in history.search("прив дела")] == [1]
+    assert history.search("вычно") == []
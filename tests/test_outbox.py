@@ -0,0 +1,76 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from history import ChatHistory
+from outbox import Outbox
+from providers import ProviderClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+from stub_server import make_server
+
+REQUESTS = 24
+
+@pytest.fixture
+def stub():
+    # Сначала заглушка рвёт все соединения - "нет сети"
+    server = make_server(0, token_delay=0.0, drop_rate=1.0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def client():
+    client = ProviderClient()
+    yield client
+    client.shutdown()
+
+def test_each_entry_delivered_once_into_its_session(workdir, stub, client):
+    history = ChatHistory()
+    sessions = [history.create_session(f"Чат {number}") for number in range(3)]
+    provider = client.provider("custom_api", {
+        "enabled": True, "endpoint": f"http://127.0.0.1:{stub.server_address[1]}/v1/chat/completions", "api_key": ""
+    })
+    delivered = []
+    failed = []
+    
+    def send(entry, on_result, on_error):
+        return client.submit(provider, [{"role": "user", "content": entry["prompt"]}], on_result, on_error)
+    
+    outbox = Outbox(
+        history, send,
+        on_delivered=lambda entry, message_id, text: delivered.append((entry, message_id, text)),
+        on_failed=lambda entry, error: failed.append(entry),
+        base_delay=0.05, max_delay=0.3
+    )
+    outbox.start()
+    entries = [outbox.add(sessions[number % 3], f"вопрос {number}", {"name": "ИИ"}) for number in range(REQUESTS)]
+    time.sleep(0.5)
+    assert not delivered
+    
+    # Сеть вернулась, но часть соединений ещё рвётся
+    stub.RequestHandlerClass.drop_rate = 0.3
+    deadline = time.monotonic() + 30
+    while len(delivered) < REQUESTS and time.monotonic() < deadline:
+        time.sleep(0.05)
+    outbox.stop()
+    
+    assert not failed
+    assert sorted(entry["id"] for entry, _, _ in delivered) == [entry["id"] for entry in entries]
+    assert outbox.stats()["pending"] == 0
+    assert outbox.stats()["retries"] > 0
+    for entry, _, text in delivered:
+        assert text == f"Эхо: {entry['prompt']}"
+    for number, session_id in enumerate(sessions):
+        stored = [row["text"] for row in history.load_page_before(None, REQUESTS, session_id)]
+        assert sorted(stored) == sorted(f"Эхо: вопрос {index}" for index in range(number, REQUESTS, 3))
+    
+    # Повторное завершение уже доставленного запроса ничего не пишет
+    entry, _, text = delivered[0]
+    assert outbox.complete(entry, text) is None
+    assert history.count() == REQUESTS
+    history.close()
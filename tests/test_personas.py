@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from personas import BUILTIN_DIR, DEFAULT_PERSONA, PersonaLibrary, PersonaPack, compile_template
+
+def write_pack(directory, file_name, **data):
+    directory.mkdir(exist_ok=True)
+    (directory / file_name).write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+
+def test_compile_template_renders_fields():
+    render = compile_template("🎨 {reply} - {name} для {user} 🎭")
+    assert render({"reply": "Ответ", "name": "Бот", "user": "Игрок"}) == "🎨 Ответ - Бот для Игрок 🎭"
+    assert compile_template("без полей")({"reply": "", "name": "", "user": ""}) == "без полей"
+
+@pytest.mark.parametrize("template", ["{unknown}", "{reply!r}", "{reply:>10}", "{0}"])
+def test_compile_template_rejects_bad_fields(template):
+    with pytest.raises(ValueError):
+        compile_template(template)
+
+def test_pack_renders_each_style():
+    pack = PersonaPack("тест", ["Привет"], styles={
+        "разговорный": "{reply} (неформально)",
+        "формальный": "Уважаемый {user}, {reply}"
+    }, default_template="{name}: {reply}")
+    assert pack.styles == ["разговорный", "формальный"]
+    assert pack.render("разговорный", "ок", "Бот") == "ок (неформально)"
+    assert pack.render("формальный", "ок", "Бот", "Игрок") == "Уважаемый Игрок, ок"
+    # Стиль, которого нет в пакете, - шаблон по умолчанию
+    assert pack.render("креативный", "ок", "Бот") == "Бот: ок"
+
+def test_builtin_packs_render_all_their_styles():
+    library = PersonaLibrary([BUILTIN_DIR])
+    assert DEFAULT_PERSONA in library.names()
+    for name in library.names():
+        pack = library.pack(name)
+        for style in library.styles(name):
+            assert "ответ" in pack.render(style, "ответ", name, "Игрок")
+
+def test_broken_pack_fails_at_load(tmp_path):
+    write_pack(tmp_path, "bad.json", name="плохой", greetings=["Привет"], styles={"стиль": "{oops}"})
+    library = PersonaLibrary([str(tmp_path)])
+    with pytest.raises(ValueError):
+        library.pack("плохой")
+
+def test_user_pack_overrides_builtin(tmp_path):
+    write_pack(tmp_path / "user", "mine.json", name=DEFAULT_PERSONA, greetings=["Своё"])
+    library = PersonaLibrary([BUILTIN_DIR, str(tmp_path / "user")])
+    assert library.pack(DEFAULT_PERSONA).greetings == ["Своё"]
+    # Неизвестный характер отвечает характером по умолчанию
+    assert library.pack("удалённый") is library.pack(DEFAULT_PERSONA)
+
+@pytest.mark.parametrize("subdir", ["empty", "missing"])
+def test_library_without_packs_uses_builtin_default(tmp_path, subdir):
+    (tmp_path / "empty").mkdir()
+    library = PersonaLibrary([str(tmp_path / subdir)])
+    assert library.names() == []
+    assert library.resolve("любой") == DEFAULT_PERSONA
+    pack = library.pack("любой")
+    assert pack.greetings and pack.render("разговорный", "ок", "Бот") == "Бот: ок"
+    assert library.pack(DEFAULT_PERSONA) is pack
+    library.prefetch("любой")
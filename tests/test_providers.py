@@ -0,0 +1,30 @@
+import pytest
+
+from providers import ProviderClient, RequestCancelled, RequestHandle
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.requests = 0
+    
+    def request(self, *args, **kwargs):
+        self.requests += 1
+    
+    def close(self):
+        self.closed = True
+
+def test_cancelled_before_send_closes_the_connection(monkeypatch):
+    client = ProviderClient()
+    provider = client.provider("custom_api", {
+        "enabled": True, "endpoint": "http://127.0.0.1:9/v1/chat/completions", "api_key": ""
+    })
+    connection = FakeConnection()
+    monkeypatch.setattr(client.pool, "acquire", lambda scheme, netloc: (connection, True))
+    
+    handle = RequestHandle()
+    handle.cancel()
+    with pytest.raises(RequestCancelled):
+        provider.complete([{"role": "user", "content": "привет"}], handle)
+    assert connection.closed and connection.requests == 0
+    assert handle.connection is None
+    client.shutdown()
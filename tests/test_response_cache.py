@@ -0,0 +1,28 @@
+import pytest
+
+from context import ContextBuilder
+from response_cache import ResponseCache
+
+CHARACTER = {"name": "ИИ", "personality": "friendly", "style": "casual"}
+
+def test_key_depends_on_history():
+    cache = ResponseCache()
+    first = ContextBuilder()
+    second = ContextBuilder()
+    assert cache.make_key("почему?", CHARACTER, "openai", "gpt-4o", first.digest) == \
+        cache.make_key("почему?", CHARACTER, "openai", "gpt-4o", second.digest)
+    
+    first.add_turn("user", "небо голубое")
+    second.add_turn("user", "трава зелёная")
+    keys = {cache.make_key("почему?", CHARACTER, "openai", "gpt-4o", context.digest) for context in (first, second)}
+    assert len(keys) == 2
+    
+    before = first.digest
+    first.add_turn("assistant", "да")
+    assert first.digest != before
+
+@pytest.mark.parametrize("content", ['{"key": "value"}', '[["key", 1e18]]', '[1, 2]', '[["a", "soon", "text"]]'])
+def test_load_ignores_unexpected_format(workdir, content):
+    (workdir / "cache.json").write_text(content, encoding='utf-8')
+    cache = ResponseCache(cache_file="cache.json")
+    assert cache.stats()["entries"] == 0
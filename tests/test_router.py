@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+from providers import ProviderClient, ProviderError
+from router import ProviderRouter
+
+class FakeProvider:
+    # Отвечает через delay секунд; fail - вместо ответа ошибка. Отмену не слушает:
+    # обе попытки могут дойти до конца, и "один ответ" обеспечивает роутер
+    model = "fake"
+    
+    def __init__(self, name, delay=0.0, fail=False):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+    
+    def complete(self, messages, handle):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise ProviderError(f"{self.name}: ошибка")
+        return f"ответ {self.name}"
+
+@pytest.fixture
+def client():
+    client = ProviderClient(max_workers=8)
+    yield client
+    client.shutdown()
+
+def ask(router, providers, timeout=5):
+    results = []
+    errors = []
+    done = threading.Event()
+    
+    def on_result(text):
+        results.append(text)
+        done.set()
+    
+    def on_error(error):
+        errors.append(error)
+        done.set()
+    
+    router.submit(providers, lambda provider: [{"role": "user", "content": "привет"}], on_result, on_error)
+    assert done.wait(timeout)
+    # Запоздавшая вторая попытка не должна дать второй колбэк
+    time.sleep(0.3)
+    return results, errors
+
+def test_rank_prefers_fast_and_healthy(client):
+    router = ProviderRouter(client)
+    slow, fast, broken = FakeProvider("slow"), FakeProvider("fast"), FakeProvider("broken")
+    for _ in range(5):
+        router.provider_stats("slow").record_success(0.5)
+        router.provider_stats("fast").record_success(0.05)
+        router.provider_stats("broken").record_error(cooldown=30, max_consecutive=3)
+    assert [provider.name for provider in router.rank([broken, slow, fast])] == ["fast", "slow", "broken"]
+
+def test_hedge_fires_after_delay(client):
+    router = ProviderRouter(client, {"hedge_after_ms": 50})
+    primary, backup = FakeProvider("primary", delay=1.0), FakeProvider("backup")
+    router.provider_stats("primary").record_success(0.01)
+    started = time.perf_counter()
+    results, errors = ask(router, [primary, backup])
+    assert results == ["ответ backup"] and not errors
+    assert time.perf_counter() - started < 1.0
+    assert (router.hedges, router.hedge_wins) == (1, 1)
+
+def test_failover_when_primary_errors(client):
+    router = ProviderRouter(client, {"hedging": False})
+    primary, backup = FakeProvider("primary", fail=True), FakeProvider("backup")
+    router.provider_stats("primary").record_success(0.01)
+    results, errors = ask(router, [primary, backup])
+    assert results == ["ответ backup"] and not errors
+    assert router.failovers == 1
+    assert router.provider_stats("primary").errors == 1
+
+def test_all_providers_failing_reports_one_error(client):
+    router = ProviderRouter(client, {"hedging": False})
+    results, errors = ask(router, [FakeProvider("a", fail=True), FakeProvider("b", fail=True)])
+    assert not results and len(errors) == 1
+
+def test_single_result_when_both_legs_finish(client):
+    # Обе попытки заканчиваются почти одновременно - on_result ровно один раз
+    router = ProviderRouter(client, {"hedge_after_ms": 10})
+    for _ in range(20):
+        primary, backup = FakeProvider("primary", delay=0.05), FakeProvider("backup", delay=0.04)
+        results, errors = ask(router, [primary, backup])
+        assert len(results) == 1 and not errors
+        assert primary.calls == backup.calls == 1
@@ -0,0 +1,89 @@
+from scheduler import ReplyJob, ReplyScheduler
+
+class FakeHandle:
+    def __init__(self):
+        self.cancelled = False
+    
+    def cancel(self):
+        self.cancelled = True
+
+class Recorder:
+    # Запоминает запущенные и доставленные задачи вместо настоящих запросов
+    def __init__(self, max_in_flight=1):
+        self.started = []
+        self.delivered = []
+        self.depths = []
+        self.scheduler = ReplyScheduler(self.start, self.delivered.append, max_in_flight, self.depths.append)
+    
+    def start(self, job):
+        self.started.append(job)
+        return FakeHandle()
+    
+    def submit(self, prompt):
+        job = self.scheduler.merge(prompt)
+        if job is None:
+            job = ReplyJob(prompt)
+            self.scheduler.submit(job)
+        return job
+
+def test_replies_are_delivered_in_submission_order():
+    recorder = Recorder(max_in_flight=3)
+    first, second, third = (recorder.submit(prompt) for prompt in ("один", "два", "три"))
+    assert recorder.started == [first, second, third]
+    
+    # Ответы приходят в обратном порядке - выдача ждёт голову очереди
+    recorder.scheduler.complete(third, "3")
+    recorder.scheduler.complete(second, "2")
+    assert recorder.delivered == []
+    recorder.scheduler.fail(first, RuntimeError("ошибка"))
+    assert recorder.delivered == [first, second, third]
+    assert isinstance(first.error, RuntimeError) and third.result == "3"
+    assert recorder.scheduler.depth() == 0 and recorder.scheduler.in_flight == 0
+
+def test_limit_in_flight_and_start_next_on_finish():
+    recorder = Recorder(max_in_flight=1)
+    first = recorder.submit("один")
+    second = ReplyJob("два")
+    recorder.scheduler.submit(second)
+    assert recorder.started == [first]
+    
+    recorder.scheduler.complete(first, "1")
+    assert recorder.started == [first, second]
+    # Повторное завершение той же задачи ничего не меняет
+    recorder.scheduler.complete(first, "снова")
+    assert recorder.delivered == [first] and first.result == "1"
+    assert recorder.scheduler.in_flight == 1
+
+def test_queued_prompts_are_merged():
+    recorder = Recorder(max_in_flight=1)
+    first = recorder.submit("один")
+    # Первый запрос уже отправлен - второй встаёт отдельной задачей, третий и четвёртый склеиваются с ним
+    second = recorder.submit("два")
+    assert recorder.submit("три") is second
+    assert recorder.submit("четыре") is second
+    assert second.prompt == "два\nтри\nчетыре"
+    assert recorder.scheduler.merged == 2
+    assert recorder.scheduler.depth() == 2
+    
+    recorder.scheduler.complete(first, "1")
+    assert recorder.started == [first, second]
+    # Начатый запрос больше не пополняется
+    assert recorder.submit("пять") is not second
+
+def test_cancel_all_cancels_started_and_drops_queued():
+    recorder = Recorder(max_in_flight=1)
+    first = recorder.submit("один")
+    recorder.submit("два")
+    recorder.scheduler.cancel_all()
+    
+    assert first.handle.cancelled
+    assert recorder.scheduler.cancelled == 2
+    assert recorder.scheduler.depth() == 0 and recorder.scheduler.in_flight == 0
+    assert recorder.depths[-1] == 0
+    
+    # Запоздавший ответ отменённой задачи не доставляется
+    recorder.scheduler.complete(first, "1")
+    assert recorder.delivered == []
+    # Очередь снова принимает запросы
+    third = recorder.submit("три")
+    assert recorder.started[-1] is third
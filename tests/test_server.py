@@ -0,0 +1,82 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+from load_test import Client
+
+@pytest.fixture
+def server(workdir):
+    from core import AISystem, Config
+    from history import ChatHistory
+    from server import ChatServer
+    
+    ai_system = AISystem(Config.shared())
+    ai_system.local_provider.token_delay = 0
+    history = ChatHistory()
+    yield ChatServer(ai_system, history, port=0)
+    ai_system.shutdown()
+    history.close()
+
+def run(server, scenario):
+    async def main():
+        await server.start()
+        try:
+            return await scenario(server.port)
+        finally:
+            server.server.close()
+            await server.server.wait_closed()
+    return asyncio.run(main())
+
+async def raw_request(port, data):
+    # Ответ на произвольные байты: статус и тело JSON
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body)
+
+def test_health_sessions_and_stream(server):
+    async def scenario(port):
+        client = Client("127.0.0.1", port)
+        await client.connect()
+        try:
+            health = await client.request("GET", "/v1/health")
+            created = await client.request("POST", "/v1/sessions", {"title": "Тест"})
+            tokens = []
+            streamed = await client.request("POST", f"/v1/sessions/{created[1]['session']}/messages",
+                                            {"text": "привет", "stream": True}, tokens.append)
+            plain = await client.request("POST", f"/v1/sessions/{created[1]['session']}/messages", {"text": "как дела"})
+            page = await client.request("GET", f"/v1/sessions/{created[1]['session']}/messages")
+            completion = await client.request("POST", "/v1/chat/completions",
+                                              {"messages": [{"role": "user", "content": "привет"}]})
+            return health, created, tokens, streamed, plain, page, completion
+        finally:
+            client.close()
+    
+    health, created, tokens, streamed, plain, page, completion = run(server, scenario)
+    assert health == (200, {"status": "ok"})
+    assert created[0] == 201 and created[1]["title"] == "Тест"
+    assert streamed[0] == 200 and streamed[1]["event"] == "done"
+    assert "".join(token["token"] for token in tokens) == streamed[1]["text"]
+    assert plain[0] == 200 and plain[1]["profile"]["messages_sent"] == 2
+    assert [message["is_user"] for message in page[1]["messages"]] == [True, False, True, False]
+    assert completion[0] == 200 and completion[1]["choices"][0]["message"]["content"]
+
+def test_malformed_requests_get_an_answer(server):
+    async def scenario(port):
+        return [
+            await raw_request(port, b"GARBAGE\r\n\r\n"),
+            await raw_request(port, b"GET /v1/health HTTP/1.1\r\nX-Long: " + b"a" * 100000 + b"\r\n\r\n"),
+            await raw_request(port, b"GET /v1/health HTTP/1.1\r\n" + b"X-Header: 1\r\n" * 500 + b"\r\n"),
+            await raw_request(port, b"POST /v1/sessions HTTP/1.1\r\nContent-Length: 3\r\nConnection: close\r\n\r\n{x}"),
+            await raw_request(port, b"GET /v1/nowhere HTTP/1.1\r\nConnection: close\r\n\r\n")
+        ]
+    
+    statuses = [status for status, _ in run(server, scenario)]
+    assert statuses == [400, 431, 431, 400, 404]
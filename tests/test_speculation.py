@@ -0,0 +1,87 @@
+import speculation
+from speculation import Speculator
+
+class FakeHandle:
+    def __init__(self):
+        self.cancelled = False
+    
+    def cancel(self):
+        self.cancelled = True
+
+def make_speculator(**settings):
+    started = []
+    
+    def start(item):
+        started.append(item)
+        return FakeHandle()
+    
+    return Speculator(start, **settings), started
+
+def test_take_returns_the_speculation_when_text_matches():
+    speculator, started = make_speculator()
+    speculator.update("Как дела сегодня?", "чат 1")
+    # Тот же текст повторно не запрашивается
+    speculator.update("  Как дела сегодня?  ", "чат 1")
+    assert len(started) == 1
+    
+    taken = speculator.take("Как дела сегодня? ", "чат 1")
+    assert taken is started[0]
+    assert not taken.handle.cancelled
+    assert speculator.current is None
+    assert speculator.stats()["hits"] == 1 and speculator.stats()["hit_rate"] == 1.0
+
+def test_take_cancels_when_text_or_key_differs():
+    speculator, started = make_speculator()
+    speculator.update("Как дела сегодня?", "чат 1")
+    assert speculator.take("Как дела сегодня?", "чат 2") is None
+    assert started[0].handle.cancelled
+    
+    speculator.update("Как дела сегодня?", "чат 1")
+    assert speculator.take("Как дела вчера?", "чат 1") is None
+    stats = speculator.stats()
+    assert (stats["hits"], stats["misses"], stats["wasted"]) == (0, 2, 2)
+    # Без упреждения take ничего не считает
+    assert speculator.take("Как дела сегодня?", "чат 1") is None
+    assert speculator.stats()["misses"] == 2
+
+def test_changed_text_and_discard_count_as_waste():
+    speculator, started = make_speculator()
+    speculator.update("Первый вариант", "чат")
+    speculator.update("Второй вариант", "чат")
+    assert started[0].handle.cancelled and not started[1].handle.cancelled
+    # Короткий текст упреждение снимает, но новое не запускает
+    speculator.update("Эй", "чат")
+    assert started[1].handle.cancelled
+    assert len(started) == 2 and speculator.current is None
+    
+    speculator.update("Третий вариант", "чат")
+    speculator.discard()
+    speculator.discard()
+    assert speculator.stats()["wasted"] == 3
+
+def test_finished_speculation_is_not_cancelled():
+    speculator, started = make_speculator()
+    speculator.update("Готовый ответ", "чат")
+    started[0].on_token("Отв")
+    started[0].on_result("Ответ")
+    speculator.discard()
+    assert not started[0].handle.cancelled
+    
+    # Накопленные токены и итог отдаются тому, кто подхватил ответ
+    received = []
+    started[0].adopt(received.append, received.append, received.append)
+    assert received == ["Отв", "Ответ"]
+
+def test_rate_limit_per_minute(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(speculation.time, "monotonic", lambda: now[0])
+    speculator, started = make_speculator(max_per_minute=3)
+    for number in range(5):
+        speculator.update(f"Вариант номер {number}", "чат")
+    assert len(started) == 3
+    assert speculator.stats()["throttled"] == 2
+    
+    # Через минуту лимит снова свободен
+    now[0] += 61
+    speculator.update("Вариант после паузы", "чат")
+    assert len(started) == 4
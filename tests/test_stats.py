@@ -0,0 +1,98 @@
+import pytest
+
+import stats
+from backup import Exporter, Importer
+from history import ChatHistory
+from stats import UsageStats
+
+HOUR = 3600
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Часы статистики под контролем теста; старт - середина часа
+    now = [1_700_000_000 // HOUR * HOUR + 1800.0]
+    monkeypatch.setattr(stats.time, "time", lambda: now[0])
+    return now
+
+@pytest.fixture
+def history(workdir):
+    history = ChatHistory()
+    yield history
+    history.close()
+
+def rows(history):
+    return history.connection.execute(
+        "SELECT hour, persona, messages, replies, errors, chars_in, chars_out, latency_ms FROM stats_hourly "
+        "ORDER BY hour, persona"
+    ).fetchall()
+
+def test_events_roll_over_into_the_next_hour(history, clock):
+    usage = UsageStats(history)
+    hour = int(clock[0] // HOUR)
+    usage.record_message("friendly", "привет")
+    usage.record_reply("friendly", "здравствуй", 120.0)
+    usage.record_error("cheerful")
+    clock[0] += HOUR
+    usage.record_message("friendly", "снова")
+    usage.flush()
+    
+    assert rows(history) == [
+        (hour, "cheerful", 0, 0, 1, 0, 0, 0.0),
+        (hour, "friendly", 1, 1, 0, 6, 10, 120.0),
+        (hour + 1, "friendly", 1, 0, 0, 5, 0, 0.0)
+    ]
+    # Повторный сброс того же часа складывается с записанной строкой
+    usage.record_message("friendly", "ещё")
+    usage.flush()
+    assert rows(history)[-1][2] == 2
+
+def test_flush_every_writes_in_batches(history):
+    usage = UsageStats(history, flush_every=3)
+    usage.record_message("friendly", "а")
+    usage.record_message("friendly", "б")
+    assert rows(history) == []
+    usage.record_message("friendly", "в")
+    assert rows(history)[0][2] == 3
+    assert usage.pending_events == 0
+
+def test_latency_aggregation(history):
+    usage = UsageStats(history)
+    for latency_ms in [15.0] * 18 + [400.0, 3000.0]:
+        usage.record_reply("friendly", "ответ", latency_ms)
+    summary = usage.summary()
+    
+    assert summary["replies"] == 20
+    assert summary["avg_latency_ms"] == pytest.approx((15 * 18 + 400 + 3000) / 20)
+    # Процентили - верхние границы корзин DEFAULT_BUCKETS
+    assert summary["latency_p50_ms"] == 20
+    assert summary["latency_p95_ms"] == 500
+    assert summary["personas"] == [{"persona": "friendly", "messages": 0, "replies": 20, "errors": 0}]
+
+def test_empty_summary(history):
+    summary = UsageStats(history).summary()
+    assert (summary["messages"], summary["replies"]) == (0, 0)
+    assert summary["avg_latency_ms"] is None and summary["latency_p95_ms"] is None
+    assert summary["busiest_hour"] is None
+
+def test_import_merges_stats_into_existing(history, clock):
+    source = ChatHistory("source.db")
+    source_stats = UsageStats(source)
+    source.append("вопрос", True, 1)
+    source_stats.record_message("friendly", "вопрос")
+    source_stats.record_reply("friendly", "ответ", 40.0)
+    source_stats.flush()
+    Exporter(source, {}, "backup.jsonl").run(lambda done, total: None)
+    source.close()
+    
+    usage = UsageStats(history)
+    usage.record_message("friendly", "своё")
+    usage.record_reply("friendly", "своё", 40.0)
+    usage.flush()
+    
+    summary = Importer(history, "backup.jsonl").run(lambda done, total: None)
+    assert summary["stats"]
+    # Сводки копии складываются с уже записанными, в том числе корзины задержек
+    totals = usage.summary()
+    assert (totals["messages"], totals["replies"]) == (2, 2)
+    assert totals["avg_latency_ms"] == pytest.approx(40.0)
+    assert history.connection.execute("SELECT bucket, count FROM stats_latency").fetchall() == [(5, 2)]
@@ -0,0 +1,404 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# 📏 БЕНЧМАРКИ
+# Прогоняет сценарии чата без участия пользователя и печатает результаты в JSON,
+# чтобы их можно было сравнивать между коммитами:
+#   python tools/bench.py --sizes 100,1000,10000 --output bench.json
+# Окно Kivy скрыто; на сервере без дисплея запускать через xvfb-run
+# или с --offscreen (SDL offscreen-драйвер).
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарки Chai Clone")
+    parser.add_argument("--sizes", default="100,1000,10000",
+                        help="размеры сессий чата через запятую (до 100000)")
+    parser.add_argument("--micro", type=int, default=10000,
+                        help="число вызовов в микробенчмарках generate_response/save_config")
+    parser.add_argument("--resize", type=int, default=200,
+                        help="число сообщений в сценарии поворота экрана (0 - пропустить)")
+    parser.add_argument("--switch", type=int, default=5000,
+                        help="число сообщений в каждом из двух чатов в сценарии переключения (0 - пропустить)")
+    parser.add_argument("--token-delay", type=float, default=0.0,
+                        help="пауза между токенами локального генератора, сек")
+    parser.add_argument("--offscreen", action="store_true", help="SDL_VIDEODRIVER=offscreen")
+    parser.add_argument("--output", help="файл для JSON (по умолчанию stdout)")
+    return parser.parse_args()
+
+def setup_kivy(args):
+    # Настройки Kivy нужно задать до импорта окна
+    os.environ.setdefault("KIVY_NO_ARGS", "1")
+    os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+    os.environ.setdefault("KIVY_NO_FILELOG", "1")
+    if args.offscreen:
+        os.environ["SDL_VIDEODRIVER"] = "offscreen"
+    
+    from kivy.config import Config as KivyConfig
+    KivyConfig.set('graphics', 'window_state', 'hidden')
+    KivyConfig.set('graphics', 'maxfps', '0')
+    KivyConfig.set('graphics', 'width', '480')
+    KivyConfig.set('graphics', 'height', '800')
+
+# 📊 ИЗМЕРЕНИЯ
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+    
+    return {
+        "count": len(ordered),
+        "mean": round(statistics.fmean(ordered), 3),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": round(ordered[-1], 3)
+    }
+
+def disk_bytes_written():
+    # Фактически записанные процессом байты (только Linux)
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def files_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+def count_widgets(widget):
+    return 1 + sum(count_widgets(child) for child in widget.children)
+
+def fresh_workdir(main):
+    # Каждый прогон - в пустом каталоге: свой конфиг, история и кэши
+    workdir = tempfile.mkdtemp(prefix="chaiclone-bench-")
+    os.chdir(workdir)
+    main.Config._shared = None
+    return workdir
+
+def close_screen(screen, manager):
+    # Как ChaiCloneApp.on_stop: фоновые потоки экрана не должны пережить сценарий
+    from kivy.core.window import Window
+    Window.remove_widget(manager)
+    screen.outbox.stop()
+    screen.ai_system.shutdown()
+    screen.history.close()
+
+def require_bubbles(screen):
+    # Без пузырей на экране замеры виджетов и кадров ничего не значат
+    if not screen.message_layout.children:
+        raise RuntimeError("Список сообщений пуст: пузыри не созданы")
+    return list(screen.message_layout.children)
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# 💬 СЦЕНАРИЙ ЧАТА
+def run_chat_session(main, size, token_delay):
+    from kivy.base import EventLoop
+    from kivy.core.window import Window
+    from kivy.uix.screenmanager import ScreenManager
+    # ROOT попадает в sys.path только в main_entry, поэтому импорт здесь
+    from metrics import rss_bytes
+    
+    workdir = fresh_workdir(main)
+    screen = main.ChatScreen(name='chat')
+    screen.ai_system.local_provider.token_delay = token_delay
+    # Всплывающие окна о новом уровне копились бы в окне и искажали число виджетов
+    screen.show_popup = lambda title, message: None
+    
+    manager = ScreenManager()
+    manager.add_widget(screen)
+    Window.add_widget(manager)
+    
+    sent_at = {}
+    first_token_at = {}
+    latencies = []
+    first_token_latencies = []
+    original_append = screen.append_reply_text
+    original_response = screen.ai_response
+    
+    def traced_append(reply_msg, text, *args):
+        key = id(reply_msg)
+        if key in sent_at and key not in first_token_at:
+            first_token_at[key] = time.perf_counter()
+            first_token_latencies.append((first_token_at[key] - sent_at[key]) * 1000)
+        original_append(reply_msg, text, *args)
+    
+    def traced_response(user_message, reply_msg, stream, response, *args):
+        original_response(user_message, reply_msg, stream, response, *args)
+        latencies.append((time.perf_counter() - sent_at.pop(id(reply_msg))) * 1000)
+        first_token_at.pop(id(reply_msg), None)
+    
+    screen.append_reply_text = traced_append
+    screen.ai_response = traced_response
+    
+    frame_times = []
+    
+    def frame():
+        started = time.perf_counter()
+        EventLoop.idle()
+        frame_times.append((time.perf_counter() - started) * 1000)
+    
+    for _ in range(5):
+        frame()
+    
+    rss_before = rss_bytes()
+    io_before = disk_bytes_written()
+    widgets_samples = []
+    started = time.perf_counter()
+    
+    for number in range(size):
+        screen.message_input.text = f"Сообщение номер {number}: как дела?"
+        before = len(screen.chat_history.data)
+        sent = time.perf_counter()
+        screen.send_message(None)
+        reply_msg = screen.chat_history.data[before + 1]
+        sent_at[id(reply_msg)] = sent
+        
+        deadline = time.perf_counter() + 10
+        while id(reply_msg) in sent_at:
+            frame()
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"Нет ответа на сообщение {number}")
+        
+        if number % max(1, size // 20) == 0:
+            require_bubbles(screen)
+            widgets_samples.append(count_widgets(Window))
+    
+    elapsed = time.perf_counter() - started
+    screen.config.flush()
+    io_after = disk_bytes_written()
+    
+    result = {
+        "messages": size,
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_s": round(size / elapsed, 1),
+        "reply_latency_ms": percentiles(latencies),
+        "first_token_ms": percentiles(first_token_latencies),
+        "frame_time_ms": percentiles(frame_times),
+        "widgets": {"min": min(widgets_samples), "max": max(widgets_samples), "end": count_widgets(Window)},
+        "rss_growth_bytes": None if rss_before is None else rss_bytes() - rss_before,
+        "config_saves": screen.config.save_stats,
+        "files_bytes": files_size(workdir),
+        "disk_bytes_written": None if io_before is None else io_after - io_before
+    }
+    
+    close_screen(screen, manager)
+    return result
+
+# 🔄 ПОВОРОТ ЭКРАНА
+def run_resize(main, size, rounds=20):
+    from kivy.base import EventLoop
+    from kivy.core.window import Window
+    from kivy.uix.screenmanager import ScreenManager
+    
+    fresh_workdir(main)
+    screen = main.ChatScreen(name='chat')
+    manager = ScreenManager()
+    manager.add_widget(screen)
+    Window.add_widget(manager)
+    
+    screen.chat_history.data = [
+        screen.make_message(f"Сообщение {number}: " + "текст пузыря " * (number % 7 + 1), number % 2 == 0)
+        for number in range(size)
+    ]
+    for _ in range(5):
+        EventLoop.idle()
+    bubbles = require_bubbles(screen)
+    
+    # На каждый поворот: первый кадр - разметка под новый размер окна; затем
+    # пересчёт высот пузырей (его обычно запускает триггер, здесь - напрямую,
+    # чтобы в замер не попала отрисовка) и кадр, в котором обновляются видимые
+    # пузыри. Первое появление ширины считает разметку всех сообщений, повторы
+    # берут высоты из кэша - их замеры раздельно. Самый долгий кадр за поворот
+    # включает и перерисовку окна драйвером.
+    layout_ms = []
+    cold_ms = []
+    warm_ms = []
+    refresh_ms = []
+    slowest_ms = []
+    seen_widths = {main.message_text_width()}
+    for number in range(rounds):
+        Window.size = (800, 480) if number % 2 == 0 else (480, 800)
+        screen._remeasure_messages.cancel()
+        started = time.perf_counter()
+        EventLoop.idle()
+        layout_ms.append((time.perf_counter() - started) * 1000)
+        
+        width = main.message_text_width()
+        started = time.perf_counter()
+        screen.remeasure_messages()
+        (warm_ms if width in seen_widths else cold_ms).append((time.perf_counter() - started) * 1000)
+        seen_widths.add(width)
+        
+        started = time.perf_counter()
+        EventLoop.idle()
+        refresh_ms.append((time.perf_counter() - started) * 1000)
+        
+        deadline = time.perf_counter() + 0.4
+        slowest = max(layout_ms[-1], refresh_ms[-1])
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            EventLoop.idle()
+            slowest = max(slowest, (time.perf_counter() - started) * 1000)
+        slowest_ms.append(slowest)
+    
+    bubbles = require_bubbles(screen)
+    result = {
+        "messages": size,
+        "rounds": rounds,
+        "layout_ms": percentiles(layout_ms),
+        "remeasure_cold_ms": [round(value, 3) for value in cold_ms],
+        "remeasure_warm_ms": percentiles(warm_ms),
+        "refresh_frame_ms": percentiles(refresh_ms),
+        "slowest_frame_ms": percentiles(slowest_ms),
+        "visible_bubbles": len(bubbles),
+        "widgets_per_bubble": count_widgets(bubbles[0]),
+        "instructions_per_bubble": len(bubbles[0].canvas.before.children) + len(bubbles[0].canvas.children)
+    }
+    
+    close_screen(screen, manager)
+    Window.size = (480, 800)
+    return result
+
+# 💬 ПЕРЕКЛЮЧЕНИЕ ЧАТОВ
+def run_session_switch(main, size, rounds=50):
+    from kivy.base import EventLoop
+    from kivy.core.window import Window
+    from kivy.uix.screenmanager import ScreenManager
+    
+    fresh_workdir(main)
+    screen = main.ChatScreen(name='chat')
+    manager = ScreenManager()
+    manager.add_widget(screen)
+    Window.add_widget(manager)
+    
+    # Два больших чата; в памяти они оба, как два недавно открытых
+    first = screen.session.id
+    second = screen.history.create_session("Второй")
+    for session_id in (first, second):
+        for number in range(size):
+            screen.history.append(f"Сообщение {number}: " + "текст пузыря " * (number % 7 + 1),
+                                  number % 2 == 0, session_id)
+    # Первый чат открыт ещё пустым - выгружаем, чтобы замерить открытие с диска
+    screen.on_session_evicted(screen.sessions.discard(first))
+    screen.session = None
+    started = time.perf_counter()
+    screen.switch_session(first)
+    EventLoop.idle()
+    open_ms = (time.perf_counter() - started) * 1000
+    screen.switch_session(second)
+    for _ in range(5):
+        EventLoop.idle()
+    require_bubbles(screen)
+    
+    # Переключение плюс следующий кадр: разметка и отрисовка нового списка
+    switch_ms = []
+    frame_ms = []
+    for number in range(rounds):
+        started = time.perf_counter()
+        screen.switch_session(first if number % 2 == 0 else second)
+        switched = time.perf_counter()
+        EventLoop.idle()
+        switch_ms.append((switched - started) * 1000)
+        frame_ms.append((time.perf_counter() - switched) * 1000)
+    
+    result = {
+        "messages_per_chat": size,
+        "rounds": rounds,
+        "open_ms": round(open_ms, 3),
+        "switch_ms": percentiles(switch_ms),
+        "next_frame_ms": percentiles(frame_ms),
+        "sessions": screen.sessions.stats()
+    }
+    
+    close_screen(screen, manager)
+    return result
+
+# 🔬 МИКРОБЕНЧМАРКИ
+def run_generate_response(main, calls):
+    fresh_workdir(main)
+    config = main.Config.shared()
+    ai_system = main.AISystem(config)
+    timings = []
+    for number in range(calls):
+        started = time.perf_counter()
+        ai_system.generate_response(f"вопрос {number}")
+        timings.append((time.perf_counter() - started) * 1000)
+    ai_system.shutdown()
+    return {"calls": calls, "latency_ms": percentiles(timings)}
+
+def run_save_config(main, calls):
+    fresh_workdir(main)
+    config = main.Config.shared()
+    config.flush()
+    
+    timings = []
+    for number in range(calls):
+        started = time.perf_counter()
+        config.set("user_profile.xp", number % 100)
+        timings.append((time.perf_counter() - started) * 1000)
+    
+    started = time.perf_counter()
+    config.flush()
+    flush_ms = (time.perf_counter() - started) * 1000
+    return {
+        "calls": calls,
+        "call_latency_ms": percentiles(timings),
+        "final_flush_ms": round(flush_ms, 3),
+        "saves": config.save_stats,
+        "saves_avoided": config.saves_avoided()
+    }
+
+def main_entry():
+    args = parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    setup_kivy(args)
+    sys.path.insert(0, ROOT)
+    import main
+    
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "version": main.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
+        },
+        "micro": {
+            "generate_response": run_generate_response(main, args.micro),
+            "save_config": run_save_config(main, args.micro)
+        },
+        "chat": [run_chat_session(main, int(size), args.token_delay) for size in args.sizes.split(",")]
+    }
+    if args.resize:
+        report["resize"] = run_resize(main, args.resize)
+    if args.switch:
+        report["switch"] = run_session_switch(main, args.switch)
+    
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main_entry()
@@ -0,0 +1,60 @@
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+import time
+
+# 🖼 СБОРКА АТЛАСА АВАТАРОВ
+# Склеивает встроенные аватары data/avatars/src/*.png в одну текстуру с
+# файлом .atlas в формате Kivy: в приложении все они - одно декодирование
+# и одна загрузка в видеопамять. Нужен Pillow (pip install pillow):
+#   python tools/build_atlas.py
+#   python tools/build_atlas.py --size 128
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import avatars
+
+# Зазор между картинками, чтобы при масштабировании не подмешивались соседние
+PADDING = 2
+
+def build_atlas(source_dir, atlas_dir, size):
+    from PIL import Image
+    
+    started = time.perf_counter()
+    sources = sorted(glob.glob(os.path.join(source_dir, "*.png")))
+    if not sources:
+        raise SystemExit(f"{source_dir}: нет картинок")
+    columns = math.ceil(math.sqrt(len(sources)))
+    rows = math.ceil(len(sources) / columns)
+    cell = size + PADDING * 2
+    page = Image.new("RGBA", (columns * cell, rows * cell), (0, 0, 0, 0))
+    page_name = f"{avatars.ATLAS_NAME}-0.png"
+    
+    regions = {}
+    for number, path in enumerate(sources):
+        image = Image.open(path).convert("RGBA")
+        image.thumbnail((size, size), Image.LANCZOS)
+        x = number % columns * cell + PADDING + (size - image.width) // 2
+        y = number // columns * cell + PADDING + (size - image.height) // 2
+        page.paste(image, (x, y))
+        # В атласе Kivy начало координат - левый нижний угол
+        name = os.path.splitext(os.path.basename(path))[0]
+        regions[name] = [x, page.height - y - image.height, image.width, image.height]
+    
+    page.save(os.path.join(atlas_dir, page_name), optimize=True)
+    with open(os.path.join(atlas_dir, f"{avatars.ATLAS_NAME}.atlas"), 'w', encoding='utf-8') as f:
+        json.dump({page_name: regions}, f, ensure_ascii=False, sort_keys=True)
+    print(f"{avatars.ATLAS_NAME}.atlas: {len(regions)} аватаров, {page.width}x{page.height}, "
+          f"{time.perf_counter() - started:.2f} с")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Сборка атласа встроенных аватаров Chai Clone")
+    parser.add_argument("--source-dir", default=avatars.SOURCE_DIR)
+    parser.add_argument("--atlas-dir", default=avatars.ASSET_DIR)
+    parser.add_argument("--size", type=int, default=avatars.THUMB_SIZE, help="сторона аватара в атласе, пикселей")
+    args = parser.parse_args()
+    build_atlas(args.source_dir, args.atlas_dir, args.size)
@@ -0,0 +1,63 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+# 🗂 СБОРКА ИНДЕКСОВ ОТВЕТОВ
+# Строит .idx рядом с каждым корпусом data/corpus/*.tsv, чтобы приложение
+# не тратило время на индексацию при первом ответе, и index.json пакетов
+# персонажей в data/personas (см. personas.py):
+#   python tools/build_index.py
+#   python tools/build_index.py --query "как дела" --personality friendly
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import personas
+from retrieval import ResponseEngine, RetrievalIndex, corpus_digest, read_corpus
+
+def build_all(corpus_dir):
+    for corpus_path in sorted(glob.glob(os.path.join(corpus_dir, "*.tsv"))):
+        started = time.perf_counter()
+        pairs = read_corpus(corpus_path)
+        index = RetrievalIndex.build(pairs, corpus_digest(corpus_path))
+        index_path = corpus_path[:-4] + ".idx"
+        index.save(index_path)
+        print(f"{os.path.basename(index_path)}: {len(pairs)} строк, "
+              f"{os.path.getsize(index_path)} байт, {time.perf_counter() - started:.2f} с")
+
+def build_personas(persona_dir):
+    # Заодно проверяем шаблоны каждого пакета: ошибка всплывёт в сборке, а не на телефоне
+    index = personas.build_index(persona_dir)
+    for name, entry in sorted(index["personas"].items()):
+        personas.PersonaPack.load(os.path.join(persona_dir, entry["file"]))
+    skipped = len(index["files"]) - len(index["personas"])
+    if skipped:
+        raise SystemExit(f"{persona_dir}: не прочитано пакетов: {skipped}")
+    print(f"{personas.INDEX_FILE}: {len(index['personas'])} персонажей")
+
+def query(corpus_dir, personality, text, repeat=1000):
+    engine = ResponseEngine(corpus_dir, corpus_dir)
+    index = engine.index(personality)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        results = index.search(text)
+    elapsed_ms = (time.perf_counter() - started) * 1000 / repeat
+    for doc, score in results:
+        print(f"{score:.3f}  {index.replies[doc]}")
+    print(f"поиск: {elapsed_ms:.3f} мс")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Сборка индексов локальных ответов Chai Clone")
+    parser.add_argument("--corpus-dir", default=os.path.join(ROOT, "data", "corpus"))
+    parser.add_argument("--persona-dir", default=personas.BUILTIN_DIR)
+    parser.add_argument("--query", help="проверить поиск по готовому индексу")
+    parser.add_argument("--personality", default="friendly", help="имя корпуса для --query")
+    args = parser.parse_args()
+    
+    if args.query:
+        query(args.corpus_dir, args.personality, args.query)
+    else:
+        build_all(args.corpus_dir)
+        build_personas(args.persona_dir)
@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+# 🏋️ НАГРУЗОЧНЫЙ ТЕСТ СЕРВЕРА
+# Виртуальные пользователи: каждый создаёт свой чат и по очереди отправляет
+# сообщения с ответом потоком, как приложение. Без --url сервер запускается
+# тут же во временном каталоге:
+#   python tools/load_test.py --users 100 --messages 10 --token-delay 0.01
+#   python tools/load_test.py --url http://127.0.0.1:8800 --users 50
+# Печатает JSON: пропускная способность, p50/p95/p99 полного ответа и первого токена.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест сервера чата Chai Clone")
+    parser.add_argument("--url", help="адрес запущенного сервера; без него - свой во временном каталоге")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=10, help="сообщений на пользователя")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="для своего сервера")
+    parser.add_argument("--max-connections", type=int, default=200, help="для своего сервера")
+    parser.add_argument("--workers", type=int, default=64, help="для своего сервера")
+    return parser.parse_args()
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+def start_local_server(args):
+    # Свой сервер в отдельном потоке со своим циклом событий
+    from core import AISystem, Config
+    from history import ChatHistory
+    from server import ChatServer
+    
+    os.chdir(tempfile.mkdtemp(prefix="chaiclone-load-"))
+    ai_system = AISystem(Config.shared(), max_workers=args.workers)
+    ai_system.local_provider.token_delay = args.token_delay
+    server = ChatServer(ai_system, ChatHistory(), port=0, max_connections=args.max_connections)
+    ready = threading.Event()
+    
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        ready.set()
+        loop.run_forever()
+    
+    threading.Thread(target=run, name="server", daemon=True).start()
+    ready.wait()
+    return server, f"http://127.0.0.1:{server.port}"
+
+class Client:
+    # Одно keep-alive соединение на пользователя
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+    
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+    
+    async def request(self, method, path, payload=None, on_event=None):
+        body = json.dumps(payload or {}, ensure_ascii=False).encode('utf-8')
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+                          f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+        await self.writer.drain()
+        
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding") != "chunked":
+            data = await self.reader.readexactly(int(headers.get("content-length", 0)))
+            return status, json.loads(data or b"{}")
+        
+        # Поток SSE: события приходят кусками chunked
+        result = None
+        event = None
+        while True:
+            size = int((await self.reader.readline()).strip(), 16)
+            if size == 0:
+                await self.reader.readline()
+                return status, result
+            chunk = (await self.reader.readexactly(size + 2))[:-2].decode('utf-8')
+            for line in chunk.splitlines():
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[5:].strip())
+                    if event in ("done", "error"):
+                        result = dict(data, event=event)
+                    elif on_event is not None:
+                        on_event(data)
+                    event = None
+    
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+async def run_user(number, host, port, messages, report):
+    client = Client(host, port)
+    try:
+        await client.connect()
+        status, created = await client.request("POST", "/v1/sessions", {"title": f"Нагрузка {number}"})
+        if status != 201:
+            report["rejected"] += 1
+            return
+        for index in range(messages):
+            started = time.perf_counter()
+            first = []
+            
+            def on_event(data):
+                if not first:
+                    first.append(time.perf_counter())
+            
+            status, result = await client.request(
+                "POST", f"/v1/sessions/{created['session']}/messages",
+                {"text": f"привет, как дела? {index}", "stream": True}, on_event
+            )
+            finished = time.perf_counter()
+            if status != 200 or result is None or result["event"] != "done":
+                report["errors"] += 1
+                continue
+            report["latency_ms"].append((finished - started) * 1000)
+            if first:
+                report["first_token_ms"].append((first[0] - started) * 1000)
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+        report["errors"] += 1
+    finally:
+        client.close()
+
+async def run_load(url, users, messages):
+    parts = urlsplit(url)
+    report = {"latency_ms": [], "first_token_ms": [], "errors": 0, "rejected": 0}
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(number, parts.hostname, parts.port, messages, report) for number in range(users)))
+    report["elapsed_s"] = time.perf_counter() - started
+    return report
+
+def main_entry():
+    args = parse_args()
+    server = None
+    url = args.url
+    if url is None:
+        server, url = start_local_server(args)
+    
+    report = asyncio.run(run_load(url, args.users, args.messages))
+    replies = len(report["latency_ms"])
+    result = {
+        "users": args.users,
+        "messages_per_user": args.messages,
+        "replies": replies,
+        "errors": report["errors"],
+        "rejected": report["rejected"],
+        "elapsed_s": round(report["elapsed_s"], 2),
+        "throughput_rps": round(replies / report["elapsed_s"], 1) if report["elapsed_s"] else 0.0,
+        "latency_ms": {name: percentile(report["latency_ms"], q) for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "first_token_ms": {name: percentile(report["first_token_ms"], q) for name, q in (("p50", 0.5), ("p99", 0.99))}
+    }
+    if server is not None:
+        result["server"] = {key: value for key, value in server.stats().items() if key in ("rejected", "requests", "sessions")}
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main_entry()
@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# 📮 ПРОВЕРКА ОЧЕРЕДИ НЕОТПРАВЛЕННЫХ ЗАПРОСОВ
+# Заглушка LLM сначала рвёт все соединения ("нет сети"), затем чинится;
+# очередь должна доставить каждый запрос ровно один раз и в свой чат:
+#   python tools/outbox_check.py --requests 50 --offline 3
+# Печатает JSON: сколько доставлено, сколько было повторов, дубли и потери.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from history import ChatHistory
+from outbox import Outbox
+from providers import ProviderClient
+from stub_server import make_server
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Проверка очереди неотправленных запросов на заглушке")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8780)
+    parser.add_argument("--offline", type=float, default=3.0, help="сколько секунд заглушка рвёт соединения")
+    parser.add_argument("--drop-rate", type=float, default=0.2, help="доля обрывов после возврата сети")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    return parser.parse_args()
+
+def main_entry():
+    args = parse_args()
+    server = make_server(args.port, token_delay=0.0, drop_rate=1.0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    os.chdir(tempfile.mkdtemp(prefix="chaiclone-outbox-"))
+    history = ChatHistory()
+    sessions = [history.create_session(f"Чат {number}") for number in range(3)]
+    client = ProviderClient()
+    provider = client.provider("custom_api", {
+        "enabled": True, "endpoint": f"http://127.0.0.1:{args.port}/v1/chat/completions", "api_key": ""
+    })
+    
+    delivered = []
+    failed = []
+    
+    def send(entry, on_result, on_error):
+        return client.submit(provider, [{"role": "user", "content": entry["prompt"]}], on_result, on_error)
+    
+    outbox = Outbox(
+        history, send,
+        on_delivered=lambda entry, message_id, text: delivered.append((entry, text)),
+        on_failed=lambda entry, error: failed.append((entry, str(error))),
+        base_delay=0.2, max_delay=2.0
+    )
+    outbox.start()
+    
+    started = time.perf_counter()
+    for number in range(args.requests):
+        outbox.add(sessions[number % len(sessions)], f"вопрос {number}", {"name": "Ассистент"})
+    
+    time.sleep(args.offline)
+    server.RequestHandlerClass.drop_rate = args.drop_rate
+    deadline = time.perf_counter() + args.timeout
+    while len(delivered) + len(failed) < args.requests and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    outbox.stop()
+    
+    # Каждый ответ - в чате своего запроса, без дублей
+    prompts = [entry["prompt"] for entry, _ in delivered]
+    misplaced = sum(1 for entry, text in delivered if text != f"Эхо: {entry['prompt']}")
+    stored = {
+        session_id: [row["text"] for row in history.load_page_before(None, args.requests, session_id)]
+        for session_id in sessions
+    }
+    wrong_chat = sum(
+        1 for number in range(args.requests)
+        if stored[sessions[number % len(sessions)]].count(f"Эхо: вопрос {number}") != 1
+    )
+    report = dict(outbox.stats(), **{
+        "requests": args.requests,
+        "delivered_callbacks": len(delivered),
+        "failed": failed,
+        "duplicates": len(prompts) - len(set(prompts)),
+        "lost": args.requests - len(set(prompts)) - len(failed),
+        "misplaced": misplaced + wrong_chat,
+        "elapsed_s": round(elapsed, 2)
+    })
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    
+    client.shutdown()
+    server.shutdown()
+    history.close()
+
+if __name__ == '__main__':
+    main_entry()
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+# 🧭 ПРОВЕРКА МАРШРУТИЗАТОРА
+# Поднимает три заглушки LLM с разными задержками и долей ошибок и прогоняет
+# через маршрутизатор серию запросов - без Kivy и без сети:
+#   python tools/router_check.py --requests 200
+#   python tools/router_check.py --fast-error-rate 0.5 --no-hedging
+# Печатает JSON: кто отвечал, задержки до первого токена, число дублей и переключений.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench import percentiles
+from providers import ProviderClient
+from router import ProviderRouter
+from stub_server import make_server
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Проверка маршрутизатора провайдеров на заглушках")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8770, help="первый порт; заглушки занимают три подряд")
+    parser.add_argument("--fast-delay", type=float, default=0.05)
+    parser.add_argument("--fast-error-rate", type=float, default=0.05)
+    parser.add_argument("--fast-slow-rate", type=float, default=0.1, help="доля долгих ответов быстрого провайдера")
+    parser.add_argument("--slow-delay", type=float, default=0.4)
+    parser.add_argument("--broken-error-rate", type=float, default=1.0)
+    parser.add_argument("--no-hedging", action="store_true")
+    return parser.parse_args()
+
+def start_stub(port, **options):
+    server = make_server(port, token_delay=0.0, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main_entry():
+    args = parse_args()
+    base = f"http://127.0.0.1:{args.port}"
+    servers = [
+        # openai: обычно быстрый, но с хвостом долгих ответов
+        start_stub(args.port, delay=args.fast_delay, error_rate=args.fast_error_rate,
+                   slow_rate=args.fast_slow_rate, slow_delay=1.5),
+        # google_ai: стабильный, но медленный
+        start_stub(args.port + 1, delay=args.slow_delay),
+        # custom_api: почти всегда падает
+        start_stub(args.port + 2, delay=0.0, error_rate=args.broken_error_rate)
+    ]
+    cloud_services = {
+        "openai": {"enabled": True, "api_key": "stub", "model": "gpt-3.5-turbo", "base_url": f"{base}/v1"},
+        "google_ai": {"enabled": True, "api_key": "stub", "model": "gemini-pro",
+                      "base_url": f"http://127.0.0.1:{args.port + 1}/v1beta"},
+        "custom_api": {"enabled": True, "endpoint": f"http://127.0.0.1:{args.port + 2}/v1/chat/completions", "api_key": ""}
+    }
+    
+    client = ProviderClient(max_workers=8)
+    router = ProviderRouter(client, {"hedging": not args.no_hedging})
+    providers = client.configured_providers(cloud_services)
+    
+    first_token_ms = []
+    total_ms = []
+    errors = 0
+    for number in range(args.requests):
+        done = threading.Event()
+        started = time.perf_counter()
+        first = []
+        
+        def on_token(token):
+            if not first:
+                first.append(time.perf_counter())
+        
+        def on_result(text):
+            total_ms.append((time.perf_counter() - started) * 1000)
+            done.set()
+        
+        def on_error(error):
+            nonlocal errors
+            errors += 1
+            done.set()
+        
+        router.submit(providers, lambda provider: [{"role": "user", "content": f"вопрос {number}"}],
+                      on_result, on_error, on_token)
+        done.wait(30)
+        if first:
+            first_token_ms.append((first[0] - started) * 1000)
+    
+    report = dict(router.snapshot(), **{
+        "requests": args.requests,
+        "errors_surfaced": errors,
+        "first_token_ms": percentiles(first_token_ms),
+        "total_ms": percentiles(total_ms)
+    })
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    
+    client.shutdown()
+    for server in servers:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main_entry()
@@ -0,0 +1,115 @@
+import argparse
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 🧪 ЗАГЛУШКА ОБЛАЧНОГО LLM
+# Локальный сервер, отвечающий в форматах OpenAI (chat/completions) и Gemini
+# (generateContent). Нужен для ручной проверки провайдеров и бенчмарков без сети:
+#   python tools/stub_server.py --port 8765 --delay 0.3 --error-rate 0.1 --token-delay 0.05
+# --slow-rate/--slow-delay добавляют редкие долгие ответы (хвост задержек для hedging).
+# --drop-rate - доля запросов, на которые сервер молча закрывает соединение (обрыв сети).
+# Запросы со "stream": true (и streamGenerateContent) получают ответ потоком SSE.
+# и в настройках: custom_api.endpoint = http://127.0.0.1:8765/v1/chat/completions
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+    error_rate = 0.0
+    token_delay = 0.02
+    slow_rate = 0.0
+    slow_delay = 0.0
+    drop_rate = 0.0
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        
+        if random.random() < self.drop_rate:
+            # Соединение рвётся без ответа - клиент видит RemoteDisconnected
+            self.close_connection = True
+            return
+        time.sleep(self.delay + (self.slow_delay if random.random() < self.slow_rate else 0.0))
+        if random.random() < self.error_rate:
+            self.send_json(503, {"error": {"message": "stub: искусственная ошибка"}})
+            return
+        
+        if self.path.startswith("/v1/chat/completions"):
+            prompt = request["messages"][-1]["content"]
+            if request.get("stream"):
+                self.send_stream(reply_for(prompt), lambda token: {"choices": [{"delta": {"content": token}}]}, done=True)
+            else:
+                self.send_json(200, {"choices": [{"message": {"role": "assistant", "content": reply_for(prompt)}}]})
+        elif ":generateContent" in self.path or ":streamGenerateContent" in self.path:
+            prompt = request["contents"][-1]["parts"][0]["text"]
+            if ":streamGenerateContent" in self.path:
+                self.send_stream(reply_for(prompt), lambda token: {"candidates": [{"content": {"parts": [{"text": token}]}}]})
+            else:
+                self.send_json(200, {"candidates": [{"content": {"role": "model", "parts": [{"text": reply_for(prompt)}]}}]})
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+    
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_stream(self, text, make_event, done=False):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for token in re.findall(r"\S+\s*", text):
+                time.sleep(self.token_delay)
+                self.send_chunk("data: " + json.dumps(make_event(token), ensure_ascii=False) + "\n\n")
+            if done:
+                self.send_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент отменил запрос посреди потока
+            self.close_connection = True
+    
+    def send_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+def reply_for(prompt):
+    return f"Эхо: {prompt}"
+
+def make_server(port=8765, delay=0.0, error_rate=0.0, token_delay=0.02, slow_rate=0.0, slow_delay=0.0, drop_rate=0.0):
+    # Параметры можно менять на ходу: server.RequestHandlerClass.drop_rate = 0.0
+    handler = type("ConfiguredStubHandler", (StubHandler,), {
+        "delay": delay,
+        "error_rate": error_rate,
+        "token_delay": token_delay,
+        "slow_rate": slow_rate,
+        "slow_delay": slow_delay,
+        "drop_rate": drop_rate
+    })
+    return ThreadingHTTPServer(("127.0.0.1", port), handler)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Заглушка облачного LLM для Chai Clone")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.0, help="задержка ответа, сек")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="пауза между токенами потока, сек")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="доля медленных ответов")
+    parser.add_argument("--slow-delay", type=float, default=0.0, help="дополнительная задержка медленного ответа, сек")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="доля оборванных соединений")
+    args = parser.parse_args()
+    
+    server = make_server(args.port, args.delay, args.error_rate, args.token_delay, args.slow_rate, args.slow_delay,
+                         args.drop_rate)
+    print(f"🧪 Заглушка LLM на http://127.0.0.1:{args.port}")
+    server.serve_forever()